@@ -0,0 +1,96 @@
+from __future__ import print_function,division
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from functions import get_liquid_index, get_compound_masks, scale_area, calculate_coverage, calculate_CF, calculate_IFT
+
+# Run by: python benchmarks/bench_kernels.py
+# Times the numerical work of one iteration (area scaling, coverages, coverage factor and both IFTs) for a growing number
+# of compounds. The vectorized kernels have a constant Python overhead, so the time per iteration stays nearly flat, while
+# the earlier kernels, which looped over the compounds and searched liquid_index for every compound, grow quadratically.
+
+R = 8.314*1e-3
+T = 298.15
+
+
+def scale_area_loop(compound_list, AreaAB, AreaBA, N_compounds, scale_water, scale_organic):
+    """ The earlier scale_area, kept as the reference for the benchmark """
+    for i in range(N_compounds):
+        if "h2o" in compound_list[i]:
+            AreaAB[i]*=scale_water
+            AreaBA[i]*=scale_water
+        elif "vacuum" in compound_list[i]:
+            AreaAB[i]=1e1000
+            AreaBA[i]=1e1000
+        else:
+            AreaAB[i]*=scale_organic
+            AreaBA[i]*=scale_organic
+    return AreaAB, AreaBA
+
+
+def calculate_coverage_loop(phase, Gtot, R, T, liquid_index):
+    """ The earlier calculate_coverage, kept as the reference for the benchmark """
+    coverage = np.zeros(len(phase))
+    for i in range(len(phase)):
+        if i in liquid_index:
+            coverage[i] = phase[i]*np.exp(-Gtot[i]/(R*T))
+        else:
+            coverage[i] = 0.0
+    return coverage
+
+
+def iteration(kernels, compound_list, phase1, phase2, coverage, results, liquid_index, masks):
+    """ The kernel calls of one damped iteration of an LL calculation """
+    scale, coverage_function = kernels
+    (GtotAS, GtotSA, AreaAS, AreaSA), (GtotSB, GtotBS, AreaSB, AreaBS) = results
+    N_compounds = len(compound_list)
+    if masks is None:
+        AreaAS, AreaSA = scale(compound_list, np.copy(AreaAS), np.copy(AreaSA), N_compounds, 1.6, 1.0)
+        AreaBS, AreaSB = scale(compound_list, np.copy(AreaBS), np.copy(AreaSB), N_compounds, 1.6, 1.0)
+    else:
+        AreaAS, AreaSA = scale(compound_list, AreaAS, AreaSA, N_compounds, 1.6, 1.0, masks)
+        AreaBS, AreaSB = scale(compound_list, AreaBS, AreaSB, N_compounds, 1.6, 1.0, masks)
+    coverage_new = [coverage_function(phase1, GtotAS, R, T, liquid_index), coverage_function(phase2, GtotBS, R, T, liquid_index)]
+    coverage = calculate_CF(np.copy(coverage), coverage_new, 0.5, 2.0, liquid_index)
+    IFT_A = calculate_IFT(phase1, GtotAS, GtotSA, AreaAS, AreaSA, coverage, R, T, 1.66, "LL", liquid_index, 0.5, 0.5)
+    IFT_B = calculate_IFT(phase2, GtotBS, GtotSB, AreaBS, AreaSB, coverage, R, T, 1.66, "LL", liquid_index, 0.5, 0.5)
+    return coverage, IFT_A, IFT_B
+
+
+def best_time(function, repeats, *args):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+
+def main():
+    random = np.random.RandomState(0)
+    print("{:>10} {:>20} {:>20} {:>12}".format("Compounds", "vectorized [us/it]", "earlier [us/it]", "speed-up"))
+    for N_compounds in [3, 10, 25, 50, 100, 200, 400, 800]:
+        compound_list = ["h2o"] + ["compound_{}".format(i) for i in range(1, N_compounds)]
+        phase1 = random.dirichlet(np.ones(N_compounds))
+        phase2 = random.dirichlet(np.ones(N_compounds))
+        coverage = random.dirichlet(np.ones(N_compounds))
+        results = [(random.uniform(-5, 5, N_compounds), random.uniform(-5, 5, N_compounds),
+                    random.uniform(50, 200, N_compounds), random.uniform(50, 200, N_compounds)) for _ in range(2)]
+        liquid_index, _ = get_liquid_index(phase1, phase2, "LL")
+        liquid_list = list(range(N_compounds))  # The earlier get_liquid_index returned a list
+        masks = get_compound_masks(compound_list)
+
+        new = iteration((scale_area, calculate_coverage), compound_list, phase1, phase2, coverage, results, liquid_index, masks)
+        old = iteration((scale_area_loop, calculate_coverage_loop), compound_list, phase1, phase2, coverage, results, liquid_list, None)
+        assert np.allclose(new[0], old[0]) and np.isclose(new[1], old[1]) and np.isclose(new[2], old[2])
+
+        t_new = best_time(iteration, 50, (scale_area, calculate_coverage), compound_list, phase1, phase2, coverage, results, liquid_index, masks)
+        t_old = best_time(iteration, 3 if N_compounds > 200 else 20, (scale_area_loop, calculate_coverage_loop), compound_list,
+                          phase1, phase2, coverage, results, liquid_list, None)
+        print("{:>10} {:>20.1f} {:>20.1f} {:>11.1f}x".format(N_compounds, 1e6*t_new, 1e6*t_old, t_old/t_new))
+
+
+if __name__ == "__main__":
+    main()
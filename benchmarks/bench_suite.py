@@ -0,0 +1,221 @@
+from __future__ import print_function,division
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from run_multi_L_phases import calculate_interfaces
+from run_liquid_solid import calculate_interface_IFTs
+from input_deck import InputDeck
+from solver_backends import SyntheticBackend
+
+# Run by: python benchmarks/bench_suite.py [--latency 0.0] [--compounds 2,10,50,200] [--save] [--baseline file]
+# Runs the IFT calculation for LL, LS, SL, LG and GL systems and the multi-phase and contact angle drivers against the
+# SyntheticBackend, and reports iterations to convergence, solver calls, wall time and peak memory for every case.
+# The results are compared to the stored baseline and the script exits with status 1 if a case got worse:
+# more iterations or solver calls than the baseline, or peak memory above the baseline and its tolerance. The wall time
+# depends on the machine and its load, so it is only reported relative to the baseline and never fails a case.
+# --save stores the results as the new baseline. Peak memory is the peak of the Python allocations (tracemalloc) of
+# this process; the workers of the drivers are not included.
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+header = "ctd = BP_TZVP_C30_1601.ctd cdir = \"C:\\COSMO\\CTDATA-FILES\" ldir = \"C:\\COSMO\\licensefiles\"\nunit=si notempty wtln ehfile\n!! generated by bench_suite.py !!\n"
+
+
+class CountingBackend(object):
+    """ Counts the solver calls of a backend, also from worker processes, by appending a byte per call to a file
+
+    Args:
+        backend: The backend doing the calculations
+        counter_file: The file the calls are counted in, as a string
+    """
+    def __init__(self, backend, counter_file):
+        self.backend = backend
+        self.counter_file = counter_file
+
+    @property
+    def cache_tag(self):
+        return self.backend.cache_tag
+
+    def _count(self, N_calls):
+        with open(self.counter_file, "ab") as file:
+            file.write(b"x"*N_calls)
+
+    def run_lle(self, input_file_name, N_compounds):
+        self._count(1)
+        return self.backend.run_lle(input_file_name, N_compounds)
+
+    def evaluate(self, jobs):
+        self._count(len(jobs))
+        return self.backend.evaluate(jobs)
+
+    def close(self):
+        return self.backend.close()
+
+    def N_calls(self):
+        return os.path.getsize(self.counter_file) if os.path.exists(self.counter_file) else 0
+
+
+def system_phases(N_compounds, phase_types, random):
+    """ Deterministic phases for a system, h2o is the first compound and the solid or gas the last
+
+    Args:
+        N_compounds: The number of compounds as an integer
+        phase_types: The phase types of the input file, e.g. "LL", "LS", "LLL" or "WOS"
+        random: The np.random.RandomState
+
+    Return:
+        phases: The phases in the order of phase_types as a list of np.arrays
+    """
+    N_liquid = N_compounds if set(phase_types) == set("L") else N_compounds-1
+    phases = []
+    for k, phase_type in enumerate(phase_types):
+        phase = np.zeros(N_compounds)
+        if phase_type in "SG":
+            phase[-1] = 1.0
+        elif N_liquid == 1:
+            phase[0] = 1.0
+        else:
+            water = [0.9, 0.02, 0.3][k % 3] if phase_type != "O" else 0.02
+            phase[0] = water
+            phase[1:N_liquid] = np.maximum((1-water)*random.dirichlet(np.ones(N_liquid-1)), 1e-6)
+        phases.append(np.round(phase, 6))
+    return phases
+
+
+def write_system(file_name, N_compounds, phase_types, seed = 0):
+    """ Write a COSMOtherm input file for a synthetic system
+
+    Args:
+        file_name: The input file name without extension as a string
+        N_compounds: The number of compounds as an integer
+        phase_types: The phase types of the input file, e.g. "LL", "LS", "LLL" or "WOS"
+        seed: The seed of the phase compositions, default = 0
+
+    Return:
+        None
+    """
+    phases = system_phases(N_compounds, phase_types, np.random.RandomState(seed+N_compounds))
+    text = header + "f = h2o.cosmo fdir=\"C:\\COSMO\\DB\" VPfile\n"
+    for i in range(1, N_compounds):
+        name = "gas_{}".format(i) if i == N_compounds-1 and "G" in phase_types else "compound_{}".format(i)
+        text += "f = {0}_c0.cosmo fdir=\"C:\\COSMO\\DB\" Comp = {0} VPfile\n".format(name)
+    text += "tk=298.15 liq_ex={}".format(len(phases))
+    for k, phase in enumerate(phases):
+        text += " x{}={{{}}}".format(k+1, " ".join(str(value) for value in phase))
+    with open(file_name+".inp", "w") as file:
+        file.write(text+"\n")
+
+
+def run_case(case, directory, latency):
+    """ Run one benchmark case
+
+    Args:
+        case: (kind, phase types, number of compounds) as a tuple, kind is "single", "multi" or "contact"
+        directory: The directory for the input files as a string
+        latency: The latency of the SyntheticBackend in seconds as a float
+
+    Return:
+        result: iterations, calls, wall time and peak memory as a dict
+    """
+    kind, phase_types, N_compounds = case
+    name = os.path.join(directory, "{}_{}_{}".format(kind, phase_types, N_compounds))
+    write_system(name, N_compounds, "WOS" if kind == "contact" else phase_types)
+    backend = CountingBackend(SyntheticBackend(latency = latency), name+"_calls")
+    iterations = None
+    tracemalloc.start()
+    start = time.perf_counter()
+    if kind == "single":
+        _, IFT, details = calculate_IFT_tot_and_coverage(name+".inp", phase_types, "", backend = backend, print_statements = False,
+                                                         save_output_file = False, return_details = True)
+        iterations = details["iterations"]
+    elif kind == "multi":
+        _, IFT, _ = calculate_interfaces(name, phase_types, backend, print_statements = False)
+        IFT = float(np.sum(IFT))
+    else:
+        IFT = float(np.sum(calculate_interface_IFTs(InputDeck.read(name), "WOS", name+"_", "", print_statements = False, backend = backend)))
+    wall_time = time.perf_counter()-start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"iterations": iterations, "calls": backend.N_calls(), "wall_time": wall_time, "peak_MB": peak/1024**2, "IFT": IFT}
+
+
+def default_cases(compounds):
+    cases = []
+    for phase_types in ["LL", "LS", "SL", "LG", "GL"]:
+        for N_compounds in compounds:
+            cases.append(("single", phase_types, N_compounds))
+    for N_compounds in compounds:
+        if N_compounds >= 3:
+            cases.append(("multi", "LLL", N_compounds))
+            cases.append(("contact", "WOS", N_compounds))
+    return cases
+
+
+def compare(result, baseline, memory_tolerance):
+    """ The ways result is worse than baseline as a list of strings, the wall time is not compared """
+    problems = []
+    for key in ["iterations", "calls"]:
+        if baseline.get(key) is not None and result[key] is not None and result[key] > baseline[key]:
+            problems.append("{} {} > {}".format(key, result[key], baseline[key]))
+    if result["peak_MB"] > baseline["peak_MB"]*(1+memory_tolerance) + 1.0:
+        problems.append("peak memory {:.1f} MB > {:.1f} MB".format(result["peak_MB"], baseline["peak_MB"]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "IFT benchmark suite on the synthetic backend")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Wall time of every synthetic solver call in seconds")
+    parser.add_argument("--compounds", default = "2,10,50,200", help = "Comma separated numbers of compounds")
+    parser.add_argument("--baseline", default = default_baseline, help = "The baseline file")
+    parser.add_argument("--save", action = "store_true", help = "Store the results as the new baseline")
+    parser.add_argument("--memory_tolerance", type = float, default = 0.25, help = "Allowed relative increase of the peak memory")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            stored = json.load(file)
+        if stored.get("latency") == args.latency:
+            baseline = stored["cases"]
+        else:
+            print("The baseline was made with latency {}, not comparing".format(stored.get("latency")))
+
+    directory = tempfile.mkdtemp(prefix = "ift_bench_")
+    results = {}
+    regressions = 0
+    print("{:<22} {:>10} {:>7} {:>12} {:>10}  {}".format("Case", "Iterations", "Calls", "Wall [s]", "Peak [MB]", "Baseline"))
+    try:
+        for case in default_cases([int(N) for N in args.compounds.split(",")]):
+            key = "{} {} {}".format(*case)
+            results[key] = run_case(case, directory, args.latency)
+            result = results[key]
+            status = ""
+            if key in baseline:
+                problems = compare(result, baseline[key], args.memory_tolerance)
+                status = "ok" if problems == [] else "REGRESSION: " + ", ".join(problems)
+                if baseline[key]["wall_time"] > 0.0:
+                    status += " (wall time {:.2f}x)".format(result["wall_time"]/baseline[key]["wall_time"])
+                regressions += problems != []
+            print("{:<22} {:>10} {:>7} {:>12.3f} {:>10.2f}  {}".format(key, "-" if result["iterations"] is None else result["iterations"],
+                                                                    result["calls"], result["wall_time"], result["peak_MB"], status))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump({"latency": args.latency, "cases": results}, file, indent = 1, sort_keys = True)
+        print("Saved the baseline to {}".format(args.baseline))
+    if regressions:
+        print("{} case(s) regressed".format(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+from __future__ import print_function,division
+import os
+import sys
+import re
+import time
+import shutil
+import tempfile
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from functions import get_Gtot_and_Area, get_comp_and_phases_for_LL
+from solver_backends import write_synthetic_flatsurf_tab, write_synthetic_lle_tab
+
+# Run by: python benchmarks/bench_tab_parser.py
+# Times the .tab parsers for a growing number of compounds. The time per compound should stay flat (linear scaling),
+# while the earlier parser, which re-ran the regex over the whole file for every compound, grows with the compound count.
+
+
+def get_Gtot_and_Area_quadratic(input_file_name, N_compounds):
+    """ The earlier parser, kept as the reference for the benchmark """
+    GtotAB, GtotBA, AreaAB, AreaBA = [], [], [], []
+    with open(input_file_name+".tab","r") as file:
+        text = file.read()
+        for i in range(N_compounds):
+            obj_ABtab = re.findall(r"(?:[-+]?\d*\.\d*\s*){4,}", text)
+            GtotAB.append(float(obj_ABtab[i].split()[1]))
+            GtotBA.append(float(obj_ABtab[i+N_compounds].split()[1]))
+            AreaAB.append(float(obj_ABtab[i].split()[2]))
+            AreaBA.append(float(obj_ABtab[i+N_compounds].split()[2]))
+    return np.array(GtotAB), np.array(GtotBA), np.array(AreaAB), np.array(AreaBA)
+
+
+def best_time(function, repeats, *args):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        print("{:>10} {:>18} {:>18} {:>18} {:>18}".format("Compounds", "flatsurf [us/comp]", "earlier [us/comp]", "LLE [us/comp]", "speed-up"))
+        for N_compounds in [10, 25, 50, 100, 200, 400, 800]:
+            name = os.path.join(directory, "flatsurf{}".format(N_compounds))
+            compound_list = ["compound_{}".format(i) for i in range(N_compounds)]
+            values = [np.linspace(-10, 10, N_compounds), np.linspace(10, -10, N_compounds), 
+                      np.linspace(0.5, 2, N_compounds), np.linspace(2, 0.5, N_compounds)]
+            write_synthetic_flatsurf_tab(name, compound_list, *values)
+            write_synthetic_lle_tab(name+"_lle", compound_list, [np.full(N_compounds, 1./N_compounds)]*3)
+            new = get_Gtot_and_Area(name, N_compounds)
+            assert all(np.allclose(a, b) for a, b in zip(new, get_Gtot_and_Area_quadratic(name, N_compounds)))
+            repeats = 20
+            t_new = best_time(get_Gtot_and_Area, repeats, name, N_compounds)
+            t_old = best_time(get_Gtot_and_Area_quadratic, 3 if N_compounds > 200 else repeats, name, N_compounds)
+            t_lle = best_time(get_comp_and_phases_for_LL, repeats, name+"_lle", N_compounds)
+            print("{:>10} {:>18.2f} {:>18.2f} {:>18.2f} {:>17.1f}x".format(N_compounds, 1e6*t_new/N_compounds, 1e6*t_old/N_compounds,
+                                                                          1e6*t_lle/N_compounds, t_old/t_new))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
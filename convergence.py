@@ -0,0 +1,325 @@
+from __future__ import print_function,division
+import numpy as np
+
+# This document includes the accelerated update schemes for the coupled coverage/IFT iteration.
+# The damped fixed-point updates (calculate_CF and calculate_IFT_damping) in functions.py remain the default and the fallback.
+
+IFT_scale = 10.  # IFT is divided by this in the joint state vector, so it weighs about the same as log(coverage)
+
+
+class AndersonMixer(object):
+    """ Anderson mixing for a fixed-point problem x = g(x)
+
+    Args:
+        history: The number of earlier iterations used in the mixing, default = 5
+        beta: The mixing parameter as a float or an array with one value per unknown, 1.0 is an undamped step, default = 0.5
+        regularization: Tikhonov regularization of the least squares problem, default = 1e-10
+    """
+    def __init__(self, history = 5, beta = 0.5, regularization = 1e-10):
+        self.history = history
+        self.beta = beta
+        self.regularization = regularization
+        self.reset()
+
+    def reset(self):
+        """ Forget the stored iterations """
+        self.x_list = []
+        self.f_list = []
+
+    def update(self, x, g):
+        """ Calculate the next iterate from the current iterate and its image
+
+        Args:
+            x: The current iterate as an array
+            g: g(x) as an array
+
+        Return:
+            x_new: The mixed next iterate as an array
+        """
+        f = g - x
+        self.x_list.append(np.copy(x))
+        self.f_list.append(f)
+        if len(self.x_list) > self.history+1:
+            self.x_list.pop(0)
+            self.f_list.pop(0)
+        if len(self.x_list) < 2:
+            return x + self.beta*f
+        dX = np.diff(np.array(self.x_list), axis=0)  # (m, n)
+        dF = np.diff(np.array(self.f_list), axis=0)
+        # Least squares: min |f - dF.T gamma|
+        A = np.dot(dF, dF.T) + self.regularization*np.eye(len(dF))
+        gamma = np.linalg.solve(A, np.dot(dF, f))
+        return x + self.beta*f - np.dot((dX + self.beta*dF).T, gamma)
+
+
+def pack_state(coverage, IFT_A, IFT_B, liquid_index):
+    """ Join log(coverage) of the liquid compounds and the scaled IFTs into one vector
+
+    Args:
+        coverage: Surface coverage as an array
+        IFT_A: IFT between phase 1 and the surface as a float
+        IFT_B: IFT between the surface and phase 2 as a float
+        liquid_index: The index for the liquid phase, if a solid phase is present
+
+    Return:
+        x: The joint state as an array
+    """
+    return np.concatenate((np.log(coverage[liquid_index]), [IFT_A/IFT_scale, IFT_B/IFT_scale]))
+
+
+def unpack_state(x, coverage, liquid_index):
+    """ Split a joint state vector into a normalized coverage and the two IFTs
+
+    Args:
+        x: The joint state as an array
+        coverage: Surface coverage as an array, used for the shape and the non-liquid compounds
+        liquid_index: The index for the liquid phase, if a solid phase is present
+
+    Return:
+        coverage: Surface coverage as a new array
+        IFT_A: IFT between phase 1 and the surface as a float
+        IFT_B: IFT between the surface and phase 2 as a float
+    """
+    coverage = np.copy(coverage)
+    log_coverage = x[:-2]
+    coverage[liquid_index] = np.exp(log_coverage-np.max(log_coverage))
+    coverage /= np.sum(coverage)
+    return coverage, x[-2]*IFT_scale, x[-1]*IFT_scale
+
+
+def anderson_step(mixer, coverage, IFT_A_value, IFT_B_value, coverage_target, IFT_A, IFT_B, liquid_index, max_CF, IFT_max_diff,
+                  coverage_damping, IFT_damping):
+    """ Take an Anderson mixed step of the joint (coverage, IFT_A, IFT_B) state
+
+    The mixing parameter of the coverage is coverage_damping and that of the IFTs IFT_damping, so the first step after
+    a restart is the damped step. The step is limited by max_CF and IFT_max_diff like the damped update and the IFTs
+    are kept at 0.0 or above. If the mixed step is not finite or the residual grew since the previous iteration, the
+    stored history is dropped and None is returned so the damped update is used instead.
+
+    Args:
+        mixer: The AndersonMixer of the calculation
+        coverage: The current surface coverage as an array
+        IFT_A_value: The current IFT between phase 1 and the surface as a float
+        IFT_B_value: The current IFT between the surface and phase 2 as a float
+        coverage_target: The coverage the flatsurf results point to (an undamped calculate_CF step) as an array
+        IFT_A: IFT_A calculated from coverage_target as a float
+        IFT_B: IFT_B calculated from coverage_target as a float
+        liquid_index: The index for the liquid phase, if a solid phase is present
+        max_CF: The maximum allowed step length for the coverage per iteration
+        IFT_max_diff: The maximum step length of the IFT per iteration
+        coverage_damping: The coverage damping as a float
+        IFT_damping: The IFT damping as a float
+
+    Return:
+        None if the step is rejected, else
+        coverage: The new surface coverage as an array
+        IFT_A_value: The new IFT_A value as a float
+        IFT_B_value: The new IFT_B value as a float
+    """
+    x = pack_state(coverage, IFT_A_value, IFT_B_value, liquid_index)
+    g = pack_state(coverage_target, IFT_A, IFT_B, liquid_index)
+    residual = np.linalg.norm(g-x)
+    if mixer.f_list and residual > np.linalg.norm(mixer.f_list[-1]):
+        mixer.reset()
+        return None
+    if np.max(np.abs(g[:-2]-x[:-2])) > np.log(max_CF):  # The damped step is limited by max_CF, far from the solution
+        mixer.reset()
+        return None
+    mixer.beta = np.concatenate((np.full(len(x)-2, coverage_damping), [IFT_damping, IFT_damping]))
+    x_new = mixer.update(x, g)
+    if not np.all(np.isfinite(x_new)):
+        mixer.reset()
+        return None
+    # Limit the step length the same way as the damped update
+    step = x_new - x
+    step[:-2] = np.clip(step[:-2], -np.log(max_CF), np.log(max_CF))
+    step[-2:] = np.clip(step[-2:], -IFT_max_diff/IFT_scale, IFT_max_diff/IFT_scale)
+    x_new = x + step
+    x_new[-2:] = np.maximum(x_new[-2:], 0.0)  # A negative IFT is not physical and leads to the trivial root
+    return unpack_state(x_new, coverage, liquid_index)
+
+
+class StepController(object):
+    """ Adaptive damping from the residual history of the coverage and IFT
+
+    The residuals are the distances from the current iterate to the values the latest flatsurf results point to.
+    Over a window of iterations the controller measures the mean contraction of each residual and how often it reverses
+    direction. Reversing residuals that do not shrink are oscillations, so the damping and max_CF are lowered.
+    Residuals that keep their direction but shrink slowly are stagnation, so the damping and max_CF are raised.
+    After an adjustment the window is cleared, so the next decision is based on iterations with the new settings.
+
+    Args:
+        IFT_damping: The initial IFT damping as a float
+        coverage_damping: The initial coverage damping as a float
+        max_CF: The initial maximum coverage factor as a float
+        window: The number of residuals used for each decision, default = 6
+    """
+    IFT_damping_range = (0.01, 1.0)
+    coverage_damping_range = (0.05, 1.0)
+    max_CF_range = (1.1, 10.0)
+    oscillation_reversals = 0.6  # Fraction of reversing steps above which a non-shrinking residual is oscillating
+    stagnation_reversals = 0.2  # Fraction of reversing steps below which a slowly shrinking residual is stagnating
+    oscillation_contraction = 0.9  # Mean residual ratio per iteration above which the residual is not shrinking
+    stagnation_contraction = 0.6  # Mean residual ratio per iteration above which the residual shrinks too slowly
+
+    def __init__(self, IFT_damping, coverage_damping, max_CF, window = 6):
+        self.IFT_damping = IFT_damping
+        self.coverage_damping = coverage_damping
+        self.max_CF = max_CF
+        self.window = window
+        self.IFT_residuals = []
+        self.coverage_residuals = []
+
+    def _statistics(self, residuals):
+        """ Mean contraction ratio and fraction of reversals of a list of residual vectors """
+        norms = np.array([np.linalg.norm(r) for r in residuals])
+        if np.any(norms == 0.0):
+            return 0.0, 0.0
+        contraction = np.exp(np.mean(np.log(norms[1:]/norms[:-1])))
+        reversals = np.mean([np.dot(residuals[k], residuals[k-1]) < 0.0 for k in range(1, len(residuals))])
+        return contraction, reversals
+
+    def _classify(self, residuals):
+        contraction, reversals = self._statistics(residuals)
+        if reversals >= self.oscillation_reversals and contraction > self.oscillation_contraction:
+            return "oscillation"
+        if reversals <= self.stagnation_reversals and contraction > self.stagnation_contraction:
+            return "stagnation"
+        return None
+
+    def update(self, coverage_residual, IFT_residual):
+        """ Add the residuals of an iteration and adjust the damping if needed
+
+        Args:
+            coverage_residual: log(coverage_target/coverage) of the liquid compounds as an array
+            IFT_residual: The signed change the flatsurf results ask for in IFT_A and IFT_B as an array
+
+        Return:
+            message: Description of the change as a string, or None if nothing was changed
+        """
+        self.coverage_residuals.append(np.atleast_1d(np.asarray(coverage_residual, dtype=float)))
+        self.IFT_residuals.append(np.atleast_1d(np.asarray(IFT_residual, dtype=float)))
+        if len(self.IFT_residuals) < self.window:
+            return None
+        self.IFT_residuals = self.IFT_residuals[-self.window:]
+        self.coverage_residuals = self.coverage_residuals[-self.window:]
+
+        messages = []
+        IFT_state = self._classify(self.IFT_residuals)
+        if IFT_state is not None:
+            factor = 0.5 if IFT_state == "oscillation" else 1.5
+            IFT_damping = float(np.clip(self.IFT_damping*factor, *self.IFT_damping_range))
+            if IFT_damping != self.IFT_damping:
+                messages.append("IFT {} detected, changed the IFT_damping from {:.4g} to {:.4g}".format(IFT_state, self.IFT_damping, IFT_damping))
+                self.IFT_damping = IFT_damping
+        coverage_state = self._classify(self.coverage_residuals)
+        if coverage_state is not None:
+            factor = 0.7 if coverage_state == "oscillation" else 1.4
+            coverage_damping = float(np.clip(self.coverage_damping*factor, *self.coverage_damping_range))
+            max_CF = float(np.clip(self.max_CF**factor, *self.max_CF_range))
+            if coverage_damping != self.coverage_damping or max_CF != self.max_CF:
+                messages.append("Coverage {} detected, changed the coverage_damping from {:.4g} to {:.4g} and max_CF from {:.4g} to {:.4g}".format(
+                    coverage_state, self.coverage_damping, coverage_damping, self.max_CF, max_CF))
+                self.coverage_damping = coverage_damping
+                self.max_CF = max_CF
+        if messages:  # Judge the new settings on their own iterations
+            self.IFT_residuals = []
+            self.coverage_residuals = []
+            return "\n".join(messages)
+        return None
+
+
+class NewtonKrylovSolver(object):
+    """ Newton steps for the fixed-point problem x = g(x) from finite-difference Jacobian probes
+
+    The residual is F(x) = g(x) - x. Its Jacobian is probed along a set of directions, J v ~ (F(x + h v) - F(x))/h,
+    and the step s solves min |F(x) + J V a| with s = V a. With as many probes as unknowns V is the identity (a full
+    Newton step), with fewer probes V spans F(x), the earlier steps and the unknowns with the largest residuals, like a
+    Krylov subspace. The probes do not depend on each other, so they are evaluated together and run at the same time.
+    The step is then shortened by a line search, whose trial points are also evaluated together.
+
+    Args:
+        N_probes: The number of Jacobian probes per step, None probes every unknown, default = 3
+        probe_size: The finite-difference step h in the units of the joint state, default = 1e-3
+        history: The number of earlier steps used as probe directions, default = 3
+        line_search: The step fractions tried by the line search, the longest acceptable one is taken, default = (1.0, 0.5, 0.25)
+        sufficient_decrease: Armijo constant, a step fraction t is accepted if |F| drops by at least t*sufficient_decrease*|F|, default = 1e-4
+        regularization: Tikhonov regularization of the least squares problem, default = 1e-10
+        max_residual: Above this residual norm no step is taken, so the damped update brings the iteration closer first, default = 0.2
+        min_residual: Below this residual norm x_new = g(x) without probes, default = 1e-5
+    """
+    def __init__(self, N_probes = 3, probe_size = 1e-3, history = 3, line_search = (1.0, 0.5, 0.25), sufficient_decrease = 1e-4,
+                 regularization = 1e-10, max_residual = 0.2, min_residual = 1e-5):
+        self.N_probes = N_probes
+        self.max_residual = max_residual
+        self.min_residual = min_residual
+        self.probe_size = probe_size
+        self.history = history
+        self.line_search = line_search
+        self.sufficient_decrease = sufficient_decrease
+        self.regularization = regularization
+        self.reset()
+
+    def reset(self):
+        """ Forget the earlier steps """
+        self.steps = []
+
+    def directions(self, f):
+        """ Orthonormal probe directions for the residual f as the columns of an array """
+        n = len(f)
+        if self.N_probes is None or self.N_probes >= n:
+            return np.eye(n)
+        candidates = [f] + self.steps[::-1]
+        candidates += [np.eye(n)[i] for i in np.argsort(-np.abs(f), kind="stable")]
+        V = []
+        for v in candidates:
+            for u in V:  # Gram-Schmidt
+                v = v - np.dot(u, v)*u
+            norm = np.linalg.norm(v)
+            if norm > 1e-8:
+                V.append(v/norm)
+            if len(V) == max(1, self.N_probes):
+                break
+        return np.array(V).T
+
+    def step(self, x, g, evaluate, max_step = None, normalize = None):
+        """ Calculate a Newton step from x and check it with a line search
+
+        Args:
+            x: The current iterate as an array
+            g: g(x) as an array
+            evaluate: A function taking a list of iterates and returning the list of their images g, run at the same time
+            max_step: The largest change of every unknown as an array, default = None (no limit)
+            normalize: A function returning the equivalent normalized iterate, e.g. with the coverage summing to 1,
+                       the line search compares the residuals of normalized iterates, default = None
+
+        Return:
+            None if no step fraction lowers the residual enough, else
+            x_new: The accepted iterate as an array
+            g_new: g(x_new) as an array, None if it was not evaluated
+        """
+        f = g - x
+        residual = np.linalg.norm(f)
+        if residual > self.max_residual:  # Too far from the solution for the linear model
+            return None
+        if residual < self.min_residual:  # Probes cannot resolve the rest, the undamped step is as good
+            return g, None
+        V = self.directions(f)
+        h = self.probe_size
+        probes = [x + h*V[:, k] for k in range(V.shape[1])]
+        JV = np.array([(g_k - x_k - f)/h for x_k, g_k in zip(probes, evaluate(probes))]).T
+        A = np.dot(JV.T, JV) + self.regularization*np.eye(V.shape[1])
+        s = np.dot(V, np.linalg.solve(A, -np.dot(JV.T, f)))
+        if not np.all(np.isfinite(s)):
+            self.reset()
+            return None
+        if max_step is not None:
+            s *= min(1.0, np.min(max_step/np.maximum(np.abs(s), 1e-300)))  # Keep the direction, shorten the step
+        trials = [x + t*s if normalize is None else normalize(x + t*s) for t in self.line_search]
+        for t, x_t, g_t in zip(self.line_search, trials, evaluate(trials)):
+            if np.all(np.isfinite(g_t)) and np.linalg.norm(g_t - x_t) <= (1 - self.sufficient_decrease*t)*residual:
+                self.steps.append(t*s)
+                self.steps = self.steps[-self.history:]
+                return x_t, g_t
+        self.reset()
+        return None
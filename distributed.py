@@ -0,0 +1,459 @@
+from __future__ import print_function,division
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from multiprocessing import Pool
+from solver_backends import SyntheticBackend, FlatsurfJob, write_synthetic_lle_tab
+from solver_orchestrator import ProcessOrchestrator, SolverError, SolverTimeoutError, get_deadline
+from functions import get_Gtot_and_Area, get_comp_and_phases_for_LL, get_user_and_path, parse_address
+from input_deck import InputDeck
+from instrumentation import get_profiler
+
+# This document includes distributed solver execution. A coordinator holds a queue of solver jobs, the rendered COSMOtherm
+# input and what to return. Worker processes on any node connect to the coordinator, pull one job at a time, run it with
+# COSMOtherm (or the synthetic stand-in) and return the parsed Gtot and Area arrays, or the .tab file of an LLE.
+# A job whose worker disconnects, passes the job timeout or fails is given to another worker, up to max_attempts times.
+# DistributedBackend is the solver backend that submits the jobs of a calculation to the coordinator.
+# Run by: python distributed.py coordinator [--address 0.0.0.0:48766] [--max_attempts 3] [--job_timeout seconds]
+#         python distributed.py worker "user_name" [--address host:48766] [--processes N] [--call_timeout seconds]
+#         python distributed.py worker --synthetic latency [--address host:48766] [--processes N]
+#
+# The protocol is one JSON object per line. Both sides start with {"type": "hello", "role": "client" or "worker"}.
+# A client sends {"type": "submit", "jobs": [...]} and gets a {"type": "result", "id": ..., "result": ...} or
+# {"type": "error", "id": ..., "error": ...} for every job. A worker sends {"type": "ready"}, gets {"type": "job", ...} and
+# answers with {"type": "result", "result": ...} or {"type": "error", "error": ...}.
+
+default_address = "127.0.0.1:48766"
+
+
+def _send(connection, message):
+    connection.sendall((json.dumps(message)+"\n").encode("utf-8"))
+
+
+class Coordinator(object):
+    """ The job queue between clients and workers
+
+    Args:
+        max_attempts: The number of workers a job is given to before it fails, default = 3
+        job_timeout: Seconds a worker may take for one job before it is treated as lost, default = None (no limit)
+    """
+    def __init__(self, max_attempts = 3, job_timeout = None):
+        self.max_attempts = max_attempts
+        self.job_timeout = job_timeout
+        self.queue = None
+        self.server = None
+        self.N_workers = 0
+        self.N_done = 0
+        self.N_retried = 0
+
+    async def handle_connection(self, reader, writer):
+        """ Serve a client or a worker, depending on its hello message """
+        lock = asyncio.Lock()
+
+        async def send(message):
+            async with lock:
+                writer.write((json.dumps(message)+"\n").encode("utf-8"))
+                await writer.drain()
+
+        try:
+            hello = json.loads((await reader.readline()).decode("utf-8") or "{}")
+            if hello.get("role") == "worker":
+                await self.serve_worker(reader, send, hello.get("name", ""))
+            elif hello.get("role") == "client":
+                await self.serve_client(reader, send)
+            elif hello.get("type") == "ping":
+                await send({"type": "ok", "queued": self.queue.qsize(), "workers": self.N_workers, "done": self.N_done,
+                            "retried": self.N_retried})
+            elif hello.get("type") == "shutdown":
+                await send({"type": "ok"})
+                self.server.close()
+        except (ConnectionError, OSError, ValueError):
+            pass
+        except asyncio.CancelledError:  # The coordinator shuts down
+            pass
+        finally:
+            writer.close()
+
+    async def serve_client(self, reader, send):
+        """ Queue the jobs of a client, the results are sent by the workers that run them """
+        records = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line.decode("utf-8"))
+                if message.get("type") == "submit":
+                    for job in message["jobs"]:
+                        record = {"job": job, "send": send, "attempts": 0, "cancelled": False}
+                        records.append(record)
+                        self.queue.put_nowait(record)
+        finally:
+            for record in records:  # Jobs of a client that went away are not run
+                record["cancelled"] = True
+
+    async def serve_worker(self, reader, send, name):
+        """ Give jobs to a worker one at a time and forward its results, requeue the job if the worker is lost """
+        self.N_workers += 1
+        record = None
+        try:
+            while True:
+                line = await reader.readline()  # The worker is ready for a job
+                if not line:
+                    break
+                record = await self.queue.get()
+                while record["cancelled"]:
+                    record = await self.queue.get()
+                record["attempts"] += 1
+                await send(dict(record["job"], type="job"))
+                line = await asyncio.wait_for(reader.readline(), self.job_timeout)
+                if not line:
+                    break
+                answer = json.loads(line.decode("utf-8"))
+                if answer.get("type") == "result":
+                    await self._reply(record, {"type": "result", "id": record["job"]["id"], "result": answer["result"]})
+                    self.N_done += 1
+                else:
+                    self._retry(record, "Worker {}: {}".format(name, answer.get("error")))
+                record = None
+        except (asyncio.TimeoutError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.N_workers -= 1
+            if record is not None:  # The worker was lost while running the job
+                self._retry(record, "Worker {} was lost".format(name))
+
+    def _retry(self, record, error):
+        """ Put a failed job back in the queue, or report the error to its client after max_attempts """
+        if record["cancelled"]:
+            return
+        if record["attempts"] < self.max_attempts:
+            self.N_retried += 1
+            self.queue.put_nowait(record)
+        else:
+            asyncio.ensure_future(self._reply(record, {"type": "error", "id": record["job"]["id"],
+                                                       "error": "{} after {} attempt(s)".format(error, record["attempts"])}))
+
+    async def _reply(self, record, message):
+        try:
+            await record["send"](message)
+        except (ConnectionError, OSError):  # The client went away
+            record["cancelled"] = True
+
+    async def serve(self, address = default_address, print_statements = True):
+        """ Serve clients and workers on address until a shutdown request
+
+        Args:
+            address: "host:port" or a port number as a string, default = default_address
+            print_statements: Print where the coordinator listens, boolean, default = True
+
+        Return:
+            None
+        """
+        self.queue = asyncio.Queue()
+        host, port = parse_address(address)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        if print_statements:
+            print("Coordinator listening on {}".format(address))
+            sys.stdout.flush()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:  # Closed by a shutdown request
+                pass
+
+
+def run_job(job, scratch_path, COSMOtherm_path = None, latency = 0.0, orchestrator = None):
+    """ Run one job of the coordinator on this node
+
+    Args:
+        job: The job message as a dict with kind ("flatsurf" or "lle"), name, input and N_compounds, and phase1, phase2, T
+             and IFT for a flatsurf job
+        scratch_path: The directory for the input and .tab files as a string
+        COSMOtherm_path: Path to the COSMOtherm executable, default = None uses the SyntheticBackend
+        latency: The latency of the SyntheticBackend in seconds, default = 0.0
+        orchestrator: The ProcessOrchestrator of the worker that runs COSMOtherm, default = None creates one for this job
+
+    Return:
+        result: [GtotAB, GtotBA, AreaAB, AreaBA] as lists for a flatsurf job or the .tab file as a string for an LLE
+    """
+    file_name = os.path.join(scratch_path, os.path.basename(job["name"]))
+    with open(file_name+".inp", "w") as file:
+        file.write(job["input"])
+    if COSMOtherm_path is not None:
+        if orchestrator is None:
+            orchestrator = ProcessOrchestrator()
+            try:
+                orchestrator.run([[COSMOtherm_path, file_name+".inp"]])
+            finally:
+                orchestrator.close()
+        else:
+            orchestrator.run([[COSMOtherm_path, file_name+".inp"]])
+        if job["kind"] == "flatsurf":
+            result = get_Gtot_and_Area(file_name, job["N_compounds"])
+    else:
+        deck = InputDeck(job["input"], file_name)
+        if job["kind"] == "flatsurf":
+            backend = SyntheticBackend(latency = latency, write_files = False)
+            result, = backend.evaluate([FlatsurfJob(deck, file_name, np.array(job["phase1"]), np.array(job["phase2"]), job["T"],
+                                                    job["IFT"], 0, "", 0.0, job["N_compounds"])])
+        else:
+            time.sleep(latency)
+            write_synthetic_lle_tab(file_name, deck.compound_list, [phase/np.sum(phase) for phase in deck.phases])
+    if job["kind"] == "flatsurf":
+        return [np.asarray(values).tolist() for values in result]
+    with open(file_name+".tab", "r") as file:
+        return file.read()
+
+
+def run_worker(address = default_address, COSMOtherm_path = None, latency = 0.0, call_timeout = None, connect_attempts = 20):
+    """ Pull jobs from the coordinator and run them until the coordinator closes the connection
+
+    Args:
+        address: The address of the coordinator, default = default_address
+        COSMOtherm_path: Path to the COSMOtherm executable, default = None uses the SyntheticBackend
+        latency: The latency of the SyntheticBackend in seconds, default = 0.0
+        call_timeout: Kill a COSMOtherm process after this many seconds, default = None (no limit)
+        connect_attempts: Seconds to wait for the coordinator to start, default = 20
+
+    Return:
+        N_jobs: The number of jobs run as an integer
+    """
+    for attempt in range(connect_attempts):
+        try:
+            connection = socket.create_connection(parse_address(address))
+            break
+        except (ConnectionError, OSError):
+            if attempt == connect_attempts-1:
+                raise
+            time.sleep(1.0)
+    scratch_path = tempfile.mkdtemp(prefix="ift_worker_")
+    orchestrator = ProcessOrchestrator(call_timeout)  # One event loop for all jobs of this worker
+    N_jobs = 0
+    try:
+        with connection, connection.makefile("r", encoding="utf-8") as file:
+            _send(connection, {"type": "hello", "role": "worker", "name": "{}:{}".format(socket.gethostname(), os.getpid())})
+            while True:
+                _send(connection, {"type": "ready"})
+                line = file.readline()
+                if not line:
+                    break
+                job = json.loads(line)
+                try:
+                    answer = {"type": "result", "result": run_job(job, scratch_path, COSMOtherm_path, latency, orchestrator)}
+                except (Exception, SystemExit) as error:
+                    answer = {"type": "error", "error": "{}: {}".format(type(error).__name__, error)}
+                _send(connection, answer)
+                N_jobs += 1
+    except (ConnectionError, OSError):  # The coordinator went away
+        pass
+    finally:
+        orchestrator.close()
+        shutil.rmtree(scratch_path, ignore_errors = True)
+    return N_jobs
+
+
+class DistributedBackend(object):
+    """ Solver backend that runs the LLE and flatsurf calculations on the workers of a coordinator
+
+    The inputs are rendered here, so the workers only need COSMOtherm and the COSMO files at the paths in the input file.
+
+    Args:
+        address: The address of the coordinator, default = default_address
+        cache_tag: Identifies the COSMOtherm version of the workers for the flatsurf cache, default = "distributed"
+    """
+    def __init__(self, address = default_address, cache_tag = "distributed"):
+        self.address = address
+        self.cache_tag = cache_tag
+        self.connection = None
+        self.file = None
+        self.N_submitted = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["connection"] = None  # Every process opens its own connection
+        state["file"] = None
+        return state
+
+    def _submit(self, jobs):
+        """ Send jobs to the coordinator and wait for all results
+
+        Args:
+            jobs: The job messages as a list of dicts
+
+        Return:
+            results: The result of every job in the order of jobs
+        """
+        if self.connection is None:
+            self.connection = socket.create_connection(parse_address(self.address))
+            self.file = self.connection.makefile("r", encoding="utf-8")
+            _send(self.connection, {"type": "hello", "role": "client"})
+        ids = []
+        for job in jobs:
+            self.N_submitted += 1
+            job["id"] = self.N_submitted
+            ids.append(job["id"])
+        results = {}
+        try:
+            _send(self.connection, {"type": "submit", "jobs": jobs})
+            while len(results) < len(jobs):
+                deadline = get_deadline()
+                self.connection.settimeout(None if deadline is None else max(deadline-time.monotonic(), 1e-3))
+                line = self.file.readline()
+                if not line:
+                    raise SolverError("The coordinator at {} closed the connection".format(self.address))
+                message = json.loads(line)
+                if message["id"] not in ids:  # From an earlier call that was interrupted
+                    continue
+                if message["type"] == "error":
+                    raise SolverError("Job {} failed: {}".format(jobs[ids.index(message["id"])]["name"], message["error"]))
+                results[message["id"]] = message["result"]
+        except socket.timeout:
+            self.close()  # The coordinator drops the queued jobs of a closed connection
+            raise SolverTimeoutError("The calculation passed its time limit waiting for the workers")
+        except (SolverError, ConnectionError, OSError):
+            self.close()
+            raise
+        return [results[job_id] for job_id in ids]
+
+    def run_lle(self, input_file_name, N_compounds):
+        """ Run the LLE on a worker and read the two phases from the returned .tab file, see COSMOthermBackend.run_lle """
+        with get_profiler().section("lle"):
+            with open(input_file_name+".inp", "r") as file:
+                text = file.read()
+            tab, = self._submit([{"kind": "lle", "name": os.path.basename(input_file_name), "input": text, "N_compounds": N_compounds}])
+            with open(input_file_name+".tab", "w") as file:
+                file.write(tab)
+        with get_profiler().section("parse"):
+            return get_comp_and_phases_for_LL(input_file_name, N_compounds)
+
+    def evaluate(self, jobs):
+        """ Run a list of flatsurf jobs on the workers, see COSMOthermBackend.evaluate """
+        profiler = get_profiler()
+        with profiler.section("render"):
+            messages = []
+            for job in jobs:
+                messages.append({"kind": "flatsurf", "name": os.path.basename(job.output_file_name), "N_compounds": job.N_compounds,
+                                 "input": job.deck.render_flatsurf(job.phase1, job.phase2, job.T, job.IFT, job.IFT_write_length,
+                                                                   job.phase_types, job.max_depth),
+                                 "phase1": np.asarray(job.phase1).tolist(), "phase2": np.asarray(job.phase2).tolist(),
+                                 "T": job.T, "IFT": job.IFT})
+        with profiler.section("cosmotherm"):
+            results = self._submit(messages)
+        return [tuple(np.array(values) for values in result) for result in results]
+
+    def close(self):
+        """ Close the connection to the coordinator
+
+        Return:
+            teardown_time: Always 0.0
+        """
+        if self.connection is not None:
+            self.file.close()
+            self.connection.close()
+            self.connection = None
+            self.file = None
+        return 0.0
+
+
+def request(message, address = default_address):
+    """ Send {"type": "ping"} or {"type": "shutdown"} to the coordinator and return the answer as a dict """
+    with socket.create_connection(parse_address(address)) as connection, connection.makefile("r", encoding="utf-8") as file:
+        _send(connection, message)
+        return json.loads(file.readline())
+
+
+class LocalCluster(object):
+    """ A coordinator and synthetic workers as local processes, for testing the distributed mode without COSMOtherm
+
+    Args:
+        N_workers: The number of worker processes, default = 2
+        latency: The latency of the synthetic workers in seconds, default = 0.0
+        address: The address of the coordinator, default = None picks a free local port
+        max_attempts: See Coordinator, default = 3
+    """
+    def __init__(self, N_workers = 2, latency = 0.0, address = None, max_attempts = 3):
+        if address is None:
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                address = "127.0.0.1:{}".format(probe.getsockname()[1])
+        self.address = address
+        script = os.path.abspath(__file__)
+        self.coordinator = subprocess.Popen([sys.executable, script, "coordinator", "--address", address,
+                                             "--max_attempts", str(max_attempts)], stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                request({"type": "ping"}, address)
+                break
+            except (ConnectionError, OSError):
+                time.sleep(0.1)
+        self.workers = [subprocess.Popen([sys.executable, script, "worker", "--synthetic", str(latency), "--address", address])
+                        for _ in range(N_workers)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """ Shut down the coordinator, the workers stop when it closes their connections """
+        try:
+            request({"type": "shutdown"}, self.address)
+        except (ConnectionError, OSError):
+            pass
+        for process in self.workers+[self.coordinator]:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Distributed solver execution")
+    commands = parser.add_subparsers(dest = "command")
+    coordinator_parser = commands.add_parser("coordinator", help = "Run the job queue")
+    coordinator_parser.add_argument("--address", default = default_address, help = "host:port to listen on, 0.0.0.0:port for all nodes")
+    coordinator_parser.add_argument("--max_attempts", type = int, default = 3, help = "Workers a job is given to before it fails")
+    coordinator_parser.add_argument("--job_timeout", type = float, default = None, help = "Seconds before a worker is treated as lost")
+    worker_parser = commands.add_parser("worker", help = "Run jobs from the coordinator")
+    worker_parser.add_argument("user", nargs = "?", default = None, help = "The user name of the COSMOtherm path in Users.txt")
+    worker_parser.add_argument("--address", default = default_address, help = "host:port of the coordinator")
+    worker_parser.add_argument("--processes", type = int, default = 1, help = "The number of worker processes on this node")
+    worker_parser.add_argument("--call_timeout", type = float, default = None, help = "Kill a COSMOtherm process after this many seconds")
+    worker_parser.add_argument("--synthetic", type = float, default = None, metavar = "LATENCY",
+                               help = "Run the jobs on the SyntheticBackend with this latency in seconds instead of COSMOtherm")
+    for name in ["ping", "shutdown"]:
+        commands.add_parser(name).add_argument("--address", default = default_address)
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        asyncio.run(Coordinator(args.max_attempts, args.job_timeout).serve(args.address))
+    elif args.command == "worker":
+        if args.synthetic is None and args.user is None:
+            print("Give a user name or --synthetic, run by: python distributed.py worker \"user_name\" [--address host:port]")
+            quit()
+        COSMOtherm_path = get_user_and_path(args.user) if args.synthetic is None else None
+        latency = args.synthetic or 0.0
+        if args.processes > 1:
+            with Pool(args.processes) as pool:
+                pool.starmap(run_worker, [(args.address, COSMOtherm_path, latency, args.call_timeout)]*args.processes)
+        else:
+            run_worker(args.address, COSMOtherm_path, latency, args.call_timeout)
+    elif args.command in ["ping", "shutdown"]:
+        print(json.dumps(request({"type": args.command}, args.address)))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+from __future__ import print_function,division
+import os
+import hashlib
+import tempfile
+import numpy as np
+from instrumentation import get_profiler
+
+# This document includes the on-disk cache of flatsurf results. An entry is keyed by a hash of the rendered flatsurf
+# input, so identical COSMOtherm calls from earlier iterations, runs or batches are only calculated once.
+
+
+def canonical_flatsurf_key(text, cache_tag):
+    """ Hash a rendered flatsurf input, ignoring whitespace differences and !! comment lines
+
+    Args:
+        text: The rendered flatsurf input as a string
+        cache_tag: Identifies the backend that calculates the results, as a string
+
+    Return:
+        key: The sha256 hex digest as a string
+    """
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if line == "" or line.startswith("!!"):
+            continue
+        lines.append(line)
+    return hashlib.sha256((cache_tag+"\n"+"\n".join(lines)).encode("utf-8")).hexdigest()
+
+
+class FlatsurfCache(object):
+    """ Size-bounded, least recently used cache of parsed flatsurf results on disk
+
+    Each entry is an .npz file with GtotAB, GtotBA, AreaAB and AreaBA, written to a temporary file and moved into
+    place, so concurrent readers never see a partial entry. Reading an entry updates its modification time, and when
+    the cache grows beyond max_bytes the least recently used entries are deleted. Several processes can share a cache
+    directory; entries removed by another process are treated as misses.
+
+    Args:
+        directory: The cache directory as a string, created if missing
+        max_bytes: The maximum size of the cache in bytes, default = 1 GB
+    """
+    def __init__(self, directory, max_bytes = 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key+".npz")
+
+    def _entries(self):
+        """ All entries as a list of (path, size, modification time) """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:  # Removed by another process
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        """ Get a cached result
+
+        Args:
+            key: The key from canonical_flatsurf_key as a string
+
+        Return:
+            result: (GtotAB, GtotBA, AreaAB, AreaBA) as a tuple of np.arrays, or None if the key is not cached
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = (data["GtotAB"], data["GtotBA"], data["AreaAB"], data["AreaBA"])
+            os.utime(path, None)  # Mark as recently used
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """ Store a result
+
+        Args:
+            key: The key from canonical_flatsurf_key as a string
+            result: (GtotAB, GtotBA, AreaAB, AreaBA) as a tuple of np.arrays
+
+        Return:
+            None
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # Created by another process
+                pass
+        GtotAB, GtotBA, AreaAB, AreaBA = result
+        handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(file, GtotAB=GtotAB, GtotBA=GtotBA, AreaAB=AreaAB, AreaBA=AreaBA)
+            os.replace(temp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+        return
+
+    def evict(self):
+        """ Delete the least recently used entries until the cache is below 90 % of max_bytes
+
+        Return:
+            None
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for path, entry_size, _ in entries:
+            if size <= 0.9*self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # In use or already removed by another process
+                continue
+            size -= entry_size
+        self._size = size
+        return
+
+
+class CachedBackend(object):
+    """ Solver backend that looks up flatsurf jobs in a FlatsurfCache and only runs the misses
+
+    Args:
+        backend: The solver backend running the flatsurf calculations that are not cached
+        cache: The FlatsurfCache
+    """
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    @property
+    def cache_tag(self):
+        return self.backend.cache_tag
+
+    def run_lle(self, input_file_name, N_compounds):
+        """ Run the LLE with the wrapped backend, see COSMOthermBackend.run_lle """
+        return self.backend.run_lle(input_file_name, N_compounds)
+
+    def evaluate(self, jobs):
+        """ Get the flatsurf results from the cache and calculate the rest with the wrapped backend
+
+        Args:
+            jobs: The flatsurf calculations as a list of FlatsurfJob
+
+        Return:
+            results: (GtotAB, GtotBA, AreaAB, AreaBA) for each job as a list of tuples of np.arrays
+        """
+        profiler = get_profiler()
+        results = [None]*len(jobs)
+        keys = []
+        missing = []
+        with profiler.section("cache"):
+            for i, job in enumerate(jobs):
+                text = job.deck.render_flatsurf(job.phase1, job.phase2, job.T, job.IFT, job.IFT_write_length, job.phase_types, job.max_depth)
+                keys.append(canonical_flatsurf_key(text, self.backend.cache_tag))
+                results[i] = self.cache.get(keys[i])
+                if results[i] is None:
+                    missing.append(i)
+        if missing:
+            calculated = self.backend.evaluate([jobs[i] for i in missing])
+            with profiler.section("cache"):
+                for i, result in zip(missing, calculated):
+                    self.cache.put(keys[i], result)
+                    results[i] = result
+        return results
+
+    def close(self):
+        """ Close the wrapped backend, see COSMOthermBackend.close """
+        return self.backend.close()
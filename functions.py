@@ -1,8 +1,12 @@
 import subprocess
 import sys
 import os
+import mmap
+import shutil
+import tempfile
 import numpy as np
 import re
+from input_deck import InputDeck
 
 # This document includes all the functions called in the IFT calculation script and some called in the run_multi_L_phases support script
 
@@ -15,28 +19,22 @@ def get_liquid_index(phase1, phase2, phase_types):
         phase_types: The types of phase 1 and phase 2
         
     Return:
-        liquid_index: The index for compounds in the liquid phase above 0.0, as a list
-        solid_index: The index for compounds in the solid phase above 0.0, as a list
+        liquid_index: The index for compounds in the liquid phase above 0.0, as an np.array of integers
+        solid_index: The index for compounds in the solid phase above 0.0, as an np.array of integers
     """
-    liquid_index = []
-    solid_index = []
+    liquid_index = np.array([], dtype=int)
+    solid_index = np.array([], dtype=int)
     
     if phase_types == "LL":
-        for i in range(len(phase1)):
-            liquid_index.append(i)
-    
+        liquid_index = np.arange(len(phase1))
     elif phase_types == "SL" or phase_types == "GL":
-        for i in range(len(phase1)):
-            if phase1[i] > 0.0:
-                solid_index.append(i)
-            else:
-                liquid_index.append(i)
+        solid_mask = np.asarray(phase1) > 0.0
+        solid_index = np.flatnonzero(solid_mask)
+        liquid_index = np.flatnonzero(~solid_mask)
     elif phase_types == "LS" or phase_types == "LG":
-        for i in range(len(phase2)):
-            if phase2[i] > 0.0:
-                solid_index.append(i)
-            else:
-                liquid_index.append(i)
+        solid_mask = np.asarray(phase2) > 0.0
+        solid_index = np.flatnonzero(solid_mask)
+        liquid_index = np.flatnonzero(~solid_mask)
     return liquid_index, solid_index
 
 
@@ -98,6 +96,25 @@ def get_user_and_path(user_name):
     return COSMOtherm_path
 
 
+def read_users(users_file = None):
+    """ Read the user names and COSMOtherm paths of Users.txt without prompting, see get_user_and_path
+    
+    Args:
+        users_file: The users file name as a string, default = None uses Users.txt next to this script
+    
+    Return:
+        users: The COSMOtherm path of every user name as a dict
+    """
+    if users_file is None:
+        users_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Users.txt")
+    with open(users_file, "r") as file:
+        text = file.read()
+    users = {}
+    for (u, p) in zip(re.findall(r"[Nn]ame:\ *\w*", text), re.findall(r"[Pp]ath:\ *[\S\ ]*", text)):
+        users[u.split()[1]] = p.split(":", 1)[1].strip()
+    return users
+
+
 def work(cmd):
     """ Run the process for multiprocessing
     
@@ -108,7 +125,139 @@ def work(cmd):
         The process
     """
     return subprocess.call(cmd, shell=False)
+
+
+def create_workspace(input_file_name, scratch_path = None):
+    """ Get the directory for the intermediate files of a calculation
+    
+    Args:
+        input_file_name: The input file name without extension as a string
+        scratch_path: A directory given by the caller, default = None creates a new, unique directory in the temp directory
+    
+    Return:
+        workspace: The directory as a string
+        created: If the directory was created here and should be removed after the calculation, boolean
+    """
+    if scratch_path is not None:
+        if not os.path.exists(scratch_path):
+            os.makedirs(scratch_path)
+        return scratch_path, False
+    prefix = "ift_{}_".format(re.sub(r"[^\w\-]", "_", os.path.basename(input_file_name)))
+    return tempfile.mkdtemp(prefix=prefix), True
+
+
+def close_workspace(workspace, created, archive_path = None):
+    """ Remove the flatsurf files of a calculation or move them to an archive directory
+    
+    Args:
+        workspace: The directory of the intermediate files as a string
+        created: If the directory was created by create_workspace and should be removed, boolean
+        archive_path: Directory to move the flatsurf files to, default = None deletes them
+    
+    Return:
+        None
+    """
+    files = [name for name in os.listdir(workspace) if name.startswith("flatsurf")] if os.path.isdir(workspace) else []
+    if archive_path is not None:
+        if not os.path.exists(archive_path):
+            os.makedirs(archive_path)
+        for name in files:
+            shutil.move(os.path.join(workspace, name), os.path.join(archive_path, name))
+    else:
+        for name in files:
+            os.remove(os.path.join(workspace, name))
+    if created:
+        shutil.rmtree(workspace, ignore_errors = True)
+    return
+
+
+def save_checkpoint(checkpoint_file, state):
+    """ Write the state of an iterative calculation atomically, so a crash never leaves a partial checkpoint
+    
+    Args:
+        checkpoint_file: The checkpoint file name with .npz extension as a string
+        state: Names and values (numbers, strings, lists or np.arrays) as a dict
+    
+    Return:
+        None
+    """
+    directory = os.path.dirname(os.path.abspath(checkpoint_file))
+    handle, temp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez(file, **{name: np.asarray(value) for name, value in state.items()})
+        os.replace(temp_path, checkpoint_file)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return
+
+
+def load_checkpoint(checkpoint_file, compound_list, phase_types, T):
+    """ Read a checkpoint if it belongs to the same system
+    
+    Args:
+        checkpoint_file: The checkpoint file name with .npz extension as a string
+        compound_list: Compound names of the calculation as a list
+        phase_types: The phase types of the calculation as a string
+        T: The temperature of the calculation as a float
+    
+    Return:
+        state: The saved state as a dict of np.arrays and numbers, or None if there is no matching checkpoint
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with np.load(checkpoint_file) as data:
+            state = {name: (data[name][()] if data[name].ndim == 0 else data[name]) for name in data.files}
+    except (IOError, OSError, ValueError):
+        print("Warning: Could not read the checkpoint {}, starting from the beginning.".format(checkpoint_file))
+        return None
+    if list(state["compound_list"]) != list(compound_list) or str(state["phase_types"]) != phase_types or abs(float(state["T"])-T) > 1e-8:
+        print("Warning: The checkpoint {} is from a different system, starting from the beginning.".format(checkpoint_file))
+        return None
+    return state
+
+
+def truncate_output_file(output_file_name, N_lines):
+    """ Keep the first N_lines lines of a text output file, so a resumed calculation does not repeat rows
     
+    Args:
+        output_file_name: The text output file name with extension as a string
+        N_lines: The number of lines kept, the header and one line per checkpointed iteration, as an integer
+    
+    Return:
+        exists: If the file existed, boolean
+    """
+    if not os.path.exists(output_file_name):
+        return False
+    with open(output_file_name, "r") as file:
+        lines = file.readlines()
+    if len(lines) > N_lines:
+        with open(output_file_name, "w") as file:
+            file.writelines(lines[:N_lines])
+    return True
+
+
+def parse_address(address):
+    """ Split an address into a TCP (host, port) or a Unix socket file
+
+    Args:
+        address: "host:port", a port number or a socket file name as a string
+
+    Return:
+        host: The host as a string, None for a Unix socket
+        port: The port as an integer, or the socket file name for a Unix socket
+    """
+    address = str(address)
+    if address.isdigit():
+        return "127.0.0.1", int(address)
+    host, _, port = address.rpartition(":")
+    if host != "" and port.isdigit():
+        return host, int(port)
+    return None, address
+
 
 def change_input_name(name):
     """ Change the input file name from a path or with extension to the name without extension
@@ -131,38 +280,31 @@ def change_input_name(name):
     return name, path
     
     
-def check_units_get_liq_ex(input_file_name):
+def check_units_get_liq_ex(input_file_name, deck = None):
     """ Check if unit=si is present in the .inp file
     
     Args:
         input_file_name: The input file name without extension as a string
+        deck: The parsed input file, default = None reads input_file_name
     
     Return:
         liq_ex: The number of phases in the calculation as an integer
     """
-    with open(input_file_name+".inp","r") as file:
-        text = file.read()
-        if re.findall(r"unit\ *=\ *[sS][iI]", text) == []:
-            print("Warning: unit=si is missing from the input file.")
-        if len(re.findall(r"unit", text)) > 1:
-            print("Warning: Multiple instances of unit in the input file, COSMOtherm might not use the correct units.")
-    # Find number of liquid extractions
-    with open(input_file_name+".inp","r") as file:
-        text = file.read()
-        # N compounds
-        obj_comp = re.findall(r"\{(?:\d*\.\d*[\ ,\}]*)+", text)  # Find first { with numbers behind it
-        N_compounds = len(obj_comp[0].split())  # Numbers in the {} in the file
-        # Find number of liquid extractions
-        obj_inp = re.findall(r"liq_ex=\d", text)
-        liq_ex = int(obj_inp[0][-1])
-    return liq_ex
+    if deck is None:
+        deck = InputDeck.read(input_file_name)
+    if not deck.unit_si:
+        print("Warning: unit=si is missing from the input file.")
+    if deck.N_unit > 1:
+        print("Warning: Multiple instances of unit in the input file, COSMOtherm might not use the correct units.")
+    return deck.liq_ex
     
     
-def check_parameterization(input_file_name):
+def check_parameterization(input_file_name, deck = None):
     """ Check parameterization between the water parameterization and the .inp file
     
     Args:
         input_file_name: The input file name without extension as a string
+        deck: The parsed input file, default = None reads input_file_name
     
     Return:
         scale_water: Water scaling parameter as a float
@@ -173,17 +315,16 @@ def check_parameterization(input_file_name):
     parameterization = [1/0.625, 1/0.25475*0.43061, 1/0.26753*0.43061, 1/0.25*0.43061,
         1/0.26697*0.43061, 1/0.2641*0.43061, 1.0, 1.0, 1.0, 1/0.31733*0.43061, 1/0.28649*0.43061, 
         "add_parameterization_here"]
-    with open(input_file_name+".inp","r") as file:
-        text = file.read()
-        para_obj = re.findall("ctd\ *=\ *\w*", text)
-        para = para_obj[0].split()[2]
-        if para in parameter:
-            index = parameter.index(para)
-            scale_water = parameterization[index]
-        else:
-            print("Warning: No matching parameterization found.\
-            \nGo to check_parameterization to add new parameterizations.")
-            quit()
+    if deck is None:
+        deck = InputDeck.read(input_file_name)
+    para = deck.parameterization
+    if para in parameter:
+        index = parameter.index(para)
+        scale_water = parameterization[index]
+    else:
+        print("Warning: No matching parameterization found.\
+        \nGo to check_parameterization to add new parameterizations.")
+        quit()
     return scale_water, parameter[index]
 
     
@@ -231,33 +372,111 @@ def check_phase_types(types, N_phases):
     return types_formated
 
 
-def get_N_compounds_and_T(input_file_name):
+def get_N_compounds_and_T(input_file_name, deck = None):
     """ Extract data from the .inp file
     
     Args:
         input_file_name: Filename as a string
+        deck: The parsed input file, default = None reads input_file_name
     
     Return:
         N_compounds: Number of compounds as a float
         T: Temperature as floats
     """
-    # Implement Fahrenheit
-    with open(input_file_name+".inp","r") as file:
-        text = file.read()
-        
-        T_obj = re.findall(r"t[ckF]=[0-9]+\.*[0-9]*", text)  # Find tc=, tk= or tF=
-        T_list = T_obj[0].split("=")
-        if T_list[0] == "tc":
-            T = float(T_list[1])+273.15  # From Celsius to Kelvin
-        elif T_list[0] == "tF":
-            T = (float(T_list[1])-32)*(5/9) + 273.15  # From Fahrenheit to Kelvin
+    if deck is None:
+        deck = InputDeck.read(input_file_name)
+    return deck.N_compounds, deck.T
+
+    
+def iter_lines(file_name, mmap_threshold = 1<<20):
+    """ Read the lines of a text file one at a time, through mmap for large files
+    
+    Args:
+        file_name: The file name with extension as a string
+        mmap_threshold: Files of at least this many bytes are memory mapped, default = 1 MB
+    
+    Return:
+        A generator of the lines as strings
+    """
+    with open(file_name, "rb") as file:
+        if os.path.getsize(file_name) < mmap_threshold:
+            for line in file:
+                yield line.decode("latin-1")
         else:
-            T = float(T_list[1]) 
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                line = mapped.readline()
+                while line:
+                    yield line.decode("latin-1")
+                    line = mapped.readline()
+            finally:
+                mapped.close()
+
+
+def _last_lines(data, N_lines):
+    """ The last N_lines lines of the bytes data as strings, after dropping the empty lines at its end """
+    lines = data.splitlines()
+    while lines and lines[-1].strip() == b"":
+        lines.pop()
+    return [line.decode("latin-1") for line in lines[-N_lines:]]
+
+
+def read_last_lines(file_name, N_lines, mmap_threshold = 1<<20):
+    """ Read the last lines of a text file, searching backwards through mmap for large files
+    
+    Empty lines at the end of the file are skipped, so both ways of reading give the same lines.
+    
+    Args:
+        file_name: The file name with extension as a string
+        N_lines: The number of lines to read as an integer
+        mmap_threshold: Files of at least this many bytes are memory mapped, default = 1 MB
+    
+    Return:
+        lines: The last N_lines lines as a list of strings
+    """
+    with open(file_name, "rb") as file:
+        if os.path.getsize(file_name) < mmap_threshold:
+            return _last_lines(file.read(), N_lines)
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end = len(mapped)
+            while end > 0 and mapped[end-1] in b" \t\r\n":  # Skip the empty lines at the end
+                end -= 1
+            start = end
+            for _ in range(N_lines):
+                start = mapped.rfind(b"\n", 0, start)
+                if start < 0:
+                    start = 0
+                    break
+            return _last_lines(mapped[start:end], N_lines)
+        finally:
+            mapped.close()
 
-        obj_comp = re.findall(r"[^w]\d\ *=\ *\{[\d \. \ * e \-]*", text)  # Find first { with numbers behind it
-        N_compounds = len(obj_comp[0].split())  # Numbers in the {} in the file
 
-    return N_compounds, T
+def get_phases_from_tab(input_file_name, N_compounds):
+    """ Extract the compounds and all phase compositions from the .tab file of an LLE calculation
+    
+    Args:
+        input_file_name: The input file name without extension as a string
+        N_compounds: The number of compounds in the system as an integer
+        
+    Return:
+        compound_list: Compound names as a list
+        phases: The phase_n_x columns in order as a list of np.arrays of floats
+    """
+    lines = read_last_lines(input_file_name+".tab", N_compounds+1)
+    header = lines[0].split()
+    # Find the index of the phase_n_x columns and use those indices to get the values in their columns
+    phase_columns = sorted((int(name.split("_")[1]), index) for index, name in enumerate(header) 
+                           if re.match(r"phase_\d+_x$", name))
+    compound_list = []
+    phases = np.empty((len(phase_columns), N_compounds))
+    for i, line in enumerate(lines[1:]):
+        split = line.split()
+        compound_list.append(split[1].strip("\""))
+        for j, (_, index) in enumerate(phase_columns):
+            phases[j, i] = float(split[index])
+    return compound_list, list(phases)
 
     
 def get_comp_and_phases_for_LL(input_file_name, N_compounds):
@@ -272,66 +491,48 @@ def get_comp_and_phases_for_LL(input_file_name, N_compounds):
         phase1: Phase 1 as a np.array of floats
         phase2: Phase 2 as a np.array of floats
     """
-    # Use Re? Return phases as a list and combine the two functions
-    compound_list = []
-    phase1 = []
-    phase2 = []
-    
-    with open(input_file_name+".tab","r") as file:
-        lines = file.readlines()
-
-        # Find the index of phase_1_x and phase_2_x and use that index to get the values in their columns
-        index1 = lines[-1-N_compounds].split().index("phase_1_x")
-        index2 = lines[-1-N_compounds].split().index("phase_2_x")
-        for i in range(-N_compounds,0,1):
-            compound_list.append(lines[i].split()[1].strip("\""))
-            phase1.append(float(lines[i].split()[index1]))
-            phase2.append(float(lines[i].split()[index2]))
-        phase1 = np.array(phase1)
-        phase2 = np.array(phase2)
-    return compound_list, phase1, phase2
+    compound_list, phases = get_phases_from_tab(input_file_name, N_compounds)
+    return compound_list, phases[0], phases[1]
     
     
-def get_comp_and_phases(input_file_name, N_compounds):
+def get_comp_and_phases(input_file_name, N_compounds, deck = None):
     """ Extract data from the .inp file
     
     Args:
         input_file_name: The input file name without extension as a string
         N_compounds: The number of compounds in the system as an integer
+        deck: The parsed input file, default = None reads input_file_name
         
     Return:
         compound_list: Compound names as a list
         phases: A list of the phases, each phase is an np.array
     """
-    compound_list = []
-    phases = []
-    
-    with open(input_file_name+".inp","r") as file:
-        lines = file.read()
-        compound_object = re.findall(r"f\ *=\ *[\w\S\ ]* VPfile", lines)
-        phase_object = re.findall(r"[^w]\d\ *=\ *\{[\d \. \ * e \-]*", lines)
-        for i in range(N_compounds):
-            comp = re.findall(r"Comp = \S*", compound_object[i])
-            if comp == []:
-                compound_list.append(compound_object[i].split()[2].split(".")[0].strip("\""))
-            else:
-                compound_list.append(comp[0].split(" ")[-1].strip("\""))
-        
-        phase_counter = 1
-        for j in range(len(phase_object)):
-            phase = []
-            if phase_object[j][1] == str(phase_counter):
-                for k in phase_object[j].split():
-                    if re.findall(r"[^w]\d\ *=\ *\{", k) != []:
-                        phase.append(float(k.split("{")[1]))
-                    else:
-                        phase.append(float(k))
-                phases.append(np.array(phase))
-                phase_counter += 1
-    return compound_list, phases
-    
-    
-def write_flatsurf_file(input_file_name, output_input_file_name, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth):
+    if deck is None:
+        deck = InputDeck.read(input_file_name)
+    return list(deck.compound_list[:N_compounds]), [np.copy(phase) for phase in deck.phases]
+    
+    
+def render_flatsurf_input(input_file_name, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth, deck = None):
+    """ Create the text of a .inp file for a flatsurf calculation
+    
+    Args:
+        input_file_name: Filename as a string
+        phase1: First phase as a list
+        phase2: Second phase as a list
+        T: Temperature as a float
+        IFT: IFT as a float
+        phase_types: Type of phases (Liquid L, Gas, G, Solid S) as a string with length 2
+        deck: The parsed input file, default = None reads input_file_name
+    
+    Return:
+        text: The flatsurf input as a string
+    """
+    if deck is None:
+        deck = InputDeck.read(input_file_name)
+    return deck.render_flatsurf(phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth)
+
+
+def write_flatsurf_file(input_file_name, output_input_file_name, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth, deck = None):
     """ Create new .inp files for flatsurf calculations
     
     Args:
@@ -342,88 +543,92 @@ def write_flatsurf_file(input_file_name, output_input_file_name, phase1, phase2,
         T: Temperature as a float
         IFT: IFT as a float
         phase_types: Type of phases (Liquid L, Gas, G, Solid S) as a string with length 2
+        deck: The parsed input file, default = None reads input_file_name
     
     Return:
         None
     """
-    max_depth_str = ""
-    if phase_types[0] == "S" or phase_types[1] == "S":# or phase_types[0] == "G" or phase_types[1] == "G":
-        max_depth_str = "maxdepth={} ".format(max_depth)
-    
-    with open(input_file_name+".inp", "r") as file:  # Read the inital input file
-        lines = file.readlines()
-        # Create output_input_file_name.inp file and write all lines except the last from initial file and write new last line
-        with open(output_input_file_name+".inp", "w") as output:    
-            output.writelines(lines[0])
-            output.writelines(max_depth_str+" "+lines[1])
-            output.writelines(lines[2:-1])  # All lines except the last
-            # Last line 
-            (output.write("tk={0} FLATSURF xf1={{{1}}} xf2={{{2}}} IGNORE_CHARGE IFT={3:.{4}f} \n".
-            format(T, "  ".join(map(str,phase1)), "  ".join(map(str,phase2)), IFT, IFT_write_length)))
+    text = render_flatsurf_input(input_file_name, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth, deck)
+    with open(output_input_file_name+".inp", "w") as output:
+        output.write(text)
     return
     
 
+# A run of at least 4 numbers with decimals, as in the compound lines of a flatsurf .tab file
+_tab_numbers = re.compile(r"(?:[-+]?\d*\.\d*\s*){4,}")
+
+
 def get_Gtot_and_Area(input_file_name, N_compounds): 
     """ Extract data from the .tab file
     
+    The file is read once, line by line, and reading stops when both directions are found.
+    
     Args:
         input_file_name: The input file name without extension as a string
         N_compounds: The number of compounds in the system as an integer
     
     Return:
-        GtotAB: Gtot from one side as a list of floats 
-        GtotBA: Gtot from the other side as a list of floats
-        AreaAB: Area from one side as a list of floats
-        AreaBA: Area from the other side as a list of floats
+        GtotAB: Gtot from one side as a np.array of floats 
+        GtotBA: Gtot from the other side as a np.array of floats
+        AreaAB: Area from one side as a np.array of floats
+        AreaBA: Area from the other side as a np.array of floats
     """
-    GtotAB = []
-    GtotBA = []
-    AreaAB = []
-    AreaBA = []
-    with open(input_file_name+".tab","r") as file:
-        text = file.read()
-        for i in range(N_compounds):
-            # find a line of numbers with more than 4 numbers
-            obj_ABtab = re.findall(r"(?:[-+]?\d*\.\d*\s*){4,}", text)  
-            # There is 2 times the N_compounds lines in obj_ABtab.
-            # The first N_compounds lines are from one side, the rest are from the other. 
-            # Gtot is index 1 and across,mean is index 2.
-            GtotAB.append(float(obj_ABtab[i].split()[1]))
-            GtotBA.append(float(obj_ABtab[i+N_compounds].split()[1]))
-            AreaAB.append(float(obj_ABtab[i].split()[2]))
-            AreaBA.append(float(obj_ABtab[i+N_compounds].split()[2]))
-    GtotAB = np.array(GtotAB)
-    GtotBA = np.array(GtotBA)
-    AreaAB = np.array(AreaAB)
-    AreaBA = np.array(AreaBA)
-    return GtotAB, GtotBA, AreaAB, AreaBA
+    # There is 2 times the N_compounds lines of numbers.
+    # The first N_compounds lines are from one side, the rest are from the other. 
+    # Gtot is index 1 and across,mean is index 2.
+    Gtot = np.empty(2*N_compounds)
+    Area = np.empty(2*N_compounds)
+    count = 0
+    for line in iter_lines(input_file_name+".tab"):
+        for numbers in _tab_numbers.findall(line):
+            split = numbers.split()
+            Gtot[count] = float(split[1])
+            Area[count] = float(split[2])
+            count += 1
+            if count == 2*N_compounds:
+                return Gtot[:N_compounds], Gtot[N_compounds:], Area[:N_compounds], Area[N_compounds:]
+    raise ValueError("Found {} of {} compound lines in {}.tab".format(count, 2*N_compounds, input_file_name))
   
 
-def scale_area(compound_list, AreaAB, AreaBA, N_compounds, scale_water, scale_organic):
+def get_compound_masks(compound_list):
+    """ Find the water, vacuum and organic compounds, computed once per calculation for scale_area
+    
+    Args:
+        compound_list: Compound names as a list
+        
+    Return:
+        water: Compounds with h2o in the name as an np.array of booleans
+        vacuum: Compounds with vacuum, but not h2o, in the name as an np.array of booleans
+        organic: All other compounds as an np.array of booleans
+    """
+    water = np.array(["h2o" in name for name in compound_list], dtype=bool)
+    vacuum = np.array(["vacuum" in name for name in compound_list], dtype=bool) & ~water
+    organic = ~(water | vacuum)
+    return water, vacuum, organic
+
+
+def scale_area(compound_list, AreaAB, AreaBA, N_compounds, scale_water, scale_organic, masks = None):
     """ Scaling areas
     
     Args:
         compound_list: Compound names as a list
-        AreaAB: Areas from one side as a list of floats
-        AreaBA: Areas from the other side as a list of floats
+        AreaAB: Areas from one side as an array
+        AreaBA: Areas from the other side as an array
         N_compounds: The number of compounds in the system as an integer
         scale_water: The parameterization for water as a float or integer
         scale_organic: The parameterization for organic as a float or integer
+        masks: The water, vacuum and organic masks from get_compound_masks, default = None finds them from compound_list
         
     Return:
-        AreaAB: Scaled area from one side as a list of floats
-        AreaBA: Scaled area from the other side as a list of floats
+        AreaAB: Scaled area from one side as a new array
+        AreaBA: Scaled area from the other side as a new array
     """
-    for i in range(N_compounds):
-        if "h2o" in compound_list[i]:  # Scale water
-            AreaAB[i]*=scale_water;
-            AreaBA[i]*=scale_water;
-        elif "vacuum" in compound_list[i]:  # Scale vacuum
-            AreaAB[i]=1e1000
-            AreaBA[i]=1e1000
-        else:
-            AreaAB[i]*=scale_organic;
-            AreaBA[i]*=scale_organic;
+    if masks is None:
+        masks = get_compound_masks(compound_list[:N_compounds])
+    water, vacuum, _ = masks
+    scaling = np.where(water, scale_water, scale_organic)
+    AreaAB = np.where(vacuum, np.inf, np.asarray(AreaAB, dtype=float)*scaling)  # Vacuum has no area
+    AreaBA = np.where(vacuum, np.inf, np.asarray(AreaBA, dtype=float)*scaling)
     return AreaAB, AreaBA  
 
     
@@ -438,18 +643,38 @@ def calculate_coverage(phase, Gtot, R, T, liquid_index):
         liquid_index: The index for the liquid phase, if a solid phase is present
         
     Return:
-        coverage: Surface coverage as an array
+        coverage: Surface coverage as an array, 0.0 for the compounds outside liquid_index
     """
     coverage = np.zeros(len(phase))
-    for i in range(len(phase)):
-        if i in liquid_index:
-            coverage[i] = phase[i]*np.exp(-Gtot[i]/(R*T))
-        else:
-            coverage[i] = 0.0
+    coverage[liquid_index] = np.asarray(phase)[liquid_index]*np.exp(-np.asarray(Gtot)[liquid_index]/(R*T))
     return coverage 
     
     
-def calculate_CF(coverage, coverage_new, coverage_damping, max_CF, liquid_index):
+def calculate_coverage_new(phase1, phase2, GtotAS, GtotBS, R, T, liquid_index, phase_types):
+    """ Calculate the coverage from the liquid phase(s) next to the surface
+    
+    Args:
+        phase1: Phase 1 as an array
+        phase2: Phase 2 as an array
+        GtotAS: Gtot from phase 1 to the surface as an array
+        GtotBS: Gtot from phase 2 to the surface as an array
+        R: The gas constant in kj/mol/K as a float
+        T: The temperature in Kelvin as a float
+        liquid_index: The index for the liquid phase, if a solid phase is present
+        phase_types: The phase types with C as the middle phase, e.g. "LCL", as a string
+        
+    Return:
+        coverage_new: [coverage_A, coverage_B] as a list of arrays for LCL, else the coverage from the liquid phase as an array
+    """
+    if phase_types == "LCL":
+        return [calculate_coverage(phase1, GtotAS, R, T, liquid_index), calculate_coverage(phase2, GtotBS, R, T, liquid_index)]
+    elif phase_types == "LCS" or phase_types == "LCG":
+        return calculate_coverage(phase1, GtotAS, R, T, liquid_index)
+    elif phase_types == "SCL" or phase_types == "GCL":
+        return calculate_coverage(phase2, GtotBS, R, T, liquid_index)
+    
+    
+def calculate_CF(coverage, coverage_new, coverage_damping, max_CF, liquid_index, relative = False):
     """ Calculate coverage factor (CF) and replace the value if it is too high or too low
     
     Args:
@@ -458,18 +683,23 @@ def calculate_CF(coverage, coverage_new, coverage_damping, max_CF, liquid_index)
         coverage_damping: The coverage damping
         max_CF: The maximum allowed step length for the coverage per iteration
         liquid_index: The index for the liquid phase, if a solid phase is present
+        relative: Take CF relative to the normalization before limiting it, so max_CF limits the actual step, default = False
         
     Return:
         coverage: Surface coverage as an array
     """
     if type(coverage_new) == list:
         CF = np.power((coverage_new[0][liquid_index]*coverage_new[1][liquid_index]/coverage[liquid_index]**2), coverage_damping)
+        if relative:
+            CF /= np.sum(coverage[liquid_index]*CF)/np.sum(coverage)
         CF[CF>max_CF] = max_CF
         CF[CF<1/max_CF] = 1/max_CF
         coverage[liquid_index] = coverage[liquid_index]*CF
         coverage /= np.sum(coverage)
     else:
         CF = np.power((coverage_new[liquid_index]/coverage[liquid_index]), coverage_damping)
+        if relative:
+            CF /= np.sum(coverage[liquid_index]*CF)/np.sum(coverage)
         CF[CF>max_CF] = max_CF
         CF[CF<1/max_CF] = 1/max_CF
         coverage[liquid_index] = coverage[liquid_index]*CF
@@ -521,12 +751,6 @@ def calculate_IFT_damping(IFT, IFT_value, IFT_max_diff, IFT_damping):
     Return:
         IFT_value with 6 decimals, truncated to prevent memory error in COSMOthermX18
     """
-    if IFT-IFT_value > IFT_max_diff:
-        difference = IFT_max_diff
-    elif IFT-IFT_value < -IFT_max_diff:
-        difference = -IFT_max_diff
-    else:
-        difference = IFT-IFT_value
-    
+    difference = min(max(IFT-IFT_value, -IFT_max_diff), IFT_max_diff)
     IFT_value = IFT_value+difference*IFT_damping
     return IFT_value
\ No newline at end of file
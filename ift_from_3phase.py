@@ -2,15 +2,28 @@ from __future__ import print_function,division
 import subprocess
 import sys
 import os
+import time
 import numpy as np
 import re
 from functions import *
-from multiprocessing import Pool, cpu_count
+from solver_backends import COSMOthermBackend, ExtrapolatingBackend, FlatsurfJob
+from flatsurf_cache import FlatsurfCache, CachedBackend
+from input_deck import InputDeck
+from trajectory import TrajectoryWriter
+from results_store import ResultsStore
+from instrumentation import Profiler, get_profiler, set_profiler
+from solver_orchestrator import set_deadline, check_deadline
+from convergence import AndersonMixer, anderson_step, StepController, NewtonKrylovSolver, pack_state, unpack_state, IFT_scale
 
 # Run by: python "script name" "input_file_name"(without extensions) phase type (liquid (L), gas (G), solid (S)) "user initials"(in caps)
 
 def calculate_IFT_tot_and_coverage(input_file_name, phase_types, user, print_statements = True, debug = False, multiprocess = True, delete_files = True, 
-                                   save_output_file = True, max_iterations = 0):
+                                   save_output_file = True, max_iterations = 0, backend = None, solver_mode = "damping", 
+                                   adaptive_damping = True, cache_dir = None, extrapolate = False, scratch_path = None, 
+                                   initial_guess = None, return_details = False, checkpoint_file = None, resume = False, 
+                                   phases = None, output_format = "text", profile = False, profile_file = None, 
+                                   call_timeout = None, calculation_timeout = None, solver_retries = 0, results_db = None, 
+                                   warm_start = False, newton_probes = 3):
     """ Calculate the total interfacial tension of the two input phases and 
         the surface coverage between the phases.
     Args: 
@@ -22,15 +35,43 @@ def calculate_IFT_tot_and_coverage(input_file_name, phase_types, user, print_sta
         multiprocess: Run COSMOtherm simultaneously in the while loop, boolean, default = True
         delete_files: Delete the intermediate files created during the calculation, boolean, default = True
         save_output_file: Save the direct output of the calculation, boolean, default = True
+        output_format: Format of the direct output, "text" for input_output.txt or "binary" for the input_trajectory.npy record array with Gtot and Area of every iteration, see trajectory.py, default = "text"
         max_iterations: The maximum amount of iterations for the iterative process, 0 = no upper bound, integer, default = 0      
+        backend: The solver backend running the flatsurf calculations, e.g. SyntheticBackend, which is left open for the caller to close, default = None runs COSMOtherm for the user
+        solver_mode: Update scheme for coverage and IFT, "damping" for damped fixed-point steps, "anderson" for Anderson mixing or "newton" for Newton steps with a line search from finite-difference Jacobian probes that run at the same time, default = "damping"
+        newton_probes: The number of Jacobian probes per Newton step (2 flatsurf calculations each) in a reduced Krylov-like Jacobian, None probes every unknown (the full Jacobian, liquid compounds + 2 probes), default = 3
+        adaptive_damping: Raise or lower the IFT damping, coverage damping and max_CF when the residuals oscillate or stagnate, False uses the fixed damping and the infinite loop check of earlier versions, which can stall when every coverage factor is limited by max_CF, boolean, default = True
+        cache_dir: Directory of the flatsurf result cache shared by all runs, None disables the cache, default = None
+        extrapolate: Predict Gtot and Area from a Broyden model of earlier iterations and only run COSMOtherm when the step leaves the trusted region, boolean, default = False
+        scratch_path: Directory for the intermediate flatsurf files, default = None creates a new workspace in the temp directory, which is removed after the calculation
+        initial_guess: Start values as a dict with "coverage", "IFT_A" and "IFT_B", e.g. the details of a similar calculation, default = None starts from flatsurfAB and start_ift
+        checkpoint_file: Save the state of the calculation atomically to this .npz file after every iteration, removed when converged, default = None
+        resume: Continue from checkpoint_file if it exists and belongs to the same system, boolean, default = False
+        phases: The compositions of phase 1 and phase 2 as a tuple of arrays, used instead of the LLE or the phases in the input file, default = None
+        profile: Record the wall time of every stage (LLE, rendering, COSMOtherm, parsing, event loop setup, updates, output) in every iteration and print a summary table, boolean, default = False
+        profile_file: Write the timings of every iteration to this .json or .csv file, implies profile, default = None
+        call_timeout: Kill a COSMOtherm process that runs longer than this many seconds, used when backend is None, default = None (no limit)
+        solver_retries: Start a killed or failed COSMOtherm process again this many times before giving up, used when backend is None, default = 0
+        calculation_timeout: Stop the calculation with SolverTimeoutError after this many seconds, killing the running COSMOtherm processes, default = None (no limit)
+        results_db: Add the converged calculation (compounds, phases, T, parameterization, scaling, coverage, IFTs, iterations and timings) to this SQLite database, see results_store.py, default = None
+        warm_start: Start from the coverage and IFTs interpolated from the closest converged calculations in results_db (same compounds, phase types, parameterization and scaling settings, close in composition and T), or from flatsurfAB when there are none, boolean, default = False
+        return_details: Also return a dict with the converged coverage, IFT_A, IFT_B, IFT_tot, iterations, converged, T, compound_list, phase1 and phase2, boolean, default = False
         
     Return:
         coverage: The surface coverage between the two input phases as a numpy array
         IFT_tot: The total interfacial tension of the system as a float
+        details: Only if return_details, the final state of the calculation as a dict
     """
+    start_time = time.time()
+    
     # Add your own path to COSMOtherm and user name in the Users.txt file
-    COSMOtherm_path = get_user_and_path(user)
-    curr_path = os.path.abspath(__file__)[:-len(__file__)+2]  # Current path without file name
+    created_backend = backend is None  # A backend given by the caller is left open for the caller to reuse and close
+    if backend is None:
+        backend = COSMOthermBackend(get_user_and_path(user), multiprocess = multiprocess, call_timeout = call_timeout, retries = solver_retries)
+    if cache_dir is not None:
+        backend = CachedBackend(backend, FlatsurfCache(cache_dir))
+    if extrapolate:
+        backend = ExtrapolatingBackend(backend)
 
     # Initial values
     start_ift = 20.  # Start_ift * 2 is the start position in the iterative process
@@ -47,7 +88,8 @@ def calculate_IFT_tot_and_coverage(input_file_name, phase_types, user, print_sta
     # Convergence
     convergence_criteria = 3  # Number of iterations with an IFT difference under convergence_threshold
     convergence_threshold = 1e-3
-    inf_loop_precision = 3  # The precision for the infinite loop check, high number equals less likely to occur
+    inf_loop_precision = 3  # The precision for the infinite loop check without adaptive_damping, high number equals less likely to occur
+    anderson_history = 5  # Number of earlier iterations used in Anderson mixing
     # Solids
     max_depth = 3.0
     solid_scaling = 0.5
@@ -60,228 +102,405 @@ def calculate_IFT_tot_and_coverage(input_file_name, phase_types, user, print_sta
 
     # Change input name
     input_file_name, output_path = change_input_name(input_file_name)
+    
+    # Read the input file once, the flatsurf inputs are rendered from it
+    deck = InputDeck.read(input_file_name)
 
     # Check unit=si in input file
-    liq_ex = check_units_get_liq_ex(input_file_name)
+    liq_ex = check_units_get_liq_ex(input_file_name, deck)
     
     # Check if the parameterization matches the input file
-    scale_water, parameter = check_parameterization(input_file_name)
+    scale_water, parameter = check_parameterization(input_file_name, deck)
 
     # Read Number of compounds and Temperature from initial .inp file   
-    N_compounds, T = get_N_compounds_and_T(input_file_name)
+    N_compounds, T = get_N_compounds_and_T(input_file_name, deck)
     
     if debug:
         print("N_compounds:", N_compounds, "Temperature:", T, "[K]")
     
     # Check phase types
     phase_types = check_phase_types(phase_types, 2)
+    
+    if solver_mode not in ["damping", "anderson", "newton"]:
+        print("Warning: Unknown solver_mode {}, use \"damping\", \"anderson\" or \"newton\".".format(solver_mode))
+        quit()
+    
+    if output_format not in ["text", "binary"]:
+        print("Warning: Unknown output_format {}, use \"text\" or \"binary\".".format(output_format))
+        quit()
 
-    # Get the composition of the two phases from the .tab file for LL after LLE or from the .inp file for everything else    
-    if phase_types == "LL":
-        subprocess.call([COSMOtherm_path, input_file_name+".inp"])
-        compound_list, phase1, phase2 = get_comp_and_phases_for_LL(input_file_name, N_compounds)
-    else:
-        compound_list, phases = get_comp_and_phases(input_file_name, N_compounds)
-        phase1 = phases[0]
-        phase2 = phases[1]
+    # Time the stages of the calculation, from the LLE on
+    profile = profile or profile_file is not None
+    profiler = Profiler() if profile else get_profiler()
+    previous_profiler = set_profiler(profiler)
+    
+    # The time limit of the calculation, from the LLE on, for the solver processes and the iterations
+    previous_deadline = set_deadline(time.monotonic()+calculation_timeout if calculation_timeout is not None else None)
+    
+    # Everything from here on restores the deadline and profiler and closes the backend, also when it fails
+    workspace = None
+    iterations = 0
+    trajectory = None
+    try:
+        # Get the composition of the two phases from the .tab file for LL after LLE or from the .inp file for everything else    
+        if phases is not None:
+            compound_list, _ = get_comp_and_phases(input_file_name, N_compounds, deck)
+            phase1 = np.array(phases[0], dtype=float)
+            phase2 = np.array(phases[1], dtype=float)
+        elif phase_types == "LL":
+            compound_list, phase1, phase2 = backend.run_lle(input_file_name, N_compounds)
+        else:
+            compound_list, phases = get_comp_and_phases(input_file_name, N_compounds, deck)
+            phase1 = phases[0]
+            phase2 = phases[1]
         
-    # Get the indices of the liquid and solid compounds
-    liquid_index, solid_gas_index = get_liquid_index(phase1, phase2, phase_types)
+        # Get the indices of the liquid and solid compounds
+        liquid_index, solid_gas_index = get_liquid_index(phase1, phase2, phase_types)
     
-    # If there is a 0 in the phase, convert it to 10^-16
-    if 0 in phase1[liquid_index] and phase_types[0] == "L":
-        for i in np.where(phase1[liquid_index]==0)[0]:
-            print("Warning: Added 1e-16 to a concentration in phase 1, which was 0.0")
-            phase1[i] = 1e-16
-    if 0 in phase2[liquid_index] and phase_types[1] == "L":
-        for i in np.where(phase2[liquid_index]==0)[0]:
-            print("Warning: Added 1e-16 to a concentration in phase 2, which was 0.0")
-            phase2[i] = 1e-16
+        # If there is a 0 in the phase, convert it to 10^-16
+        if phase_types[0] == "L":
+            zero_index = liquid_index[phase1[liquid_index] == 0]
+            if len(zero_index) > 0:
+                print("Warning: Added 1e-16 to {} concentration(s) in phase 1, which were 0.0".format(len(zero_index)))
+                phase1[zero_index] = 1e-16
+        if phase_types[1] == "L":
+            zero_index = liquid_index[phase2[liquid_index] == 0]
+            if len(zero_index) > 0:
+                print("Warning: Added 1e-16 to {} concentration(s) in phase 2, which were 0.0".format(len(zero_index)))
+                phase2[zero_index] = 1e-16
+    
+        # The water, vacuum and organic compounds for the area scaling
+        masks = get_compound_masks(compound_list)
    
-    # Normalize the phases
-    phase1 = phase1/np.sum(phase1)
-    phase2 = phase2/np.sum(phase2)
+        # Normalize the phases
+        phase1 = phase1/np.sum(phase1)
+        phase2 = phase2/np.sum(phase2)
    
-    # Print initial values
-    if print_statements:
-        if phase_types == "LL":
-            print("\nParameterization: {} ".format(parameter))
-        elif phase_types[0] == "G" or phase_types[1] == "G":
-            print("\nParameterization: {} \nGas scaling: {}".format(parameter, gas_scaling))
-        else:
-            print("\nParameterization: {} \nSolid scaling: {} \nMax depth: {}".format(parameter, gas_scaling, max_depth))
-        print_compound_list = "[ {}".format(compound_list[0])
-        for i in compound_list[1:]:
-            print_compound_list += "  " + i
-        print_compound_list += "]"
-        print("\nCompounds: {} \nPhase 1:   {} {} \nPhase 2:   {} {}\n".format(print_compound_list, phase1, phase_types[0], phase2, phase_types[1]))    
-
-    # Create flatsurfAB file
-    write_flatsurf_file(input_file_name, curr_path+"flatsurfAB", phase1, phase2, T, start_ift, IFT_write_length, phase_types, max_depth)
+        # Print initial values
+        if print_statements:
+            if phase_types == "LL":
+                print("\nParameterization: {} ".format(parameter))
+            elif phase_types[0] == "G" or phase_types[1] == "G":
+                print("\nParameterization: {} \nGas scaling: {}".format(parameter, gas_scaling))
+            else:
+                print("\nParameterization: {} \nSolid scaling: {} \nMax depth: {}".format(parameter, gas_scaling, max_depth))
+            print_compound_list = "[ {}".format(compound_list[0])
+            for i in compound_list[1:]:
+                print_compound_list += "  " + i
+            print_compound_list += "]"
+            print("\nCompounds: {} \nPhase 1:   {} {} \nPhase 2:   {} {}\n".format(print_compound_list, phase1, phase_types[0], phase2, phase_types[1]))    
 
-    # Run COSMOtherm
-    subprocess.call([COSMOtherm_path, curr_path+"flatsurfAB.inp"])    
+        # Continue from the checkpoint of an earlier, interrupted calculation of the same system
+        checkpoint = None
+        if resume and checkpoint_file is not None:
+            checkpoint = load_checkpoint(checkpoint_file, compound_list, phase_types, T)
+            if checkpoint is not None:
+                initial_guess = checkpoint
+                if print_statements:
+                    print("Resuming from iteration {} in {}".format(checkpoint["iterations"], checkpoint_file))
+    
+        # Start from the stored calculations closest to this system
+        if warm_start and initial_guess is None and results_db is not None and os.path.exists(results_db):
+            with ResultsStore(results_db) as store:
+                initial_guess = store.initial_guess(compound_list, phase1, phase2, T, parameter, phase_types,
+                                                    settings = {"scale_water": scale_water, "scale_organic": scale_organic, "solid_scaling": solid_scaling,
+                                                                "gas_scaling": gas_scaling, "max_depth": max_depth})
+            if print_statements and initial_guess is not None:
+                print("Warm start from {} stored calculation(s), the closest at distance {:.4g}".format(initial_guess["N_neighbours"], 
+                                                                                                        initial_guess["distance"]))
 
-    # Extract Gtot and across,mean for each direction in the flatsurf file
-    GtotAB, GtotBA, AreaAB, AreaBA = get_Gtot_and_Area(curr_path+"flatsurfAB", N_compounds)
+        # Every calculation gets its own scratch workspace, so calculations running at the same time do not share files
+        workspace, created_workspace = create_workspace(input_file_name, scratch_path)
+        curr_path = os.path.join(workspace, "")
+        
+        if initial_guess is not None:  # Warm start from a guess, e.g. a converged neighbouring calculation
+            coverage = np.array(initial_guess["coverage"], dtype=float)
+            coverage[solid_gas_index] = 0.0
+            coverage[liquid_index] = np.maximum(coverage[liquid_index], 1e-16)
+        else:
+            # Run the flatsurfAB calculation and extract Gtot and across,mean for each direction
+            (GtotAB, GtotBA, AreaAB, AreaBA), = backend.evaluate([FlatsurfJob(deck, curr_path+"flatsurfAB", phase1, phase2, T, start_ift, 
+                                                                              IFT_write_length, phase_types, max_depth, N_compounds)])
 
-    if debug:
-        print("Gtot, AB:", GtotAB, "BA:", GtotBA)
-        print("Area, AB:", AreaAB, "BA:", AreaBA)
+            if debug:
+                print("Gtot, AB:", GtotAB, "BA:", GtotBA)
+                print("Area, AB:", AreaAB, "BA:", AreaBA)
 
-    # Scale the calculated areas
-    AreaAB, AreaBA = scale_area(compound_list, AreaAB, AreaBA, N_compounds, scale_water, scale_organic)
+            # Scale the calculated areas
+            AreaAB, AreaBA = scale_area(compound_list, AreaAB, AreaBA, N_compounds, scale_water, scale_organic, masks)
 
-    # Calculate the coverage in the interface between A and B, using equation 1 for LL and a reduced equation for LS and SL
-    if phase_types == "LL":
-        coverage = np.sqrt(calculate_coverage(phase1, GtotAB, R, T, liquid_index) * calculate_coverage(phase2, GtotBA, R, T, liquid_index))
-    elif phase_types == "LS" or phase_types == "LG":
-        coverage = calculate_coverage(phase1, GtotAB, R, T, liquid_index)
-    elif phase_types == "SL" or phase_types == "GL":
-        coverage = calculate_coverage(phase2, GtotBA, R, T, liquid_index)
+            # Calculate the coverage in the interface between A and B, using equation 1 for LL and a reduced equation for LS and SL
+            if phase_types == "LL":
+                coverage = np.sqrt(calculate_coverage(phase1, GtotAB, R, T, liquid_index) * calculate_coverage(phase2, GtotBA, R, T, liquid_index))
+            elif phase_types == "LS" or phase_types == "LG":
+                coverage = calculate_coverage(phase1, GtotAB, R, T, liquid_index)
+            elif phase_types == "SL" or phase_types == "GL":
+                coverage = calculate_coverage(phase2, GtotBA, R, T, liquid_index)
     
-    # If there is a 0 in the coverage, convert it to 10^-16
-    if 0 in coverage[liquid_index]:
-        for i in np.where(coverage[liquid_index]==0)[0]:
-            print("Warning: Added 1e-16 to a value in coverage, which was 0.0")
-            coverage[i] = 1e-16
+            # If there is a 0 in the coverage, convert it to 10^-16
+            zero_index = liquid_index[coverage[liquid_index] == 0]
+            if len(zero_index) > 0:
+                print("Warning: Added 1e-16 to {} value(s) in coverage, which were 0.0".format(len(zero_index)))
+                coverage[zero_index] = 1e-16
     
-    # Normalize coverage
-    coverage /= np.sum(coverage)
+        # Normalize coverage
+        coverage /= np.sum(coverage)
     
-    # Initiate values for iterative process
-    IFT_A_value = start_ift
-    IFT_B_value = start_ift
-    IFT_tot = start_ift
-    phase_types = phase_types[0]+"C"+phase_types[1]  # Add C (coverage) as the middle phase
-    iterations = 0
-    convergence_flag = 0
-    inf_loop_counter = 0
-    IFT_tot_list = []
-    # Multiprocessing
-    N_cpu = cpu_count()     
-    if N_cpu > 2:
-        N_cpu = 2
-    # Open output file
-    if save_output_file:
-        line = ""
-        for i in range(len(phase1)):
-            line += "Coverage_{}, ".format(i)
-        line += "IFT\n"
-        with open(input_file_name.split(".")[0] + "_output.txt", "w") as output:
-            output.write(line)
-    while convergence_flag < convergence_criteria:
-        iterations += 1
+        # Initiate values for iterative process
+        if initial_guess is not None:
+            IFT_A_value = initial_guess["IFT_A"]
+            IFT_B_value = initial_guess["IFT_B"]
+        else:
+            IFT_A_value = start_ift
+            IFT_B_value = start_ift
+        IFT_tot = IFT_A_value + IFT_B_value
+        phase_types = phase_types[0]+"C"+phase_types[1]  # Add C (coverage) as the middle phase
+        convergence_flag = 0
+        inf_loop_counter = 0
+        IFT_tot_list = []
+        mixer = AndersonMixer(history = anderson_history)
+        if checkpoint is not None:
+            iterations = int(checkpoint["iterations"])
+            convergence_flag = int(checkpoint["convergence_flag"])
+            IFT_damping = float(checkpoint["IFT_damping"])
+            coverage_damping = float(checkpoint["coverage_damping"])
+            max_CF = float(checkpoint["max_CF"])
+            mixer.x_list = list(checkpoint["mixer_x"])
+            mixer.f_list = list(checkpoint["mixer_f"])
+        controller = StepController(IFT_damping, coverage_damping, max_CF)
+        newton = NewtonKrylovSolver(N_probes = newton_probes)
+        probe_results = {}  # The flatsurf results of the Newton probes and line search, by state
+        next_results = None  # The flatsurf results of the accepted line search point, reused by the next iteration
+        
+        def fixed_point_map(states):
+            """ The images g of joint states, i.e. the undamped coverage and the IFTs it gives, all flatsurf calculations run at the same time """
+            jobs = []
+            for k, x in enumerate(states):
+                coverage_k, IFT_A_k, IFT_B_k = unpack_state(x, coverage, liquid_index)
+                jobs.append(FlatsurfJob(deck, curr_path+"flatsurfAS_{}".format(k), phase1, coverage_k, T, IFT_A_k, IFT_write_length, phase_types[:2], max_depth, N_compounds))
+                jobs.append(FlatsurfJob(deck, curr_path+"flatsurfSB_{}".format(k), coverage_k, phase2, T, IFT_B_k, IFT_write_length, phase_types[1:], max_depth, N_compounds))
+            results = backend.evaluate(jobs)
+            images = []
+            for k, x in enumerate(states):
+                (GtotAS, GtotSA, AreaAS, AreaSA), (GtotSB, GtotBS, AreaSB, AreaBS) = results[2*k], results[2*k+1]
+                probe_results[x.tobytes()] = (results[2*k], results[2*k+1])
+                AreaAS, AreaSA = scale_area(compound_list, AreaAS, AreaSA, N_compounds, scale_water, scale_organic, masks)
+                AreaBS, AreaSB = scale_area(compound_list, AreaBS, AreaSB, N_compounds, scale_water, scale_organic, masks)
+                coverage_new = calculate_coverage_new(phase1, phase2, GtotAS, GtotBS, R, T, liquid_index, phase_types)
+                target = calculate_CF(np.copy(jobs[2*k].phase2), coverage_new, 1.0, np.inf, liquid_index)  # phase2 of job AS is the coverage
+                IFT_A = calculate_IFT(phase1, GtotAS, GtotSA, AreaAS, AreaSA, target, R, T, unit_converter, phase_types[:2], liquid_index, solid_scaling, gas_scaling)
+                IFT_B = calculate_IFT(phase2, GtotBS, GtotSB, AreaBS, AreaSB, target, R, T, unit_converter, phase_types[1:], liquid_index, solid_scaling, gas_scaling)
+                images.append(pack_state(target, IFT_A, IFT_B, liquid_index))
+            return images
+        
+        # Open output file, a resumed calculation continues the existing one from the iteration of the checkpoint
+        if save_output_file and output_format == "binary":
+            trajectory = TrajectoryWriter(input_file_name.split(".")[0] + "_trajectory.npy", N_compounds, 
+                                          resume = checkpoint is not None, max_iteration = iterations)
+        elif save_output_file and (checkpoint is None or not truncate_output_file(input_file_name.split(".")[0] + "_output.txt", iterations+1)):
+            line = ""
+            for i in range(len(phase1)):
+                line += "Coverage_{}, ".format(i)
+            line += "IFT\n"
+            with open(input_file_name.split(".")[0] + "_output.txt", "w") as output:
+                output.write(line)
+        while convergence_flag < convergence_criteria:
+            iterations += 1
+            profiler.next_iteration(iterations)
+            check_deadline()
 
        
-        # Create flatsurf files for phase1/coverage and coverage/phase2
-        write_flatsurf_file(input_file_name, curr_path+"flatsurfAS", phase1, coverage, T, IFT_A_value, IFT_write_length, phase_types[:2], max_depth)
-        write_flatsurf_file(input_file_name, curr_path+"flatsurfSB", coverage, phase2, T, IFT_B_value, IFT_write_length, phase_types[1:], max_depth)
-
-        if multiprocess:  # Run both COSMOtherm instances simultaneously
-            pool = Pool(processes=N_cpu)  # Initiate pool
-            pool.map(work, [[COSMOtherm_path, curr_path+"flatsurfAS.inp"], [COSMOtherm_path, curr_path+"flatsurfSB.inp"]])  # Add processes 
-            pool.close()  # Can not add more processes
-            pool.join()  # Wait for all processes to complete and continue
-        else:  # One at a time
-            subprocess.call([COSMOtherm_path, curr_path+"flatsurfAS.inp"]) 
-            subprocess.call([COSMOtherm_path, curr_path+"flatsurfSB.inp"])  
-        # Extract Gtot and Area from the .tab files
-        GtotAS, GtotSA, AreaAS, AreaSA = get_Gtot_and_Area(curr_path+"flatsurfAS", N_compounds)
-        GtotSB, GtotBS, AreaSB, AreaBS = get_Gtot_and_Area(curr_path+"flatsurfSB", N_compounds)
+            # Run the flatsurf calculations for phase1/coverage and coverage/phase2 and extract Gtot and Area
+            job_AS = FlatsurfJob(deck, curr_path+"flatsurfAS", phase1, coverage, T, IFT_A_value, IFT_write_length, phase_types[:2], max_depth, N_compounds)
+            job_SB = FlatsurfJob(deck, curr_path+"flatsurfSB", coverage, phase2, T, IFT_B_value, IFT_write_length, phase_types[1:], max_depth, N_compounds)
+            if next_results is not None:  # The Newton line search already ran this iterate
+                (GtotAS, GtotSA, AreaAS, AreaSA), (GtotSB, GtotBS, AreaSB, AreaBS) = next_results
+                next_results = None
+            else:
+                (GtotAS, GtotSA, AreaAS, AreaSA), (GtotSB, GtotBS, AreaSB, AreaBS) = backend.evaluate([job_AS, job_SB])
+            update_start = time.perf_counter()
 
-        # Scale areas
-        AreaAS, AreaSA = scale_area(compound_list, AreaAS, AreaSA, N_compounds, scale_water, scale_organic)
-        AreaBS, AreaSB = scale_area(compound_list, AreaBS, AreaSB, N_compounds, scale_water, scale_organic)
+            # Scale areas
+            AreaAS, AreaSA = scale_area(compound_list, AreaAS, AreaSA, N_compounds, scale_water, scale_organic, masks)
+            AreaBS, AreaSB = scale_area(compound_list, AreaBS, AreaSB, N_compounds, scale_water, scale_organic, masks)
         
-        # Calculate coverages
-        if phase_types == "LCL":
-            coverage_A = calculate_coverage(phase1, GtotAS, R, T, liquid_index)
-            coverage_B = calculate_coverage(phase2, GtotBS, R, T, liquid_index)
-            coverage = calculate_CF(coverage, [coverage_A, coverage_B], coverage_damping, max_CF, liquid_index)
-        elif phase_types == "LCS" or phase_types == "LCG":
-            coverage_A = calculate_coverage(phase1, GtotAS, R, T, liquid_index)
-            coverage = calculate_CF(coverage, coverage_A, coverage_damping, max_CF, liquid_index)
-        elif phase_types == "SCL" or phase_types == "GCL":
-            coverage_B = calculate_coverage(phase2, GtotBS, R, T, liquid_index)
-            coverage = calculate_CF(coverage, coverage_B, coverage_damping, max_CF, liquid_index)
+            # Calculate coverages
+            coverage_new = calculate_coverage_new(phase1, phase2, GtotAS, GtotBS, R, T, liquid_index, phase_types)
+            coverage_A, coverage_B = coverage_new if phase_types == "LCL" else (coverage_new, coverage_new)
+            
+            # The coverage the flatsurf results point to, i.e. an undamped and unlimited step
+            coverage_target = calculate_CF(np.copy(coverage), coverage_new, 1.0, np.inf, liquid_index)
+            coverage_residual = np.log(coverage_target[liquid_index]/coverage[liquid_index])
+            IFT_A_old, IFT_B_old = IFT_A_value, IFT_B_value
             
-        # Calculate IFT between phase and surface
-        IFT_A = calculate_IFT(phase1, GtotAS, GtotSA, AreaAS, AreaSA, coverage, R, T, unit_converter, phase_types[:2], liquid_index, solid_scaling, gas_scaling)
-        IFT_B = calculate_IFT(phase2, GtotBS, GtotSB, AreaBS, AreaSB, coverage, R, T, unit_converter, phase_types[1:], liquid_index, solid_scaling, gas_scaling)
+            # Anderson mixing of the joint (coverage, IFT_A, IFT_B) state, towards the undamped coverage and the IFT it gives
+            # or a Newton step of the same state, whose Jacobian probes and line search points run at the same time
+            mixed_state = None
+            if solver_mode in ["anderson", "newton"]:
+                IFT_A = calculate_IFT(phase1, GtotAS, GtotSA, AreaAS, AreaSA, coverage_target, R, T, unit_converter, phase_types[:2], liquid_index, solid_scaling, gas_scaling)
+                IFT_B = calculate_IFT(phase2, GtotBS, GtotSB, AreaBS, AreaSB, coverage_target, R, T, unit_converter, phase_types[1:], liquid_index, solid_scaling, gas_scaling)
+            if solver_mode == "anderson":
+                mixed_state = anderson_step(mixer, coverage, IFT_A_value, IFT_B_value, coverage_target, IFT_A, IFT_B, liquid_index, max_CF, IFT_max_diff,
+                                            coverage_damping, IFT_damping)
+                if mixed_state is None and debug:
+                    print("Anderson step rejected, using the damped step")
+            elif solver_mode == "newton":
+                # The step length is limited the same way as the damped update
+                max_step = np.concatenate((np.full(len(liquid_index), np.log(max_CF)), np.full(2, IFT_max_diff/IFT_scale)))
+                probe_results.clear()
+                newton_state = newton.step(pack_state(coverage, IFT_A_value, IFT_B_value, liquid_index), 
+                                           pack_state(coverage_target, IFT_A, IFT_B, liquid_index), fixed_point_map, max_step,
+                                           lambda x: pack_state(*unpack_state(x, coverage, liquid_index), liquid_index = liquid_index))
+                if newton_state is not None:
+                    next_results = probe_results.get(newton_state[0].tobytes())
+                    mixed_state = unpack_state(newton_state[0], coverage, liquid_index)
+                elif debug:
+                    print("Newton step rejected, using the damped step")
+            
+            if mixed_state is not None:
+                coverage, IFT_A_value, IFT_B_value = mixed_state
+            else:
+                coverage = calculate_CF(coverage, coverage_new, coverage_damping, max_CF, liquid_index, relative = adaptive_damping)
+            
+                # Calculate IFT between phase and surface
+                IFT_A = calculate_IFT(phase1, GtotAS, GtotSA, AreaAS, AreaSA, coverage, R, T, unit_converter, phase_types[:2], liquid_index, solid_scaling, gas_scaling)
+                IFT_B = calculate_IFT(phase2, GtotBS, GtotSB, AreaBS, AreaSB, coverage, R, T, unit_converter, phase_types[1:], liquid_index, solid_scaling, gas_scaling)
         
-        # Damping IFT
-        IFT_A_value = calculate_IFT_damping(IFT_A, IFT_A_value, IFT_max_diff, IFT_damping)
-        IFT_B_value = calculate_IFT_damping(IFT_B, IFT_B_value, IFT_max_diff, IFT_damping)
+                # Damping IFT
+                IFT_A_value = calculate_IFT_damping(IFT_A, IFT_A_value, IFT_max_diff, IFT_damping)
+                IFT_B_value = calculate_IFT_damping(IFT_B, IFT_B_value, IFT_max_diff, IFT_damping)
         
-        # Calculate total system IFT
-        IFT_tot_old = IFT_tot
-        IFT_tot = IFT_A_value + IFT_B_value
+            # Calculate total system IFT
+            IFT_tot_old = IFT_tot
+            IFT_tot = IFT_A_value + IFT_B_value
+            profiler.add("update", time.perf_counter()-update_start)
             
-        # Check convergence criteria
-        if abs(IFT_tot_old-IFT_tot) < convergence_threshold:
-            convergence_flag += 1
-        else: 
-            convergence_flag = 0
+            # Check convergence criteria
+            if abs(IFT_tot_old-IFT_tot) < convergence_threshold:
+                convergence_flag += 1
+            else: 
+                convergence_flag = 0
+            if extrapolate and convergence_flag >= convergence_criteria and backend.last_predicted:
+                convergence_flag -= 1  # Convergence has to be confirmed by a real calculation
+                backend.force_check = True
         
-        # Print current iteration results
-        if print_statements:
-            print("Iterations: {0:>2} Coverage: {1} IFT_total: {2:>8.{3}f}".format(str(iterations), coverage, IFT_tot, float_precision))
+            # Print current iteration results
+            if print_statements:
+                print("Iterations: {0:>2} Coverage: {1} IFT_total: {2:>8.{3}f}".format(str(iterations), coverage, IFT_tot, float_precision))
 
-        # Check for infinite loop
-        if "{:.{}f}".format(IFT_tot, inf_loop_precision) in IFT_tot_list:
-            inf_loop_counter += 1
-            if inf_loop_counter > 3:
-                IFT_damping_new = IFT_damping * 0.5
-                print("Infinite loop detected, changed the IFT_damping from {} to {}".format(IFT_damping, IFT_damping_new))
-                IFT_damping = IFT_damping_new
-                inf_loop_counter = 0
-        IFT_tot_list.append("{:.{}f}".format(IFT_tot, inf_loop_precision))
-        
-        if debug:
-            print("Gtot, AS:", GtotAS, "SA:", GtotSA)
-            print("Area, AS:", AreaAS, "SA:", AreaSA)
-            if phase_types[0] == "S":
-                print("IFT_A:", IFT_A, "IFT_A_value", IFT_A_value)
-            else:
-                print("Coverage_A:", coverage_A, "IFT_AS:", "IFT_A:", IFT_A, "IFT_A_value", IFT_A_value)
-            print("Gtot, SB:", GtotSB, "BS:", GtotBS)
-            print("Area, SB:", AreaSB, "BS:", AreaBS)
-            if phase_types[2] == "S":
-                print("IFT_B:", IFT_B, "IFT_B_value", IFT_B_value)
+            # Adapt the damping to oscillating or stagnating residuals
+            if adaptive_damping:
+                message = controller.update(coverage_residual, [IFT_A-IFT_A_old, IFT_B-IFT_B_old])
+                if message is not None:
+                    IFT_damping, coverage_damping, max_CF = controller.IFT_damping, controller.coverage_damping, controller.max_CF
+                    if print_statements:
+                        print(message)
             else:
-                print("Coverage_B:", coverage_B, "IFT_B:", IFT_B, "IFT_B_value", IFT_B_value)
-            print("\n")
+                # Check for infinite loop
+                if "{:.{}f}".format(IFT_tot, inf_loop_precision) in IFT_tot_list:
+                    inf_loop_counter += 1
+                    if inf_loop_counter > 3:
+                        IFT_damping_new = IFT_damping * 0.5
+                        print("Infinite loop detected, changed the IFT_damping from {} to {}".format(IFT_damping, IFT_damping_new))
+                        IFT_damping = IFT_damping_new
+                        inf_loop_counter = 0
+                IFT_tot_list.append("{:.{}f}".format(IFT_tot, inf_loop_precision))
+        
+            if debug:
+                print("Gtot, AS:", GtotAS, "SA:", GtotSA)
+                print("Area, AS:", AreaAS, "SA:", AreaSA)
+                if phase_types[0] == "S":
+                    print("IFT_A:", IFT_A, "IFT_A_value", IFT_A_value)
+                else:
+                    print("Coverage_A:", coverage_A, "IFT_AS:", "IFT_A:", IFT_A, "IFT_A_value", IFT_A_value)
+                print("Gtot, SB:", GtotSB, "BS:", GtotBS)
+                print("Area, SB:", AreaSB, "BS:", AreaBS)
+                if phase_types[2] == "S":
+                    print("IFT_B:", IFT_B, "IFT_B_value", IFT_B_value)
+                else:
+                    print("Coverage_B:", coverage_B, "IFT_B:", IFT_B, "IFT_B_value", IFT_B_value)
+                print("\n")
             
-        if save_output_file:
-            with open(input_file_name.split(".")[0] + "_output.txt", "a") as file:
-                file.write(", ".join(map(str,coverage))+", {}\n".format(IFT_tot))
+            with profiler.section("output"):
+                if trajectory is not None:
+                    trajectory.append(iteration = iterations, coverage = coverage, IFT_A = IFT_A_value, IFT_B = IFT_B_value, IFT_tot = IFT_tot,
+                                      GtotAS = GtotAS, GtotSA = GtotSA, GtotSB = GtotSB, GtotBS = GtotBS, 
+                                      AreaAS = AreaAS, AreaSA = AreaSA, AreaSB = AreaSB, AreaBS = AreaBS)
+                elif save_output_file:
+                    with open(input_file_name.split(".")[0] + "_output.txt", "a") as file:
+                        file.write(", ".join(map(str,coverage))+", {}\n".format(IFT_tot))
+            
+            # Save the state, so a failed or interrupted calculation can continue from this iteration
+            if checkpoint_file is not None:
+                with profiler.section("checkpoint"):
+                    save_checkpoint(checkpoint_file, {"compound_list": compound_list, "phase_types": phase_types[0]+phase_types[2], "T": T,
+                                                      "coverage": coverage, "IFT_A": IFT_A_value, "IFT_B": IFT_B_value, "iterations": iterations,
+                                                      "convergence_flag": convergence_flag, "IFT_damping": IFT_damping, 
+                                                      "coverage_damping": coverage_damping, "max_CF": max_CF, 
+                                                      "mixer_x": np.array(mixer.x_list), "mixer_f": np.array(mixer.f_list)})
+        
+            # Check for forced convergence
+            if iterations == max_iterations:
+                print("The script ended before convergence!\nPhase 1:  {} \nCoverage: {} \nPhase 2:  {} \nTotal IFT: {}".format(phase1, coverage, phase2, IFT_tot))
+                break
+        
+        # A converged calculation has no use for its checkpoint
+        if checkpoint_file is not None and convergence_flag >= convergence_criteria and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+    finally:
+        # The caller's deadline and profiler apply again, even if closing the files or the backend fails
+        set_deadline(previous_deadline)
+        set_profiler(previous_profiler)
         
-        # Check for forced convergence
-        if iterations == max_iterations:
-            print("The script ended before convergence!\nPhase 1:  {} \nCoverage: {} \nPhase 2:  {} \nTotal IFT: {}".format(phase1, coverage, phase2, IFT_tot))
-            break
+        # Write the buffered trajectory records
+        if trajectory is not None:
+            trajectory.close()
+        
+        # Close the backend unless it is shared with later calculations
+        if created_backend:
+            backend.close()
+        
+        # Delete the files used in the calculation or keep them in input_file_name_Gtot_files
+        if delete_files:
+            archive_path = None
+        else:
+            archive_path = input_file_name.split(".")[0]+"_Gtot_files"
+        if workspace is not None:
+            close_workspace(workspace, created_workspace, archive_path)
+        
+        # Report the timings, also of a failed calculation
+        if profile:
+            if profile_file is not None:
+                profiler.write_trace(profile_file)
+            if print_statements:
+                print("\n"+profiler.summary()+"\n")
         
         
-    # Delete files used in the calculation
-    files = ["flatsurfAB.inp", "flatsurfAB.out", "flatsurfAB.tab", "flatsurfAS.inp", "flatsurfAS.out", "flatsurfAS.tab", "flatsurfSB.inp", "flatsurfSB.out", "flatsurfSB.tab"]
-    if delete_files:
-        for i in range(len(files)):
-            if os.path.exists(curr_path+files[i]):
-                os.remove(curr_path+files[i])
-    else:
-        if not os.path.exists(input_file_name.split(".")[0]+"_Gtot_files"):
-            os.makedirs(input_file_name.split(".")[0]+"_Gtot_files")
-        for file in files:
-            if os.path.exists(curr_path+file):
-                os.replace(curr_path+file, input_file_name.split(".")[0]+"_Gtot_files\\"+file)
-                
     np.set_printoptions(suppress = True)
+    
+    # Keep the converged calculation for later analysis and warm starts
+    converged = convergence_flag >= convergence_criteria
+    if results_db is not None and converged:
+        with ResultsStore(results_db) as store:
+            store.add({"input_file": os.path.abspath(input_file_name+".inp"), "compound_list": compound_list, "T": T, 
+                       "parameterization": parameter, "phase_types": phase_types[0]+phase_types[2], "scale_water": scale_water, 
+                       "scale_organic": scale_organic, "solid_scaling": solid_scaling, "gas_scaling": gas_scaling, 
+                       "max_depth": max_depth, "solver_mode": solver_mode, "phase1": phase1, "phase2": phase2, 
+                       "coverage": coverage, "IFT_A": IFT_A_value, "IFT_B": IFT_B_value, "IFT_tot": IFT_tot, 
+                       "iterations": iterations, "converged": converged, "wall_time": time.time()-start_time, 
+                       "timings": profiler.totals() if profile else None})
         
     # Print final result
-    if iterations > max_iterations:
+    if print_statements and iterations > max_iterations:
         print("The script has converged!\nPhase 1:  {} \nCoverage: {} \nPhase 2:  {} \nTotal IFT: {}".format(phase1, coverage, phase2, IFT_tot))
     
+    if return_details:
+        details = {"coverage": coverage, "IFT_A": IFT_A_value, "IFT_B": IFT_B_value, "IFT_tot": IFT_tot, "iterations": iterations,
+                   "converged": converged, "T": T, "compound_list": compound_list, 
+                   "phase1": phase1, "phase2": phase2}
+        if profile:
+            details["timings"] = profiler.totals()
+        return coverage, IFT_tot, details
     return coverage, IFT_tot
 
 if __name__ == "__main__":
@@ -291,7 +510,9 @@ if __name__ == "__main__":
         phase_types = sys.argv[2]
         user = sys.argv[3]
     except:
-        print("Incorrect inputs, run by: python \"script name\" \"input_file_name\"(without extension) \"phase_types(L, S or G)\" \"user_name\"")
+        print("Incorrect inputs, run by: python \"script name\" \"input_file_name\"(without extension) \"phase_types(L, S or G)\" \"user_name\" [--resume]")
         quit()
+    resume = "--resume" in sys.argv[4:]
     
-    coverage_final, IFT_final = calculate_IFT_tot_and_coverage(input_file_name, phase_types, user)
\ No newline at end of file
+    coverage_final, IFT_final = calculate_IFT_tot_and_coverage(input_file_name, phase_types, user, checkpoint_file = change_input_name(input_file_name)[0]+"_checkpoint.npz", 
+                                                               resume = resume)
\ No newline at end of file
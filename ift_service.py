@@ -0,0 +1,348 @@
+from __future__ import print_function,division
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import traceback
+import numpy as np
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from run_liquid_solid import calculate_interface_IFTs, calculate_contact_angle
+from functions import change_input_name, read_users, parse_address
+from input_deck import InputDeck
+from solver_backends import COSMOthermBackend, SyntheticBackend
+
+# This document includes a resident IFT service. The service keeps its worker processes (with NumPy, pandas and the
+# calculation code imported) and the COSMOtherm path of every user, read from Users.txt when it starts, so a job costs
+# only its calculation. A job of a user without a valid path fails, the service never prompts for one.
+# Identical jobs that arrive while the first one is running are merged into one calculation.
+# Run by: python ift_service.py serve [--address 127.0.0.1:48765 or socket_file] [--workers N] [--synthetic latency]
+# Submit by: python ift_service.py submit "input_file_name" "phase_types" "user_name" [--contact_angle] [--address ...]
+#
+# The protocol is one JSON object per line in both directions. A job is
+#     {"id": 1, "kind": "ift", "input_file": "water_hexane.inp", "phase_types": "LL", "user": "LVN", "options": {...}}
+# with kind "ift" (options are keyword arguments of calculate_IFT_tot_and_coverage) or "contact_angle" (a 3 phase input
+# file, phase_types e.g. "WOS"). The service answers {"id": 1, "status": "accepted"} at once and
+# {"id": 1, "status": "done", ...} or {"id": 1, "status": "failed", "error": ...} when the job finishes, so the results
+# of the jobs sent on one connection stream back in the order they finish. {"kind": "ping"} and {"kind": "shutdown"}
+# control the service.
+
+default_address = "127.0.0.1:48765"
+
+
+def _to_json(value):
+    """ Convert np.arrays and numpy numbers in a result to JSON types """
+    if isinstance(value, dict):
+        return dict((key, _to_json(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def run_job(kind, input_file, phase_types, user, backend, options):
+    """ Run one job in a worker process of the service
+
+    Args:
+        kind: "ift" or "contact_angle" as a string
+        input_file: The input file name as a string
+        phase_types: The phase types as a string
+        user: The user initials as a string
+        backend: The solver backend of the user
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage as a dict
+
+    Return:
+        result: The result of the job as a dict of JSON types
+    """
+    start = time.time()
+    options = dict(options)
+    options.setdefault("print_statements", False)
+    if kind == "ift":
+        options.setdefault("save_output_file", False)
+        _, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, user, backend = backend, return_details = True, **options)
+        result = {"IFT": IFT, "coverage": details["coverage"], "IFT_A": details["IFT_A"], "IFT_B": details["IFT_B"],
+                  "iterations": details["iterations"], "converged": details["converged"]}
+    else:
+        # The two phase input files of the interfaces go to a directory of their own, so jobs on the same input do not collide
+        deck = InputDeck.read(change_input_name(input_file)[0])
+        output_path = tempfile.mkdtemp(prefix="ift_service_")
+        try:
+            WO_IFT, WS_IFT, OS_IFT = calculate_interface_IFTs(deck, phase_types, os.path.join(output_path, ""), user, backend = backend, **options)
+        finally:
+            shutil.rmtree(output_path, ignore_errors = True)
+        result = {"WO_IFT": WO_IFT, "WS_IFT": WS_IFT, "OS_IFT": OS_IFT,
+                  "contact_angle": calculate_contact_angle(WO_IFT, WS_IFT, OS_IFT, print_statements = False)}
+    result["wall_time"] = time.time()-start
+    return _to_json(result)
+
+
+def _warm_up():
+    """ Runs once in every worker process, the imports of this module are then done """
+    return os.getpid()
+
+
+class IFTService(object):
+    """ A resident service running IFT and contact angle jobs on a warm worker pool
+
+    Args:
+        N_workers: The number of worker processes, default = None uses half the cores
+        backend: The solver backend of every job, e.g. SyntheticBackend, default = None runs COSMOtherm for the user of the job
+        users_file: The user names and COSMOtherm paths, read once here, default = None uses Users.txt, see read_users
+    """
+    def __init__(self, N_workers = None, backend = None, users_file = None):
+        if N_workers is None:
+            N_workers = max(1, cpu_count()//2)  # Each calculation runs its two flatsurf calculations simultaneously
+        self.N_workers = N_workers
+        self.backend = backend
+        self.users = read_users(users_file) if backend is None else {}  # Read at startup, the event loop never waits for a file or a prompt
+        self.backends = {}  # COSMOthermBackend per user
+        self.in_flight = {}  # Coalescing key: asyncio.Future of the running job
+        self.executor = None
+        self.server = None
+        self.N_jobs = 0
+        self.N_coalesced = 0
+
+    def get_backend(self, user):
+        """ The solver backend of a user, created the first time the user submits a job, ValueError for an unknown user """
+        if self.backend is not None:
+            return self.backend
+        if user not in self.backends:
+            if user not in self.users:
+                raise ValueError("No COSMOtherm path for user {} in Users.txt".format(user))
+            if not os.path.isfile(self.users[user]):
+                raise ValueError("Could not find COSMOtherm for user {} at {}".format(user, self.users[user]))
+            self.backends[user] = COSMOthermBackend(self.users[user])
+        return self.backends[user]
+
+    def job_key(self, job):
+        """ Jobs with the same key give the same result: the same kind, input file content, phase types, user and options """
+        input_file = os.path.abspath(change_input_name(job["input_file"])[0]+".inp")
+        with open(input_file, "rb") as file:
+            content = hashlib.sha1(file.read()).hexdigest()
+        return json.dumps([job.get("kind", "ift"), input_file, content, job.get("phase_types"), job.get("user", ""),
+                           job.get("options", {})], sort_keys = True)
+
+    async def run(self, job):
+        """ Run a job, or wait for the identical job that is already running
+
+        Args:
+            job: The job as a dict, see the protocol at the top of this document
+
+        Return:
+            result: The result of the job as a dict
+            coalesced: If the result came from an identical job that was already running, boolean
+        """
+        key = self.job_key(job)
+        if key in self.in_flight:
+            self.N_coalesced += 1
+            return await asyncio.shield(self.in_flight[key]), True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.in_flight[key] = future
+        self.N_jobs += 1
+        try:
+            kind = job.get("kind", "ift")
+            if kind not in ["ift", "contact_angle"]:
+                raise ValueError("Unknown job kind {}, use \"ift\" or \"contact_angle\"".format(kind))
+            user = job.get("user", "")
+            phase_types = job.get("phase_types", "LL" if kind == "ift" else "WOS")
+            result = await loop.run_in_executor(self.executor, run_job, kind, job["input_file"], phase_types, user,
+                                                self.get_backend(user), job.get("options", {}))
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # Retrieved here, so a job nobody else waits for does not log a warning
+            raise
+        finally:
+            del self.in_flight[key]
+        return result, False
+
+    async def handle_job(self, job, send):
+        """ Run a job from a client and send its result """
+        job_id = job.get("id")
+        await send({"id": job_id, "status": "accepted"})
+        try:
+            result, coalesced = await self.run(job)
+            message = {"id": job_id, "status": "done", "coalesced": coalesced}
+            message.update(result)
+        except (Exception, SystemExit):  # quit() in the calculation raises SystemExit
+            message = {"id": job_id, "status": "failed", "error": traceback.format_exc().strip().split("\n")[-1]}
+        await send(message)
+
+    async def handle_connection(self, reader, writer):
+        """ Read the jobs of a client line by line and stream each result back when it is done """
+        lock = asyncio.Lock()
+        tasks = []
+
+        async def send(message):
+            async with lock:
+                writer.write((json.dumps(message)+"\n").encode("utf-8"))
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    job = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    await send({"status": "failed", "error": "The request is not valid JSON"})
+                    continue
+                kind = job.get("kind", "ift")
+                if kind == "ping":
+                    await send({"id": job.get("id"), "status": "ok", "jobs": self.N_jobs, "coalesced": self.N_coalesced,
+                                "running": len(self.in_flight), "workers": self.N_workers})
+                elif kind == "shutdown":
+                    await send({"id": job.get("id"), "status": "ok"})
+                    self.server.close()
+                    break
+                else:
+                    tasks.append(asyncio.ensure_future(self.handle_job(job, send)))
+            await asyncio.gather(*tasks)
+        except (ConnectionError, OSError):  # The client went away, its jobs still finish for other clients
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, address = default_address, print_statements = True):
+        """ Serve jobs on address until a shutdown request
+
+        Args:
+            address: "host:port", a port number or a Unix socket file name as a string, default = default_address
+            print_statements: Print where the service listens, boolean, default = True
+
+        Return:
+            None
+        """
+        self.executor = ProcessPoolExecutor(max_workers=self.N_workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, _warm_up) for _ in range(self.N_workers)])
+        host, port = parse_address(address)
+        try:
+            if host is None:
+                if os.path.exists(port):
+                    os.remove(port)
+                self.server = await asyncio.start_unix_server(self.handle_connection, path=port)
+            else:
+                self.server = await asyncio.start_server(self.handle_connection, host, port)
+            if print_statements:
+                print("IFT service with {} workers listening on {}".format(self.N_workers, address))
+            async with self.server:
+                try:
+                    await self.server.serve_forever()
+                except asyncio.CancelledError:  # Closed by a shutdown request
+                    pass
+        finally:
+            self.executor.shutdown()
+            if host is None and os.path.exists(port):
+                os.remove(port)
+
+
+def connect(address = default_address, timeout = None):
+    """ Open a connection to the service
+
+    Args:
+        address: The address of the service, see parse_address, default = default_address
+        timeout: Seconds to wait for the service to accept, default = None waits
+
+    Return:
+        connection: The connected socket
+    """
+    host, port = parse_address(address)
+    if host is None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(port)
+    else:
+        connection = socket.create_connection((host, port), timeout)
+    connection.settimeout(None)
+    return connection
+
+
+def submit(jobs, address = default_address):
+    """ Send jobs to the service and yield their results as they finish
+
+    Args:
+        jobs: The jobs as a list of dicts, see the protocol at the top of this document, an "id" is added where it is missing
+        address: The address of the service, default = default_address
+
+    Return:
+        results: A generator of the result dicts, in the order the jobs finish
+    """
+    jobs = [dict(job) for job in jobs]
+    for i, job in enumerate(jobs):
+        job.setdefault("id", i)
+    with connect(address) as connection:
+        connection.sendall("".join(json.dumps(job)+"\n" for job in jobs).encode("utf-8"))
+        N_open = len(jobs)
+        with connection.makefile("r", encoding="utf-8") as file:
+            for line in file:
+                message = json.loads(line)
+                if message["status"] in ["done", "failed"]:
+                    yield message
+                    N_open -= 1
+                    if N_open == 0:
+                        break
+        if N_open > 0:
+            raise ConnectionError("The service closed the connection before {} job(s) finished".format(N_open))
+
+
+def request(message, address = default_address):
+    """ Send a control message, e.g. {"kind": "ping"} or {"kind": "shutdown"}, and return the answer as a dict """
+    with connect(address) as connection:
+        connection.sendall((json.dumps(message)+"\n").encode("utf-8"))
+        with connection.makefile("r", encoding="utf-8") as file:
+            return json.loads(file.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Resident IFT service")
+    commands = parser.add_subparsers(dest = "command")
+    serve_parser = commands.add_parser("serve", help = "Run the service")
+    serve_parser.add_argument("--address", default = default_address, help = "host:port, a port number or a Unix socket file")
+    serve_parser.add_argument("--workers", type = int, default = None, help = "The number of worker processes")
+    serve_parser.add_argument("--synthetic", type = float, default = None, metavar = "LATENCY",
+                              help = "Run every job on the SyntheticBackend with this latency in seconds instead of COSMOtherm")
+    serve_parser.add_argument("--users", default = None, help = "The users file with the COSMOtherm paths, default = Users.txt")
+    submit_parser = commands.add_parser("submit", help = "Calculate an IFT or a contact angle with the service")
+    submit_parser.add_argument("input_file")
+    submit_parser.add_argument("phase_types")
+    submit_parser.add_argument("user")
+    submit_parser.add_argument("--contact_angle", action = "store_true", help = "input_file is a 3 phase input, e.g. phase types WOS")
+    submit_parser.add_argument("--address", default = default_address)
+    for name in ["ping", "shutdown"]:
+        commands.add_parser(name).add_argument("--address", default = default_address)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        backend = SyntheticBackend(latency = args.synthetic) if args.synthetic is not None else None
+        asyncio.run(IFTService(args.workers, backend, args.users).serve(args.address))
+    elif args.command == "submit":
+        job = {"kind": "contact_angle" if args.contact_angle else "ift", "input_file": os.path.abspath(args.input_file),
+               "phase_types": args.phase_types, "user": args.user}
+        for result in submit([job], args.address):
+            print(json.dumps(result, indent = 1))
+            if result["status"] == "failed":
+                sys.exit(1)
+    elif args.command in ["ping", "shutdown"]:
+        print(json.dumps(request({"kind": args.command}, args.address)))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from __future__ import print_function,division
+import re
+import numpy as np
+
+# This document includes the in-memory model of a COSMOtherm input file. The file is read and parsed once, and the
+# flatsurf and sub-system inputs are rendered from memory instead of re-reading the file for every calculation.
+
+
+class InputDeck(object):
+    """ A COSMOtherm input file parsed once
+
+    The last line holds the temperature, liq_ex and the phases. The compound blocks start at the lines with VPfile,
+    and every line up to the next block belongs to the block, so options for a compound on extra lines are kept.
+
+    Args:
+        text: The content of the input file as a string
+        input_file_name: The input file name without extension as a string, default = ""
+
+    Attributes:
+        lines: All lines of the file with line breaks as a list of strings
+        header_lines: The lines before the first compound as a list of strings
+        compound_blocks: The lines of each compound as a list of lists of strings
+        last_line: The last line of the file as a string
+        compound_list: Compound names as a list
+        phases: The phases of the input file as a list of np.arrays
+        N_compounds: The number of compounds as an integer
+        T: The temperature in Kelvin as a float
+        liq_ex: The number of phases in the calculation as an integer, None if liq_ex is missing
+        parameterization: The ctd parameterization as a string, None if it is not found
+        unit_si: unit=si is present, boolean
+        N_unit: The number of times unit is written in the file as an integer
+    """
+    def __init__(self, text, input_file_name = ""):
+        self.input_file_name = input_file_name
+        self.lines = text.splitlines(True)
+        self.last_line = self.lines[-1]
+
+        self.unit_si = re.search(r"unit\ *=\ *[sS][iI]", text) is not None
+        self.N_unit = len(re.findall(r"unit", text))
+        liq_ex = re.search(r"liq_ex=(\d+)", text)
+        self.liq_ex = int(liq_ex.group(1)) if liq_ex else None
+        para = re.findall(r"ctd\ *=\ *\w*", text)
+        self.parameterization = para[0].split()[2] if para and len(para[0].split()) > 2 else None
+
+        T_obj = re.findall(r"t[ckF]=[0-9]+\.*[0-9]*", text)  # Find tc=, tk= or tF=
+        T_list = T_obj[0].split("=")
+        if T_list[0] == "tc":
+            self.T = float(T_list[1])+273.15  # From Celsius to Kelvin
+        elif T_list[0] == "tF":
+            self.T = (float(T_list[1])-32)*(5/9) + 273.15  # From Fahrenheit to Kelvin
+        else:
+            self.T = float(T_list[1])
+
+        phase_object = re.findall(r"[^w]\d\ *=\ *\{[\d \. \ * e \-]*", text)
+        self.N_compounds = len(phase_object[0].split())  # Numbers in the first {} in the file
+        self.phases = []
+        phase_counter = 1
+        for obj in phase_object:
+            if obj[1] == str(phase_counter):
+                self.phases.append(np.array([float(value) for value in obj.split("{")[1].split()]))
+                phase_counter += 1
+
+        compound_object = re.findall(r"f\ *=\ *[\w\S\ ]* VPfile", text)
+        self.compound_list = []
+        for i in range(self.N_compounds):
+            comp = re.findall(r"Comp = \S*", compound_object[i])
+            if comp == []:
+                self.compound_list.append(compound_object[i].split()[2].split(".")[0].strip("\""))
+            else:
+                self.compound_list.append(comp[0].split(" ")[-1].strip("\""))
+
+        # The compound blocks run from a VPfile line to the next VPfile line or the liq_ex line
+        starts = [i for i, line in enumerate(self.lines) if "VPfile" in line or "liq_ex" in line]
+        self.header_lines = self.lines[:starts[0]] if starts else self.lines[:-1]
+        self.compound_blocks = [self.lines[start:end] for start, end in zip(starts[:-1], starts[1:])]
+
+    @classmethod
+    def read(cls, input_file_name):
+        """ Read and parse an input file
+
+        Args:
+            input_file_name: The input file name without extension as a string
+
+        Return:
+            deck: The parsed input file as an InputDeck
+        """
+        with open(input_file_name+".inp", "r") as file:
+            return cls(file.read(), input_file_name)
+
+    def render_flatsurf(self, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth):
+        """ Create the text of a .inp file for a flatsurf calculation, see render_flatsurf_input
+
+        Return:
+            text: The flatsurf input as a string
+        """
+        max_depth_str = ""
+        if phase_types[0] == "S" or phase_types[1] == "S":
+            max_depth_str = "maxdepth={} ".format(max_depth)
+        # All lines except the last from initial file and a new last line
+        text = self.lines[0]
+        text += max_depth_str+" "+self.lines[1]
+        text += "".join(self.lines[2:-1])
+        text += ("tk={0} FLATSURF xf1={{{1}}} xf2={{{2}}} IGNORE_CHARGE IFT={3:.{4}f} \n".
+                 format(T, "  ".join(map(str,phase1)), "  ".join(map(str,phase2)), IFT, IFT_write_length))
+        return text
+
+    def render_subsystem(self, phase1, phase2):
+        """ Create the text of a two phase input file with only the compounds present in phase1 or phase2
+
+        Args:
+            phase1: The first phase with a value for every compound as an array
+            phase2: The second phase with a value for every compound as an array
+
+        Return:
+            text: The input file as a string
+        """
+        compounds_index = [i for i in range(self.N_compounds) if phase1[i] > 0.0 or phase2[i] > 0.0]
+        text = "".join(self.header_lines)
+        for i in compounds_index:
+            text += "".join(self.compound_blocks[i])
+        last_line = self.last_line.split()
+        text += last_line[0] + " " + last_line[1][:-1]+"2"
+        text += " x1={" + " ".join(str(phase1[i]) for i in compounds_index) + "}"
+        text += " x2={" + " ".join(str(phase2[i]) for i in compounds_index) + "}"
+        for token in last_line[2+self.N_compounds*len(self.phases):]:
+            text += " " + token
+        return text
@@ -0,0 +1,175 @@
+from __future__ import print_function,division
+import csv
+import json
+import time
+
+# This document includes the timing instrumentation of a calculation. The code marks its stages with
+# "with get_profiler().section(name):". By default the active profiler is a NullProfiler whose sections do nothing,
+# calculate_IFT_tot_and_coverage(profile = True) activates a Profiler for the duration of the calculation.
+# Stages: lle, render (flatsurf inputs), cosmotherm (solver wall time), parse (.tab files), loop_setup (event loop), cache,
+# extrapolate, update (coverage and IFT updates), output and checkpoint.
+
+
+class _Section(object):
+    """ Adds the wall time of a with block to a stage of the current iteration """
+    __slots__ = ("stages", "name", "start")
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter()-self.start
+        stage = self.stages.get(self.name)
+        if stage is None:
+            self.stages[self.name] = [elapsed, 1]
+        else:
+            stage[0] += elapsed
+            stage[1] += 1
+        return False
+
+
+class _NullSection(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_section = _NullSection()
+
+
+class NullProfiler(object):
+    """ The profiler used when profiling is off, every method does nothing """
+    enabled = False
+
+    def section(self, name):
+        return _null_section
+
+    def add(self, name, seconds, calls = 1):
+        return
+
+    def next_iteration(self, iteration):
+        return
+
+
+class Profiler(object):
+    """ Wall time per stage for every iteration of a calculation
+
+    Time before the first iteration (the LLE, flatsurfAB and the setup) is recorded as iteration 0.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.iterations = [0]
+        self.stages = [{}]
+
+    def section(self, name):
+        """ Time a with block as the stage name of the current iteration
+
+        Args:
+            name: The stage name as a string
+
+        Return:
+            section: A context manager
+        """
+        return _Section(self.stages[-1], name)
+
+    def add(self, name, seconds, calls = 1):
+        """ Add a time measured elsewhere, e.g. the event loop setup time, to the stage name of the current iteration """
+        stage = self.stages[-1].setdefault(name, [0.0, 0])
+        stage[0] += seconds
+        stage[1] += calls
+
+    def next_iteration(self, iteration):
+        """ Record the following sections as iteration
+
+        Args:
+            iteration: The iteration number as an integer
+
+        Return:
+            None
+        """
+        self.iterations.append(iteration)
+        self.stages.append({})
+
+    def totals(self):
+        """ The total time and calls of every stage
+
+        Return:
+            totals: {stage: (seconds, calls)} as a dict
+        """
+        totals = {}
+        for stages in self.stages:
+            for name, (seconds, calls) in stages.items():
+                total = totals.setdefault(name, [0.0, 0])
+                total[0] += seconds
+                total[1] += calls
+        return dict((name, tuple(total)) for name, total in totals.items())
+
+    def summary(self):
+        """ A table of the total, mean per iteration and share of the time of every stage, the slowest first
+
+        Return:
+            table: The summary as a string
+        """
+        totals = self.totals()
+        N_iterations = max(1, len(self.iterations)-1)
+        time_sum = sum(seconds for seconds, _ in totals.values())
+        lines = ["{:<12} {:>10} {:>14} {:>8} {:>8}".format("Stage", "Total [s]", "Per iter [ms]", "Share", "Calls")]
+        for name, (seconds, calls) in sorted(totals.items(), key=lambda item: -item[1][0]):
+            lines.append("{:<12} {:>10.3f} {:>14.3f} {:>7.1f}% {:>8}".format(name, seconds, 1e3*seconds/N_iterations,
+                                                                             100*seconds/time_sum if time_sum > 0 else 0.0, calls))
+        return "\n".join(lines)
+
+    def write_trace(self, file_name):
+        """ Write the time of every stage of every iteration, as JSON for a .json file name and as CSV otherwise
+
+        Args:
+            file_name: The trace file name as a string
+
+        Return:
+            None
+        """
+        rows = []
+        for iteration, stages in zip(self.iterations, self.stages):
+            for name, (seconds, calls) in sorted(stages.items()):
+                rows.append({"iteration": iteration, "stage": name, "seconds": seconds, "calls": calls})
+        with open(file_name, "w") as file:
+            if file_name.endswith(".json"):
+                json.dump({"iterations": rows, "totals": dict((name, {"seconds": seconds, "calls": calls})
+                                                              for name, (seconds, calls) in self.totals().items())}, file, indent=1)
+            else:
+                writer = csv.DictWriter(file, fieldnames=["iteration", "stage", "seconds", "calls"])
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+_profiler = NullProfiler()
+
+
+def get_profiler():
+    """ The active profiler, a NullProfiler unless a calculation is profiled """
+    return _profiler
+
+
+def set_profiler(profiler):
+    """ Make profiler the active profiler
+
+    Args:
+        profiler: The Profiler, or None for no profiling
+
+    Return:
+        previous: The profiler that was active before
+    """
+    global _profiler
+    previous = _profiler
+    _profiler = profiler if profiler is not None else NullProfiler()
+    return previous
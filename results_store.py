@@ -0,0 +1,281 @@
+from __future__ import print_function,division
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+
+# This document includes the results store: a SQLite database with one record per converged calculation, indexed by
+# compounds, parameterization, phase types, temperature and IFT. calculate_IFT_tot_and_coverage(results_db = "results.db")
+# adds every converged calculation, and many calculations (e.g. a batch) can write to the same database at the same time.
+# Run by: python results_store.py "results.db" [--compounds h2o,hexane] [--phase_types LL] [--T_min T] [--T_max T] [--IFT_min IFT] [--IFT_max IFT]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    created REAL,
+    input_file TEXT,
+    compounds TEXT,
+    N_compounds INTEGER,
+    T REAL,
+    parameterization TEXT,
+    phase_types TEXT,
+    scale_water REAL,
+    scale_organic REAL,
+    solid_scaling REAL,
+    gas_scaling REAL,
+    max_depth REAL,
+    solver_mode TEXT,
+    phase1 BLOB,
+    phase2 BLOB,
+    coverage BLOB,
+    IFT_A REAL,
+    IFT_B REAL,
+    IFT_tot REAL,
+    iterations INTEGER,
+    converged INTEGER,
+    wall_time REAL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS results_system ON results (compounds, parameterization, phase_types, T);
+CREATE INDEX IF NOT EXISTS results_T ON results (T);
+CREATE INDEX IF NOT EXISTS results_IFT ON results (IFT_tot);
+"""
+
+_array_columns = ["phase1", "phase2", "coverage"]
+_setting_columns = ["scale_water", "scale_organic", "solid_scaling", "gas_scaling", "max_depth"]  # Settings that change the areas and IFTs
+
+
+def compounds_key(compound_list):
+    """ The compounds of a system as stored in the database, in the order of the input file """
+    return "|".join(compound_list)
+
+
+class ResultsStore(object):
+    """ A SQLite database of converged calculations
+
+    Compositions and coverages are stored as float64 blobs, so they are read back exactly and without parsing.
+
+    Args:
+        db_file: The database file name as a string, created if it does not exist
+        timeout: Seconds to wait for another process writing to the database, default = 60.0
+    """
+    def __init__(self, db_file, timeout = 60.0):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file, timeout = timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writers of a batch
+        self.connection.executescript(_schema)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, record):
+        """ Add a calculation
+
+        Args:
+            record: The calculation as a dict with the columns of the results table, compound_list as a list,
+                    phase1, phase2 and coverage as arrays and timings as a dict, missing columns are NULL
+
+        Return:
+            id: The id of the new record as an integer
+        """
+        row = dict(record)
+        compound_list = row.pop("compound_list")
+        row["compounds"] = compounds_key(compound_list)
+        row["N_compounds"] = len(compound_list)
+        row.setdefault("created", time.time())
+        for column in _array_columns:
+            if row.get(column) is not None:
+                row[column] = np.asarray(row[column], dtype="<f8").tobytes()
+        if row.get("timings") is not None:
+            row["timings"] = json.dumps(row["timings"])
+        if row.get("converged") is not None:
+            row["converged"] = int(bool(row["converged"]))
+        columns = sorted(row)
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO results ({}) VALUES ({})".format(", ".join(columns), ", ".join("?"*len(columns))),
+                                             [row[column] for column in columns])
+        return cursor.lastrowid
+
+    def _rows(self, cursor):
+        """ Records from a query, with the arrays, compound list and timings decoded """
+        names = [description[0] for description in cursor.description]
+        records = []
+        for values in cursor:
+            record = dict(zip(names, values))
+            for column in _array_columns:
+                if record.get(column) is not None:
+                    record[column] = np.frombuffer(record[column], dtype="<f8")
+            if "compounds" in record:
+                record["compound_list"] = record["compounds"].split("|")
+            if record.get("timings") is not None:
+                record["timings"] = json.loads(record["timings"])
+            records.append(record)
+        return records
+
+    def query(self, compound_list = None, phase_types = None, parameterization = None, T_range = None, IFT_range = None, limit = None,
+              settings = None):
+        """ Find calculations by system and by ranges of temperature and IFT
+
+        Args:
+            compound_list: Only this system, compound names in the order of the input file as a list, default = None
+            phase_types: Only these phase types, e.g. "LL", default = None
+            parameterization: Only this parameterization, default = None
+            T_range: (T_min, T_max) in Kelvin, either can be None, default = None
+            IFT_range: (IFT_min, IFT_max) in mN/m, either can be None, default = None
+            limit: The maximum number of records, default = None
+            settings: Only these scale_water, scale_organic, solid_scaling, gas_scaling and max_depth as a dict, missing keys
+                      are not compared, default = None
+
+        Return:
+            records: The matching records as a list of dicts, ordered by temperature
+        """
+        conditions = []
+        values = []
+        settings = {} if settings is None else settings
+        for column, value in [("compounds", None if compound_list is None else compounds_key(compound_list)),
+                              ("phase_types", phase_types), ("parameterization", parameterization)] + \
+                             [(column, settings.get(column)) for column in _setting_columns]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                values.append(value)
+        for column, value_range in [("T", T_range), ("IFT_tot", IFT_range)]:
+            if value_range is not None:
+                if value_range[0] is not None:
+                    conditions.append("{} >= ?".format(column))
+                    values.append(value_range[0])
+                if value_range[1] is not None:
+                    conditions.append("{} <= ?".format(column))
+                    values.append(value_range[1])
+        sql = "SELECT * FROM results"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY T, id"
+        if limit is not None:
+            sql += " LIMIT {}".format(int(limit))
+        return self._rows(self.connection.execute(sql, values))
+
+    def nearest(self, compound_list, phase1, phase2, T, parameterization = None, phase_types = None, k = 5, T_window = 50.0,
+                T_scale = 100.0, settings = None):
+        """ Find the calculations of the same compounds closest in composition and temperature
+
+        The distance is sqrt(|phase1 - phase1'|^2 + |phase2 - phase2'|^2 + ((T - T')/T_scale)^2). The candidates are
+        selected by the index on compounds, parameterization, phase types and T, so only they are compared. Calculations
+        with other area and IFT scaling settings are left out when settings is given.
+
+        Args:
+            compound_list: Compound names in the order of the input file as a list
+            phase1: The composition of phase 1 as an array
+            phase2: The composition of phase 2 as an array
+            T: The temperature in Kelvin as a float
+            parameterization: Only this parameterization, default = None
+            phase_types: Only these phase types, default = None
+            k: The number of records returned, default = 5
+            T_window: Only records within T +/- T_window Kelvin are compared, default = 50.0
+            T_scale: The temperature difference that counts as much as a unit difference in composition, default = 100.0
+            settings: Only calculations with these scaling settings, see query, default = None
+
+        Return:
+            records: The k closest records as a list of dicts, the closest first, each with its "distance"
+        """
+        records = self.query(compound_list, phase_types, parameterization, (T-T_window, T+T_window), settings = settings)
+        if records == []:
+            return []
+        phase1 = np.asarray(phase1, dtype=float)/np.sum(phase1)
+        phase2 = np.asarray(phase2, dtype=float)/np.sum(phase2)
+        stored1 = np.array([record["phase1"] for record in records])
+        stored2 = np.array([record["phase2"] for record in records])
+        stored_T = np.array([record["T"] for record in records])
+        distances = np.sqrt(np.sum((stored1-phase1)**2, axis=1) + np.sum((stored2-phase2)**2, axis=1) + ((stored_T-T)/T_scale)**2)
+        order = np.argsort(distances, kind="stable")[:k]
+        for i in order:
+            records[i]["distance"] = float(distances[i])
+        return [records[i] for i in order]
+
+    def initial_guess(self, compound_list, phase1, phase2, T, parameterization = None, phase_types = None, k = 3, max_distance = 0.2,
+                      settings = None):
+        """ Interpolate a start coverage and IFT from the closest stored calculations, see nearest and interpolate_guess
+
+        Args:
+            compound_list, phase1, phase2, T, parameterization, phase_types: The system, see nearest
+            k: The number of calculations interpolated, default = 3
+            max_distance: Calculations further away than this are not used, default = 0.2
+            settings: Only calculations with these scaling settings, see query, default = None
+
+        Return:
+            guess: The initial guess for calculate_IFT_tot_and_coverage as a dict, or None without close calculations
+        """
+        records = [record for record in self.nearest(compound_list, phase1, phase2, T, parameterization, phase_types, k, settings = settings)
+                   if record["distance"] <= max_distance]
+        return interpolate_guess(records)
+
+
+def interpolate_guess(records):
+    """ Interpolate the coverage and IFTs of stored calculations by inverse distance weighting
+
+    log(coverage), IFT_A and IFT_B are averaged with the weights 1/distance^2, an exact match is copied.
+
+    Args:
+        records: Calculations with coverage, IFT_A, IFT_B and distance, e.g. from ResultsStore.nearest, as a list of dicts
+
+    Return:
+        guess: {"coverage", "IFT_A", "IFT_B", "N_neighbours", "distance"} as a dict, or None without records
+    """
+    if records == []:
+        return None
+    distances = np.array([record["distance"] for record in records])
+    if np.min(distances) < 1e-12:
+        weights = (distances < 1e-12).astype(float)
+    else:
+        weights = 1/distances**2
+    weights /= np.sum(weights)
+    coverages = np.array([record["coverage"] for record in records])
+    liquid = np.all(coverages > 0.0, axis=0)  # The solid and gas compounds have no coverage
+    coverage = np.zeros(coverages.shape[1])
+    coverage[liquid] = np.exp(np.dot(weights, np.log(coverages[:, liquid])))
+    coverage /= np.sum(coverage)
+    return {"coverage": coverage, "IFT_A": float(np.dot(weights, [record["IFT_A"] for record in records])),
+            "IFT_B": float(np.dot(weights, [record["IFT_B"] for record in records])), "N_neighbours": len(records),
+            "distance": float(np.min(distances))}
+
+
+def to_dataframe(records):
+    """ The scalar columns of records as a pandas DataFrame """
+    columns = ["id", "input_file", "compounds", "T", "parameterization", "phase_types", "solver_mode", "IFT_A", "IFT_B", "IFT_tot",
+               "iterations", "converged", "wall_time"]
+    return pd.DataFrame([[record.get(column) for column in columns] for record in records], columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Query the results database")
+    parser.add_argument("db_file")
+    parser.add_argument("--compounds", default = None, help = "Comma separated compound names in the order of the input file")
+    parser.add_argument("--phase_types", default = None)
+    parser.add_argument("--parameterization", default = None)
+    for name in ["T_min", "T_max", "IFT_min", "IFT_max"]:
+        parser.add_argument("--"+name, type = float, default = None)
+    args = parser.parse_args()
+    if not os.path.exists(args.db_file):
+        print("No database at {}".format(args.db_file))
+        sys.exit(1)
+    with ResultsStore(args.db_file) as store:
+        records = store.query(None if args.compounds is None else args.compounds.split(","), args.phase_types, args.parameterization,
+                              (args.T_min, args.T_max), (args.IFT_min, args.IFT_max))
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', 200)
+    print(to_dataframe(records).to_string(index = False))
+
+
+if __name__ == "__main__":
+    main()
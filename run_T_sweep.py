@@ -0,0 +1,174 @@
+from __future__ import print_function,division
+import sys
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from functions import change_input_name, get_user_and_path
+from solver_backends import COSMOthermBackend
+
+# Run by: python run_T_sweep.py "input_file_name" "phase_types" "user_name" "T_start" "T_end" "N_points" ["N_branches"]
+# Temperatures are in Kelvin. Every temperature starts from the converged coverage and IFT of the previous temperatures.
+# With N_branches > 1 the lowest temperature is calculated first and the rest of the grid is split into branches that run
+# at the same time, each starting from that anchor.
+
+
+def write_input_at_T(input_file_name, output_file_name, T):
+    """ Copy a COSMOtherm input file with the temperature replaced
+
+    Args:
+        input_file_name: The input file name without extension as a string
+        output_file_name: The new input file name without extension as a string
+        T: The new temperature in Kelvin as a float
+
+    Return:
+        None
+    """
+    with open(input_file_name+".inp", "r") as file:
+        text = file.read()
+    text = re.sub(r"t[ckF]=[0-9]+\.*[0-9]*", "tk={}".format(T), text, count=1)
+    with open(output_file_name+".inp", "w") as file:
+        file.write(text)
+    return
+
+
+def extrapolate_guess(previous, T):
+    """ Guess the coverage and IFT at a temperature from the converged results at earlier temperatures
+
+    With two earlier results log(coverage), IFT_A and IFT_B are extrapolated linearly in T, with one the result is copied.
+
+    Args:
+        previous: The details of the earlier calculations in the branch, in walking order, as a list of dicts
+        T: The temperature of the next calculation in Kelvin as a float
+
+    Return:
+        guess: The initial guess for calculate_IFT_tot_and_coverage as a dict, or None without earlier results
+    """
+    converged = [details for details in previous if details["converged"]]
+    if converged == []:
+        return None
+    last = converged[-1]
+    if len(converged) == 1 or converged[-2]["T"] == last["T"]:
+        return {"coverage": last["coverage"], "IFT_A": last["IFT_A"], "IFT_B": last["IFT_B"]}
+    before = converged[-2]
+    weight = (T-last["T"])/(last["T"]-before["T"])
+    liquid = (last["coverage"] > 0.0) & (before["coverage"] > 0.0)
+    coverage = np.array(last["coverage"], dtype=float)
+    coverage[liquid] = np.exp(np.log(last["coverage"][liquid]) + weight*(np.log(last["coverage"][liquid])-np.log(before["coverage"][liquid])))
+    coverage /= np.sum(coverage)
+    IFT_A = last["IFT_A"] + weight*(last["IFT_A"]-before["IFT_A"])
+    IFT_B = last["IFT_B"] + weight*(last["IFT_B"]-before["IFT_B"])
+    return {"coverage": coverage, "IFT_A": IFT_A, "IFT_B": IFT_B}
+
+
+def run_sweep_branch(input_file_name, phase_types, T_list, backend, sweep_path, options, previous = None):
+    """ Calculate the IFT at a list of temperatures in order, warm starting each from the previous ones
+
+    Args:
+        input_file_name: The input file name without extension as a string
+        phase_types: The phase types as a string
+        T_list: The temperatures in Kelvin in walking order as a list of floats
+        backend: The solver backend
+        sweep_path: The directory for the input files of each temperature as a string
+        options: Keyword arguments for calculate_IFT_tot_and_coverage as a dict
+        previous: The details of calculations the branch continues from, e.g. the anchor of the sweep, as a list of dicts, default = None
+
+    Return:
+        results: The details of every calculation in T_list as a list of dicts
+    """
+    previous = [] if previous is None else list(previous)
+    results = []
+    for T in T_list:
+        # No dot in the name, the calculation takes the name up to the first dot for its output files
+        T_input = os.path.join(sweep_path, "{}_T{}".format(os.path.basename(input_file_name), "{:.4f}".format(T).replace(".", "_")))
+        write_input_at_T(input_file_name, T_input, T)
+        guess = extrapolate_guess(previous+results, T)
+        _, _, details = calculate_IFT_tot_and_coverage(T_input+".inp", phase_types, "", backend = backend, initial_guess = guess,
+                                                       return_details = True, **options)
+        details["warm_start"] = guess is not None
+        results.append(details)
+    return results
+
+
+def run_T_sweep(input_file_name, phase_types, T_list, backend, N_branches = 1, print_statements = True, **options):
+    """ Calculate the IFT over a temperature grid with warm started, parallel branches
+
+    The sorted grid is walked from low to high temperature and only the first temperature starts cold. With
+    N_branches > 1 the first temperature is calculated as an anchor and the rest of the grid is split into N_branches
+    neighbouring ranges, which run at the same time and start from the anchor. A system with several solutions can
+    then land on another solution in a branch than in a single walk, so the results can depend on N_branches.
+
+    Args:
+        input_file_name: The name of the input file either without extension, with extension or a path, as a string
+        phase_types: The phase types as a string
+        T_list: The temperatures in Kelvin as a list of floats
+        backend: The solver backend
+        N_branches: The number of branches running at the same time, default = 1
+        print_statements: Print the result of every temperature, boolean, default = True
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage
+
+    Return:
+        df: T, IFT, IFT_A, IFT_B, iterations, converged and warm start for every temperature as a pandas DataFrame
+    """
+    input_file_name, _ = change_input_name(input_file_name)
+    T_list = sorted(T_list)
+    N_branches = max(1, min(N_branches, len(T_list)-1))
+    options.setdefault("print_statements", False)
+    options.setdefault("save_output_file", False)
+
+    sweep_path = tempfile.mkdtemp(prefix="ift_T_sweep_")
+    try:
+        if N_branches == 1:
+            results = run_sweep_branch(input_file_name, phase_types, T_list, backend, sweep_path, options)
+        else:
+            # Every branch starts from the same converged anchor, so no branch starts cold
+            results = run_sweep_branch(input_file_name, phase_types, T_list[:1], backend, sweep_path, options)
+            branches = [list(branch) for branch in np.array_split(T_list[1:], N_branches)]
+            with ProcessPoolExecutor(max_workers=N_branches) as executor:
+                futures = [executor.submit(run_sweep_branch, input_file_name, phase_types, branch, backend, sweep_path, options, results[:1])
+                           for branch in branches]
+                for future in futures:
+                    results.extend(future.result())
+    finally:
+        shutil.rmtree(sweep_path, ignore_errors = True)
+
+    df = pd.DataFrame({"T [K]": [details["T"] for details in results],
+                       "IFT [mN/m]": [details["IFT_tot"] for details in results],
+                       "IFT_A": [details["IFT_A"] for details in results],
+                       "IFT_B": [details["IFT_B"] for details in results],
+                       "Iterations": [details["iterations"] for details in results],
+                       "Converged": [details["converged"] for details in results],
+                       "Warm start": [details["warm_start"] for details in results]})
+    if print_statements:
+        print(df.to_string(index=False))
+    return df
+
+
+def main():
+    try:
+        input_file_name = sys.argv[1]
+        phase_types = sys.argv[2]
+        user = sys.argv[3]
+        T_list = np.linspace(float(sys.argv[4]), float(sys.argv[5]), int(sys.argv[6]))
+    except (IndexError, ValueError):
+        print("Incorrect inputs, run by: python run_T_sweep.py \"input_file_name\" \"phase_types\" \"user_name\" \"T_start\" \"T_end\" \"N_points\" [\"N_branches\"]")
+        quit()
+    N_branches = int(sys.argv[7]) if len(sys.argv) > 7 else 1
+
+    backend = COSMOthermBackend(get_user_and_path(user))
+    try:
+        df = run_T_sweep(input_file_name, phase_types, T_list, backend, N_branches = N_branches)
+    finally:
+        backend.close()
+    input_file_name, _ = change_input_name(input_file_name)
+    with open(input_file_name+"_T_sweep_output.txt", "w") as file:
+        file.write(df.to_string(index=False))
+        file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
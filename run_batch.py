@@ -0,0 +1,161 @@
+from __future__ import print_function,division
+import sys
+import os
+import copy
+import time
+import traceback
+import pandas as pd
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from functions import change_input_name, get_N_compounds_and_T, get_user_and_path
+from solver_backends import COSMOthermBackend
+
+# Run by: python run_batch.py "manifest_file or directory" "user_name" ["phase_types"] ["N_cores"]
+# A manifest has one calculation per line: the COSMOtherm input file followed by its phase types, e.g. "water_hexane.inp LL".
+# Lines starting with # are skipped. For a directory all .inp files are calculated with the phase types given (default LL).
+
+
+def read_manifest(manifest, phase_types = "LL"):
+    """ Read the calculations of a batch from a manifest file or a directory of input files
+
+    Args:
+        manifest: Path to a manifest file or a directory as a string
+        phase_types: The phase types used for input files without phase types, default = "LL"
+
+    Return:
+        calculations: (input file, phase types) for each calculation as a list of tuples
+    """
+    calculations = []
+    if os.path.isdir(manifest):
+        for name in sorted(os.listdir(manifest)):
+            if name.endswith(".inp"):
+                calculations.append((os.path.join(manifest, name), phase_types))
+        return calculations
+    base_path = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r") as file:
+        for line in file:
+            split = line.split()
+            if split == [] or split[0].startswith("#"):
+                continue
+            input_file = split[0]
+            if not os.path.isabs(input_file):
+                input_file = os.path.join(base_path, input_file)
+            calculations.append((input_file, split[1] if len(split) > 1 else phase_types))
+    return calculations
+
+
+def estimate_cost(input_file, phase_types):
+    """ Estimate the relative run time of a calculation from its number of compounds
+
+    Args:
+        input_file: The COSMOtherm input file as a string
+        phase_types: The phase types as a string
+
+    Return:
+        cost: The estimated cost as a float, only useful for ordering calculations
+    """
+    N_compounds, _ = get_N_compounds_and_T(change_input_name(input_file)[0])
+    cost = float(N_compounds)**2  # The COSMOtherm interaction terms scale with the number of compound pairs
+    if phase_types.upper() == "LL":
+        cost *= 1.5  # An LLE calculation and more coverage compounds
+    return cost
+
+
+def run_calculation(input_file, phase_types, backend, options):
+    """ Run one calculation of a batch, which gets its own scratch workspace from calculate_IFT_tot_and_coverage
+
+    Args:
+        input_file: The COSMOtherm input file as a string
+        phase_types: The phase types as a string
+        backend: The solver backend
+        options: Keyword arguments for calculate_IFT_tot_and_coverage as a dict
+
+    Return:
+        row: The result of the calculation as a dict
+    """
+    start = time.time()
+    row = {"Input": input_file, "Phase types": phase_types, "IFT [mN/m]": float("nan"), "Coverage": "", "Status": ""}
+    try:
+        row["Compounds"], row["T [K]"] = get_N_compounds_and_T(change_input_name(input_file)[0])
+        coverage, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, "", print_statements = False, save_output_file = False,
+                                                                backend = backend, return_details = True, **options)
+        row["IFT [mN/m]"] = IFT
+        row["Coverage"] = " ".join("{:.6g}".format(c) for c in coverage)
+        row["Status"] = "converged" if details["converged"] else "not converged after {} iterations".format(details["iterations"])
+    except (Exception, SystemExit):  # quit() in the calculation raises SystemExit
+        row["Status"] = "failed: " + traceback.format_exc().strip().split("\n")[-1]
+    row["Wall time [s]"] = time.time()-start
+    return row
+
+
+def run_batch(calculations, backend, N_cores = None, print_statements = True, **options):
+    """ Run many calculations at the same time on a worker pool sized to the host, the most expensive first
+
+    Each calculation runs two flatsurf jobs per iteration. When there are fewer calculations than half the cores,
+    every calculation runs its two jobs simultaneously, otherwise one at a time so all calculations get a core.
+
+    Args:
+        calculations: (input file, phase types) for each calculation as a list of tuples
+        backend: The solver backend, which is copied to every worker process and not changed
+        N_cores: The number of cores to use, default = None uses all cores
+        print_statements: Print each result when it finishes, boolean, default = True
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage
+
+    Return:
+        df: The results of all calculations in the order of the input as a pandas DataFrame
+    """
+    if N_cores is None:
+        N_cores = cpu_count()
+    costs = [estimate_cost(input_file, phase_types) for input_file, phase_types in calculations]
+    order = sorted(range(len(calculations)), key=lambda i: -costs[i])  # Longest first, so no long job starts last
+
+    backend = copy.copy(backend)  # The caller's backend keeps its own multiprocess setting
+    backend.multiprocess = 2*len(calculations) <= N_cores
+    N_workers = max(1, min(len(calculations), N_cores//2 if backend.multiprocess else N_cores))
+
+    rows = [None]*len(calculations)
+    with ProcessPoolExecutor(max_workers=N_workers) as executor:
+        futures = {}
+        for i in order:
+            input_file, phase_types = calculations[i]
+            futures[executor.submit(run_calculation, input_file, phase_types, backend, options)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            rows[i] = future.result()
+            if print_statements:
+                print("{:<40} {:>3} IFT: {:>10.4f} {:>8.1f} s  {}".format(os.path.basename(rows[i]["Input"]), rows[i]["Phase types"],
+                                                                       rows[i]["IFT [mN/m]"], rows[i]["Wall time [s]"], rows[i]["Status"]))
+    columns = ["Input", "Phase types", "Compounds", "T [K]", "IFT [mN/m]", "Wall time [s]", "Status", "Coverage"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def main():
+    try:
+        manifest = sys.argv[1]
+        user = sys.argv[2]
+    except IndexError:
+        print("Incorrect inputs, run by: python run_batch.py \"manifest_file or directory\" \"user_name\" [\"phase_types\"] [\"N_cores\"]")
+        quit()
+    phase_types = sys.argv[3] if len(sys.argv) > 3 else "LL"
+    N_cores = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    calculations = read_manifest(manifest, phase_types)
+    backend = COSMOthermBackend(get_user_and_path(user))
+    start = time.time()
+    try:
+        df = run_batch(calculations, backend, N_cores = N_cores)
+    finally:
+        backend.close()
+    print("\n{} calculations in {:.1f} s".format(len(calculations), time.time()-start))
+
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', 200)
+    output_path = manifest if os.path.isdir(manifest) else os.path.dirname(os.path.abspath(manifest))
+    with open(os.path.join(output_path, "batch_output.txt"), "w") as file:
+        file.write(df.to_string())
+        file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
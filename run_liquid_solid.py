@@ -1,60 +1,228 @@
 from __future__ import print_function,division
+import os
 import sys
+import shutil
+import tempfile
 from os import path, remove
+from multiprocessing import cpu_count
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from ift_from_3phase import calculate_IFT_tot_and_coverage
-from functions import change_input_name, get_comp_and_phases, get_N_compounds_and_T
+from functions import change_input_name
+from input_deck import InputDeck
 
-def input_file_to_IFT(phase1, phase2, phase_types, types, input_file, output_path, user, N_comps, first_comp_line_index, N_lines_p_compound, 
-                      phase1_compounds_index, phase2_compounds_index, phases):
-    with open(input_file+".inp", "r") as file: 
-        text = file.readlines()
-        
-        extra_lines = 0
-        first_value = True
-        with open(output_path+str(phase_types)+"_input.inp", "w") as WS_file:
-            WS_file.writelines(text[:first_comp_line_index])
-            for i in range(N_comps):
-                if i in phase1_compounds_index+phase2_compounds_index:
-                    for j in range(N_lines_p_compound[i]):
-                        WS_file.write(text[first_comp_line_index+i+j+extra_lines])
-                        
-                extra_lines += N_lines_p_compound[i]-1
-            
-            last_line_modified = ""
-            last_line = text[-1]
-            last_line = last_line.split()
-            last_line_modified += last_line[0] + " " + last_line[1][:-1]+"2 x1={"
-            first_value = True
-            for i in range(N_comps):
-                if phase1[i] > 0.0 or phase2[i] > 0.0:
-                    if first_value:
-                        last_line_modified += str(phase1[i])
-                        first_value = False
-                    else:
-                        last_line_modified += " " + str(phase1[i])
-            last_line_modified += "} x2={"
-            first_value = True
-            for i in range(N_comps):
-                if phase1[i] > 0.0 or phase2[i] > 0.0:
-                    if first_value:
-                        last_line_modified += str(phase2[i])
-                        first_value = False
-                    else:
-                        last_line_modified += " " + str(phase2[i])
-            last_line_modified += "}"
-            for i in range(2+N_comps*len(phases), len(last_line)):
-                last_line_modified += " " + last_line[i]
-            WS_file.write(last_line_modified)
-
-    IFT, coverage = calculate_IFT_tot_and_coverage(output_path+str(phase_types)+"_input.inp", types, user, save_output_file = False)
+def input_file_to_IFT(deck, phase1, phase2, phase_types, types, output_path, user, **options):
+    """ Write the two phase input file of an interface and calculate its IFT
+    
+    Args:
+        deck: The parsed input file with all phases as an InputDeck
+        phase1: The first phase with a value for every compound as an array
+        phase2: The second phase with a value for every compound as an array
+        phase_types: The name of the interface, e.g. WO, used in the input file name as a string
+        types: The phase types of the calculation, e.g. LL or LS, as a string
+        output_path: The path of the output files as a string
+        user: The user initials
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage
+    
+    Return:
+        IFT: The calculated IFT
+        coverage: The calculated surface coverage
+    """
+    with open(output_path+str(phase_types)+"_input.inp", "w") as file:
+        file.write(deck.render_subsystem(phase1, phase2))
+
+    coverage, IFT = calculate_IFT_tot_and_coverage(output_path+str(phase_types)+"_input.inp", types, user, save_output_file = False, **options)
     return IFT, coverage
 
+def calculate_interface_IFTs(deck, phase_types, output_path, user, WO_IFT = 0.0, WS_IFT = 0.0, OS_IFT = 0.0, print_statements = True, **options):
+    """ Calculate the water/oil, water/solid and oil/solid IFTs that are not given, all at the same time
+    
+    The interfaces are independent, so they run at the same time, each from its own input file and workspace.
+    
+    Args:
+        deck: The parsed 3 phase input file as an InputDeck
+        phase_types: The order of the water (W), oil (O) and solid (S) phases in the input file as a string, e.g. "WOS"
+        output_path: The path of the output files as a string
+        user: The user initials
+        WO_IFT: The water/oil IFT, 0.0 calculates it, default = 0.0
+        WS_IFT: The water/solid IFT, 0.0 calculates it, default = 0.0
+        OS_IFT: The oil/solid IFT, 0.0 calculates it, default = 0.0
+        print_statements: Print each IFT when it finishes, boolean, default = True
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage, e.g. backend
+    
+    Return:
+        WO_IFT: The water/oil IFT as a float
+        WS_IFT: The water/solid IFT as a float
+        OS_IFT: The oil/solid IFT as a float
+    """
+    water_index = phase_types.index("W")
+    oil_index = phase_types.index("O")
+    solid_index = phase_types.index("S")
+
+    water_phase = deck.phases[water_index]
+    oil_phase = deck.phases[oil_index]
+    solid_phase = deck.phases[solid_index]
+    
+    interfaces = []
+    if WO_IFT == 0.0:
+        interfaces.append(("Water/oil", (deck, water_phase, oil_phase, phase_types[water_index]+phase_types[oil_index], "LL", output_path, user)))
+    if WS_IFT == 0.0:
+        interfaces.append(("Water/solid", (deck, water_phase, solid_phase, phase_types[water_index]+phase_types[solid_index], "LS", output_path, user)))
+    if OS_IFT == 0.0:
+        interfaces.append(("Oil/solid", (deck, oil_phase, solid_phase, phase_types[oil_index]+phase_types[solid_index], "LS", output_path, user)))
+    
+    if print_statements:
+        print("\nCalculating the {} interfaces:\n".format(", ".join(name.lower() for name, _ in interfaces)))
+    options.setdefault("print_statements", False)
+    IFTs = {}
+    with ProcessPoolExecutor(max_workers=max(1, len(interfaces))) as executor:
+        futures = {executor.submit(input_file_to_IFT, *arguments, **options): name for name, arguments in interfaces}
+        for future in as_completed(futures):
+            name = futures[future]
+            IFTs[name], _ = future.result()
+            if print_statements:
+                print("{} IFT: {}".format(name, IFTs[name]))
+    return IFTs.get("Water/oil", WO_IFT), IFTs.get("Water/solid", WS_IFT), IFTs.get("Oil/solid", OS_IFT)
+
+def calculate_contact_angle_matrix(deck, phase_types, user, N_workers = None, print_statements = True, **options):
+    """ Calculate the contact angle of water on every solid in every oil, solving each distinct interface once
+
+    The water/oil interface of an oil is shared by all solids and the water/solid interface of a solid by all oils, so N oils
+    and M solids need N + M + N*M interfaces instead of 3*N*M. Phases with the same composition share their interfaces too.
+    The distinct interfaces run at the same time, each from its own input file and workspace.
+
+    Args:
+        deck: The parsed input file with all phases as an InputDeck
+        phase_types: The role of every phase in the input file as a string, one water (W) and any number of oils (O) and solids (S), e.g. "WOOOSS"
+        user: The user initials
+        N_workers: The number of interfaces calculated at the same time, default = None uses half the cores
+        print_statements: Print each IFT when it finishes, boolean, default = True
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage, e.g. backend
+
+    Return:
+        oils: The phase number (from 1) of every oil as a list
+        solids: The phase number (from 1) of every solid as a list
+        contact_angles: The contact angle in degrees of water on solid j in oil i as an N x M np.array
+        IFTs: The IFT of every interface, e.g. {"W1O2": 35.1, "W1S4": 60.2, "O2S4": 20.3}, as a dict
+    """
+    phase_types = phase_types.upper()
+    if phase_types.count("W") != 1 or phase_types.count("O") == 0 or phase_types.count("S") == 0 or \
+       set(phase_types) != set("WOS") or len(phase_types) != len(deck.phases):
+        print("Warning: Give one water (W), at least one oil (O) and one solid (S) phase for each of the {} phases, not {}.".format(
+            len(deck.phases), phase_types))
+        quit()
+    water = phase_types.index("W")
+    oils = [k for k, phase_type in enumerate(phase_types) if phase_type == "O"]
+    solids = [k for k, phase_type in enumerate(phase_types) if phase_type == "S"]
+
+    # The interfaces of the matrix by name, and the distinct calculations by the types and compositions of their phases
+    names = {}
+    calculations = {}
+    def add(first, second, types):
+        name = "{}{}{}{}".format(phase_types[first], first+1, phase_types[second], second+1)
+        key = (types, tuple(deck.phases[first]), tuple(deck.phases[second]))
+        calculations.setdefault(key, (name, first, second, types))
+        names[name] = key
+    for oil in oils:
+        add(water, oil, "LL")
+    for solid in solids:
+        add(water, solid, "LS")
+    for oil in oils:
+        for solid in solids:
+            add(oil, solid, "LS")
+
+    if N_workers is None:
+        N_workers = max(1, cpu_count()//2)  # Each interface runs its two flatsurf calculations simultaneously
+    if print_statements:
+        print("\nCalculating {} distinct interfaces for {} oil(s) and {} solid(s):\n".format(len(calculations), len(oils), len(solids)))
+    options.setdefault("print_statements", False)
+    IFT_by_key = {}
+    output_path = os.path.join(tempfile.mkdtemp(prefix="ift_screening_"), "")  # The two phase input files of the interfaces
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(N_workers, len(calculations)))) as executor:
+            futures = {}
+            for key, (name, first, second, types) in calculations.items():
+                futures[executor.submit(input_file_to_IFT, deck, deck.phases[first], deck.phases[second], name, types,
+                                        output_path, user, **options)] = key
+            for future in as_completed(futures):
+                key = futures[future]
+                IFT, _ = future.result()
+                IFT_by_key[key] = float(IFT)
+                if print_statements:
+                    print("{} IFT: {}".format(calculations[key][0], IFT_by_key[key]))
+    finally:
+        shutil.rmtree(output_path, ignore_errors = True)
+
+    IFTs = dict((name, IFT_by_key[key]) for name, key in names.items())
+    contact_angles = np.zeros((len(oils), len(solids)))
+    for i, oil in enumerate(oils):
+        for j, solid in enumerate(solids):
+            WO_IFT = IFTs["W{}O{}".format(water+1, oil+1)]
+            WS_IFT = IFTs["W{}S{}".format(water+1, solid+1)]
+            OS_IFT = IFTs["O{}S{}".format(oil+1, solid+1)]
+            contact_angles[i, j] = calculate_contact_angle(WO_IFT, WS_IFT, OS_IFT, print_statements = False)
+    return [oil+1 for oil in oils], [solid+1 for solid in solids], contact_angles, IFTs
+
+def calculate_contact_angle(WO_IFT, WS_IFT, OS_IFT, print_statements = True):
+    """ Calculate the contact angle of water on the solid in oil from Young's equation
+    
+    Args:
+        WO_IFT: The water/oil IFT as a float
+        WS_IFT: The water/solid IFT as a float
+        OS_IFT: The oil/solid IFT as a float
+        print_statements: Print cos(angle) and a warning when it is out of range, boolean, default = True
+    
+    Return:
+        contact_angle: The contact angle in degrees as a float
+    """
+    youngs_eq = (OS_IFT - WS_IFT) / WO_IFT
+    if print_statements:
+        print(youngs_eq)
+    if youngs_eq > 1:
+        if print_statements:
+            print("Warning: Calculated number out of range [-1,1].")
+            print("The calculated number is {}.".format(youngs_eq))
+            print("Using 1 for the angle calculation instead")
+        youngs_eq = 1
+    elif youngs_eq < -1:
+        if print_statements:
+            print("Warning: Calculated number out of range [-1,1].")
+            print("The calculated number is {}.".format(youngs_eq))
+            print("Using -1 for the angle calculation instead")
+        youngs_eq = -1
+    return np.arccos(youngs_eq) * (180/np.pi)
+
+def screening(input, output, phase_types, user):
+    """ Calculate the contact angle matrix of an input file and write it to contact_angle_matrix_output.txt
+    
+    Args:
+        input: The input file name without extension as a string
+        output: The path of the output file as a string
+        phase_types: The role of every phase, water (W), oil (O) or solid (S), as a string, e.g. "WOOOSS"
+        user: The user initials
+    
+    Return:
+        None
+    """
+    deck = InputDeck.read(input)
+    oils, solids, contact_angles, IFTs = calculate_contact_angle_matrix(deck, phase_types, user)
+    
+    df = pd.DataFrame(contact_angles, index=["Oil {}".format(oil) for oil in oils], columns=["Solid {}".format(solid) for solid in solids])
+    df_IFT = pd.DataFrame(list(IFTs.values()), index=list(IFTs.keys()), columns=["IFT"]).sort_index()
+    print("\nContact angles [degrees], phase numbers as in the input file:\n{}".format(df.to_string()))
+    with open(output+"contact_angle_matrix_output.txt", "w") as file:
+        file.write("Contact angles [degrees]:\n{}\n".format(df.to_string()))
+        file.write("\nInterfaces:\n{}\n".format(df_IFT.to_string()))
+        file.write("\nPhase types: {}\n".format(phase_types))
+        file.write("\n\nInitial input:\n")
+        file.write("".join(deck.lines))
+
 def main():
     
     # Use a 3 phase liquid extraction COSMOtherm input file, specify which phases are water, oil and solid in the phase_types variable
-    # and specify which user is running the script in the user variable.
+    # and specify which user is running the script in the user variable, or give them after the input file.
+    # An input file with more oils and solids, e.g. phase types WOOOSS, gives the contact angle matrix of all combinations.
     
     phase_types = "WOS"  # Water (O), Oil (O), Solid (S)
     
@@ -73,85 +241,22 @@ def main():
         input, output = change_input_name(input_file)
     except:
         input = ""
+    if len(sys.argv) > 2:
+        phase_types = sys.argv[2]
+    if len(sys.argv) > 3:
+        user = sys.argv[3]
+    
+    # More than one oil or solid: the contact angle matrix of all combinations
+    if len(phase_types) > 3:
+        screening(input, output, phase_types, user)
+        return
     
     if not(WS_IFT != 0.0 and OS_IFT != 0.0 and WO_IFT != 0.0):
         
-        N_comps, T = get_N_compounds_and_T(input)
-        
-        comp_list, phases = get_comp_and_phases(input, N_comps)
-
-        phase_types_input = ""
-        for i in range(len(phase_types)):
-            if phase_types[i] == "S":
-                phase_types_input += "S"
-            else:
-                phase_types_input += "L"
-        
-        water_index = phase_types.index("W")
-        oil_index = phase_types.index("O")
-        solid_index = phase_types.index("S")
-
-        water_phase = phases[water_index]
-        water_compounds_index = []
-        oil_phase = phases[oil_index]
-        oil_compounds_index = []
-        solid_phase = phases[solid_index]
-        solid_compounds_index = []
-        for i in range(len(comp_list)):
-            if water_phase[i] != 0.0:
-                water_compounds_index.append(i)
-            if oil_phase[i] != 0.0:
-                oil_compounds_index.append(i)
-            if solid_phase[i] != 0.0:
-                solid_compounds_index.append(i)
-        
-        N_lines_p_compound = []   
-        count = 0
-        first_value = True
-        first_comp_line_index = 0
-        
-        with open(input+".inp", "r") as file: 
-            text = file.readlines()
-            for i in range(len(text)):
-                if "VPfile" in text[i] or "liq_ex" in text[i]:
-                    if first_comp_line_index == 0:
-                        first_comp_line_index = i
-                    if len(N_lines_p_compound) == 1 and first_value:
-                        N_lines_p_compound[0] = (count)
-                        first_value = False
-                    else:
-                        N_lines_p_compound.append(count)
-                    count = 0
-                count += 1
-
-            if WO_IFT == 0.0:
-                print("\nCalculating water/oil interface:\n")
-                WO_coverage, WO_IFT = input_file_to_IFT(water_phase, oil_phase, phase_types[water_index]+phase_types[oil_index], "LL", input, output, user, N_comps, 
-                                                        first_comp_line_index, N_lines_p_compound, water_compounds_index, oil_compounds_index, phases)
-            if WS_IFT == 0.0:
-                print("\nCalculating water/solid interface:\n")
-                WS_coverage, WS_IFT = input_file_to_IFT(water_phase, solid_phase, phase_types[water_index]+phase_types[solid_index], "LS", input, output, user, N_comps, 
-                                                        first_comp_line_index, N_lines_p_compound, water_compounds_index, solid_compounds_index, phases)
-            if OS_IFT == 0.0:
-                print("\nCalculating oil/solid interface:\n")
-                OS_coverage, OS_IFT = input_file_to_IFT(oil_phase, solid_phase, phase_types[oil_index]+phase_types[solid_index], "LS", input, output, user, N_comps,
-                                                        first_comp_line_index, N_lines_p_compound, oil_compounds_index, solid_compounds_index, phases)
-
-                                                        
-    youngs_eq = (OS_IFT - WS_IFT) / WO_IFT
-    print(youngs_eq)
-    if youngs_eq > 1:
-        print("Warning: Calculated number out of range [-1,1].")
-        print("The calculated number is {}.".format(youngs_eq))
-        print("Using 1 for the angle calculation instead")
-        youngs_eq = 1
-    elif youngs_eq < -1:
-        print("Warning: Calculated number out of range [-1,1].")
-        print("The calculated number is {}.".format(youngs_eq))
-        print("Using -1 for the angle calculation instead")
-        youngs_eq = -1
-    
-    contact_angle = np.arccos(youngs_eq) * (180/np.pi)
+        deck = InputDeck.read(input)
+        WO_IFT, WS_IFT, OS_IFT = calculate_interface_IFTs(deck, phase_types, output, user, WO_IFT, WS_IFT, OS_IFT)
+
+    contact_angle = calculate_contact_angle(WO_IFT, WS_IFT, OS_IFT)
     print("\nContact angle [degrees]: {:.4}".format(contact_angle))
 
 
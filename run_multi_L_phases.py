@@ -5,17 +5,24 @@ import re
 import traceback
 import pandas as pd
 import numpy as np
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from ift_from_3phase import calculate_IFT_tot_and_coverage
-from functions import change_input_name, get_comp_and_phases, check_phase_types, check_units_get_liq_ex, get_N_compounds_and_T
+from functions import change_input_name, get_comp_and_phases, check_phase_types, check_units_get_liq_ex, get_N_compounds_and_T, get_phases_from_tab, get_user_and_path
+from solver_backends import COSMOthermBackend
 
-def run_IFT(input_file, error_attempts, phase_types, initials):
-    """ Run IFT calculation again if a runtime error occurs
+def run_IFT(input_file, error_attempts, phase_types, initials, backend = None, phases = None, checkpoint_file = None, **options):
+    """ Run IFT calculation again if a runtime error occurs, continuing from the last checkpoint of the failed attempt if there is one
 
     Args:
         input_file: COSMOtherm input file for the IFT calculation
         error_attempts: The number of runtime errors the IFT script can encounter before terminating the calculation
         phase_types: The types of phases in the input file, liquid (L), gas (G) or solid (S)
 		initials: Initials of the person running the script, so it can find the COSMOpath
+        backend: The solver backend, default = None runs COSMOtherm for initials
+        phases: The compositions of the two phases of the interface as a tuple of arrays, default = None runs the LLE of the input file
+        checkpoint_file: Save the state of the calculation to this file, so a new attempt continues from it, default = None (no checkpoint)
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage
         
     Return:
         IFT: The calculated IFT
@@ -23,47 +30,74 @@ def run_IFT(input_file, error_attempts, phase_types, initials):
     """
     for k in range(1,error_attempts+1):
         try:
-            coverage, IFT = calculate_IFT_tot_and_coverage(input_file, phase_types, initials, save_output_file = False, multiprocess = True)
+            coverage, IFT = calculate_IFT_tot_and_coverage(input_file, phase_types, initials, save_output_file = False, multiprocess = True,
+                                                           backend = backend, phases = phases, checkpoint_file = checkpoint_file, 
+                                                           resume = k > 1 and checkpoint_file is not None, **options)
             break
-        except:
+        except Exception:
+            if k == error_attempts:
+                raise  # Reported by the executor of calculate_interfaces
             print("An error occurred, trying again. Try number {}/{}.".format(k, error_attempts))
             traceback.print_exc()
             print(" \n")
-            if k == error_attempts:
-                quit()
-            else:
-                continue
     return IFT, coverage
 
 
-def last_line_conc(last_line, conc):
-    """ Put conc from .tab file into the last_line string
+def calculate_interfaces(input_file, phase_types, backend, error_attempts = 2, N_workers = None, print_statements = True, checkpoint = False,
+                         **options):
+    """ Calculate the IFT and coverage of every interface between neighbouring phases of a liquid extraction
     
+    The LLE is run once and the phases are read from its .tab file. Each interface starts from its two phases directly,
+    so the input file is never changed, and the interfaces run at the same time, each in its own workspace.
+
     Args:
-        last_line: The line which is written in the new input file as a string
-        conc: The concentrations from the .tab file as an array or list
-    
+        input_file: The input file name without extension as a string
+        phase_types: The types of all phases of the liquid extraction as a string
+        backend: The solver backend, which is copied to every worker process and closed at the end
+        error_attempts: The number of runtime errors each interface can encounter before terminating, default = 2
+        N_workers: The number of interfaces calculated at the same time, default = None uses half the cores
+        print_statements: Print each IFT when its interface finishes, or every iteration when the interfaces run one at a time, boolean, default = True
+        checkpoint: Save the state of every interface to input_file_checkpoint_k-(k+1).npz, so a failed attempt continues from it, boolean, default = False
+        options: Further keyword arguments for calculate_IFT_tot_and_coverage
+
     Return:
-        last_line: The line from input now modified to include the conc
+        conc: The composition of every phase as a list of np.arrays
+        ift_list: The IFT of every interface as a list of floats
+        coverage_list: The surface coverage of every interface as a list of np.arrays
     """
-    
-    split = last_line.split()
-    
-    for i in range(len(conc)):
-        for j in range(len(conc[0])):
-            if j == 0:
-                split[2+j+(len(conc[0])*i)] = split[2+j+(len(conc[0])*i)][:4]+str(conc[i][j])
-            elif j == len(conc[0])-1:
-                split[2+j+(len(conc[0])*i)] = str(conc[i][j])+split[2+j+(len(conc[0])*i)][-1]
-            else:
-                split[2+j+(len(conc[0])*i)] = str(conc[i][j])
-    
-    last_line = ""
-    for i in range(len(split)):
-        last_line += split[i]+" "
-    
-    return last_line
-    
+    N_compounds, _ = get_N_compounds_and_T(input_file)
+    try:
+        backend.run_lle(input_file, N_compounds)
+        _, conc = get_phases_from_tab(input_file, N_compounds)
+        N_interfaces = len(conc)-1
+        if N_workers is None:
+            N_workers = max(1, cpu_count()//2)  # Each interface runs its two flatsurf calculations simultaneously
+        N_workers = min(N_workers, N_interfaces)
+        
+        arguments = []
+        for k in range(N_interfaces):
+            checkpoint_file = input_file+"_checkpoint_{}-{}.npz".format(k+1, k+2) if checkpoint else None
+            arguments.append((input_file+".inp", error_attempts, phase_types[k:k+2], "", backend, (conc[k], conc[k+1]), checkpoint_file))
+    
+        ift_list = [None]*N_interfaces
+        coverage_list = [None]*N_interfaces
+        options.setdefault("print_statements", print_statements and N_workers == 1)  # Parallel calculations would print over each other
+        if N_workers == 1:
+            for k in range(N_interfaces):
+                ift_list[k], coverage_list[k] = run_IFT(*arguments[k], **options)
+        else:
+            with ProcessPoolExecutor(max_workers=N_workers) as executor:
+                futures = {executor.submit(run_IFT, *arguments[k], **options): k for k in range(N_interfaces)}
+                for future in as_completed(futures):
+                    k = futures[future]
+                    ift_list[k], coverage_list[k] = future.result()
+                    if print_statements:
+                        print("IFT_{}-{}: {}".format(k+1, k+2, ift_list[k]))
+    finally:
+        backend.close()  # Closes the event loop of the LLE and the interfaces run here, the backend opens a new one if used again
+    return conc, ift_list, coverage_list
+
+
 def main():
     initials = "LVND"
     phase_types = ""  # Leave empty for only liquid phases
@@ -88,79 +122,18 @@ def main():
     phase_types = check_phase_types(phase_types, liq_ex)
     
     if(len(re.findall("[Ll]", phase_types)) != liq_ex):
-        print("Warning: Input types did not match phase types of this script, it only uses liquid (L) phases.")
-        quit()
+        raise ValueError("Input types did not match phase types of this script, it only uses liquid (L) phases.")
     
-	# Initialize calculated concentration lists
-    conc = [[] for _ in range(liq_ex)]
-    ift_list = []
-    coverage_list = []
-    # Initial IFT calculation
-    ift, coverage = run_IFT(input_file, error_attempts, phase_types[:2], initials)
-    ift_list.append(ift)
-    coverage_list.append(coverage)
     N_compounds, T = get_N_compounds_and_T(input_file)
+    backend = COSMOthermBackend(get_user_and_path(initials))
+    conc, ift_list, coverage_list = calculate_interfaces(input_file, phase_types, backend, error_attempts = error_attempts,
+                                                         checkpoint = "--checkpoint" in sys.argv[2:])
     
     # Make the header for printout
-    header = ["Phase 1 ({})".format(phase_types[0]), "Surface 1-2", "Phase 2 ({})".format(phase_types[1])]
-    
-        # Read concentrations from liquid extraction in .tab file
-    with open(input_file+".tab", "r") as file:
-        tab_lines = file.readlines()
-        for i in range(-N_compounds, 0, 1):
-            for j in range(liq_ex):
-                conc[j].append(float(tab_lines[i].split()[j+2]))
-
-	# If liq_ex >= 3, run the next interfaces
-    if liq_ex >= 3:
-        phase_counter = liq_ex
-        save_last_line = 1
-        # Revert the last line
-        for k in range(1, liq_ex-1):  # The first 2 phases is done in the initial calculation 
-            header.extend(["Surface {}-{}".format(k+1, k+2), "Phase {} ({})".format(k+2, phase_types[k+1])])
-            with open(input_file+".inp", "r") as read:
-                read_lines = read.readlines()
-                if save_last_line == 1:
-                    old_last_line = read_lines[-1]
-                    save_last_line = 0
-                last_line = ""
-                phase_names = []
-                phase_first_value = []
-                for i in range(liq_ex):
-                    phase_names.append(old_last_line.split()[2+i*N_compounds].split("=")[0]+"=")
-                    phase_first_value.append(old_last_line.split()[2+i*N_compounds].split("=")[1])
-                value_counter = 0
-                phase_counter -= 1
-                for j in old_last_line.split():
-                    if "=" in j and "{" in j:
-                        last_line += phase_names[phase_counter]
-                        last_line += phase_first_value[value_counter]+" "
-                        value_counter += 1
-                        phase_counter += 1
-                        if phase_counter == liq_ex:
-                            phase_counter = 0
-                    else:
-                        last_line += j+" "
-                # conc into last_line
-                last_line = last_line_conc(last_line, conc)
- 
-                print("\nNew input line:\n", last_line, "\n")
-            # Write the reverted last line
-            with open(input_file+".inp", "w") as write:
-                write.writelines(read_lines[:-1])
-                write.write(last_line)
-
-            # Run the IFT on the reverted concentrations
-            ift, coverage = run_IFT(input_file, error_attempts, phase_types[k:k+2], initials)
-            ift_list.append(ift)
-            coverage_list.append(coverage)
-            
-        # Set .inp file to initial conditions
-        with open(input_file+".inp", "w") as write:
-            write.writelines(read_lines[:-1])
-            write.write(old_last_line)
+    header = ["Phase 1 ({})".format(phase_types[0])]
+    for k in range(liq_ex-1):
+        header.extend(["Surface {}-{}".format(k+1, k+2), "Phase {} ({})".format(k+2, phase_types[k+1])])
         
-    
 	# Change lists to numpy arrays and reshape them
     for i in range(liq_ex):
         conc[i] = np.array(conc[i]).reshape((N_compounds,1))
@@ -0,0 +1,372 @@
+from __future__ import print_function,division
+import time
+import zlib
+from collections import namedtuple
+import numpy as np
+from functions import write_flatsurf_file, get_Gtot_and_Area, get_comp_and_phases_for_LL, get_comp_and_phases
+from multiprocessing import cpu_count
+from instrumentation import get_profiler
+from solver_orchestrator import ProcessOrchestrator
+
+# This document includes the solver backends the IFT calculation talks to. A backend takes flatsurf jobs and
+# returns Gtot and Area for both directions of every job, either by running COSMOtherm or by a synthetic stand-in.
+
+# One flatsurf evaluation: phase1 and phase2 are the compositions on each side of the flat surface and deck is the
+# parsed input file (an InputDeck) the flatsurf input is rendered from
+FlatsurfJob = namedtuple("FlatsurfJob", ["deck", "output_file_name", "phase1", "phase2", "T", "IFT",
+                                         "IFT_write_length", "phase_types", "max_depth", "N_compounds"])
+
+
+class COSMOthermBackend(object):
+    """ Run flatsurf and LLE calculations with the COSMOtherm binary
+
+    A COSMOtherm process that exits with a non-zero status on every attempt raises SolverError, and one that passes
+    call_timeout on every attempt raises SolverTimeoutError, instead of parsing whatever .tab output it left.
+
+    Args:
+        COSMOtherm_path: Path to the COSMOtherm executable as a string
+        multiprocess: Run the jobs of one evaluation simultaneously, boolean, default = True
+        N_cpu: The maximum number of COSMOtherm processes running at the same time, default = 2
+        call_timeout: Kill a COSMOtherm process after this many seconds, default = None (no limit)
+        retries: Start a killed or failed COSMOtherm process again this many times, default = 0
+    """
+    def __init__(self, COSMOtherm_path, multiprocess = True, N_cpu = 2, call_timeout = None, retries = 0):
+        self.COSMOtherm_path = COSMOtherm_path
+        self.multiprocess = multiprocess
+        self.N_cpu = min(N_cpu, cpu_count())
+        self.call_timeout = call_timeout
+        self.retries = retries
+        self.cache_tag = "COSMOtherm "+COSMOtherm_path  # Results from different COSMOtherm installations are cached apart
+        self.orchestrator = ProcessOrchestrator(call_timeout, retries)  # Keeps one event loop for all evaluations
+
+    def _orchestrator(self):
+        # Set per call, so a change of multiprocess (e.g. by run_batch) is respected
+        self.orchestrator.N_concurrent = self.N_cpu if self.multiprocess else 1
+        return self.orchestrator
+
+    def run_lle(self, input_file_name, N_compounds):
+        """ Run the liquid liquid extraction in the input file and read the two phases
+
+        Args:
+            input_file_name: The input file name without extension as a string
+            N_compounds: The number of compounds in the system as an integer
+
+        Return:
+            compound_list: Compound names as a list
+            phase1: Phase 1 as a np.array of floats
+            phase2: Phase 2 as a np.array of floats
+        """
+        with get_profiler().section("lle"):
+            self._orchestrator().run([[self.COSMOtherm_path, input_file_name+".inp"]])
+        with get_profiler().section("parse"):
+            return get_comp_and_phases_for_LL(input_file_name, N_compounds)
+
+    def evaluate(self, jobs):
+        """ Write, run and read a list of flatsurf jobs
+
+        Args:
+            jobs: The flatsurf calculations as a list of FlatsurfJob
+
+        Return:
+            results: (GtotAB, GtotBA, AreaAB, AreaBA) for each job as a list of tuples of np.arrays
+        """
+        profiler = get_profiler()
+        with profiler.section("render"):
+            for job in jobs:
+                write_flatsurf_file(job.deck.input_file_name, job.output_file_name, job.phase1, job.phase2, job.T, job.IFT,
+                                    job.IFT_write_length, job.phase_types, job.max_depth, job.deck)
+        cmds = [[self.COSMOtherm_path, job.output_file_name+".inp"] for job in jobs]
+        with profiler.section("cosmotherm"):  # The COSMOtherm instances run simultaneously unless multiprocess is off
+            self._orchestrator().run(cmds)
+        with profiler.section("parse"):
+            return [get_Gtot_and_Area(job.output_file_name, job.N_compounds) for job in jobs]
+
+    def close(self):
+        """ Close the event loop of the orchestrator, the COSMOtherm processes end with every evaluation
+
+        Return:
+            teardown_time: The wall time in seconds it took to close the event loop as a float
+        """
+        return self.orchestrator.close()
+
+
+class SyntheticBackend(object):
+    """ Deterministic stand-in for COSMOtherm, which needs no license and can be tuned to be slow
+
+    The Gtot and Area values follow a smooth model of each compound's affinity for the two sides of the surface,
+    derived from a hash of the compound name, so the same input always gives the same output.
+
+    Args:
+        latency: Wall time in seconds each flatsurf or LLE calculation takes, default = 0.0
+        write_files: Write .inp and .tab files like COSMOtherm and parse them, boolean, default = True
+        multiprocess: Let the jobs of one evaluation overlap in time, boolean, default = True
+        N_cpu: The number of jobs that can overlap, default = 2
+    """
+    def __init__(self, latency = 0.0, write_files = True, multiprocess = True, N_cpu = 2):
+        self.latency = latency
+        self.write_files = write_files
+        self.multiprocess = multiprocess
+        self.N_cpu = N_cpu
+        self.cache_tag = "synthetic"
+        self.N_calls = 0
+
+    def _sleep(self, N_jobs):
+        if self.latency > 0.0:
+            if self.multiprocess:
+                N_rounds = -(-N_jobs // self.N_cpu)
+            else:
+                N_rounds = N_jobs
+            time.sleep(self.latency*N_rounds)
+
+    def run_lle(self, input_file_name, N_compounds):
+        """ Write a COSMOtherm-like LLE .tab file with the normalized phases of the input file and read it
+
+        Args:
+            input_file_name: The input file name without extension as a string
+            N_compounds: The number of compounds in the system as an integer
+
+        Return:
+            compound_list: Compound names as a list
+            phase1: Phase 1 as a np.array of floats
+            phase2: Phase 2 as a np.array of floats
+        """
+        self.N_calls += 1
+        with get_profiler().section("lle"):
+            self._sleep(1)
+            compound_list, phases = get_comp_and_phases(input_file_name, N_compounds)
+            phases = [phase/np.sum(phase) for phase in phases]
+            write_synthetic_lle_tab(input_file_name, compound_list, phases)
+        with get_profiler().section("parse"):
+            return get_comp_and_phases_for_LL(input_file_name, N_compounds)
+
+    def evaluate(self, jobs):
+        """ Calculate synthetic Gtot and Area for a list of flatsurf jobs
+
+        Args:
+            jobs: The flatsurf calculations as a list of FlatsurfJob
+
+        Return:
+            results: (GtotAB, GtotBA, AreaAB, AreaBA) for each job as a list of tuples of np.arrays
+        """
+        profiler = get_profiler()
+        self.N_calls += len(jobs)
+        results = []
+        for job in jobs:
+            compound_list = job.deck.compound_list
+            if self.write_files:
+                with profiler.section("render"):
+                    write_flatsurf_file(job.deck.input_file_name, job.output_file_name, job.phase1, job.phase2, job.T, job.IFT,
+                                        job.IFT_write_length, job.phase_types, job.max_depth, job.deck)
+            with profiler.section("cosmotherm"):  # The stand-in for the COSMOtherm run
+                result = synthetic_flatsurf(compound_list, job.phase1, job.phase2, job.T, job.IFT)
+                if self.write_files:
+                    write_synthetic_flatsurf_tab(job.output_file_name, compound_list, *result)
+            if self.write_files:
+                with profiler.section("parse"):
+                    result = get_Gtot_and_Area(job.output_file_name, job.N_compounds)
+            results.append(result)
+        start = time.perf_counter()
+        self._sleep(len(jobs))
+        profiler.add("cosmotherm", time.perf_counter()-start, calls = 0)  # The latency of the jobs counted above
+        return results
+
+    def close(self):
+        """ Nothing to shut down, present to match COSMOthermBackend
+
+        Return:
+            teardown_time: Always 0.0
+        """
+        return 0.0
+
+
+def synthetic_compound_parameters(compound_list):
+    """ Get deterministic hydrophilicity and area parameters for each compound from its name
+
+    Args:
+        compound_list: Compound names as a list
+
+    Return:
+        hydrophilicity: Between -1 (oil) and 1 (water) as a np.array
+        area: Molecular area as a np.array
+    """
+    hydrophilicity = np.zeros(len(compound_list))
+    area = np.zeros(len(compound_list))
+    for i, name in enumerate(compound_list):
+        if "h2o" in name:
+            hydrophilicity[i] = 1.0
+            area[i] = 0.4
+        else:
+            crc = zlib.crc32(name.encode("utf-8")) & 0xffffffff
+            hydrophilicity[i] = -1.0 + 1.6*(crc % 1000)/1000.
+            area[i] = 0.5 + 1.5*((crc // 1000) % 1000)/1000.
+    return hydrophilicity, area
+
+
+def synthetic_flatsurf(compound_list, phase1, phase2, T, IFT):
+    """ Calculate smooth, COSMOtherm-like Gtot and Area values for a flat surface between two phases
+
+    Args:
+        compound_list: Compound names as a list
+        phase1: First phase as an array
+        phase2: Second phase as an array
+        T: Temperature in Kelvin as a float
+        IFT: IFT as a float
+
+    Return:
+        GtotAB: Gtot from phase 1 to the surface as a np.array
+        GtotBA: Gtot from phase 2 to the surface as a np.array
+        AreaAB: Area from phase 1 as a np.array
+        AreaBA: Area from phase 2 as a np.array
+    """
+    hydrophilicity, area = synthetic_compound_parameters(compound_list)
+    phase1 = np.asarray(phase1, dtype=float)
+    phase2 = np.asarray(phase2, dtype=float)
+    h1 = np.sum(phase1*hydrophilicity)/np.sum(phase1)
+    h2 = np.sum(phase2*hydrophilicity)/np.sum(phase2)
+    k = 25.*298.15/T  # kJ/mol
+    mismatch1 = (hydrophilicity-h1)**2
+    mismatch2 = (hydrophilicity-h2)**2
+    surface_term = 0.5*IFT*area/1.66  # Surface energy removed when a compound sits in the surface
+    GtotAB = 0.5*k*(mismatch2-mismatch1) - 0.1*surface_term
+    GtotBA = 0.5*k*(mismatch1-mismatch2) - 0.1*surface_term
+    AreaAB = area*(1+0.05*np.tanh(h1-h2))
+    AreaBA = area*(1-0.05*np.tanh(h1-h2))
+    return GtotAB, GtotBA, AreaAB, AreaBA
+
+
+def write_synthetic_flatsurf_tab(output_file_name, compound_list, GtotAB, GtotBA, AreaAB, AreaBA):
+    """ Write a .tab file in the flatsurf layout read by get_Gtot_and_Area
+
+    Args:
+        output_file_name: The file name without extension as a string
+        compound_list: Compound names as a list
+        GtotAB, GtotBA, AreaAB, AreaBA: The values to write as arrays
+
+    Return:
+        None
+    """
+    with open(output_file_name+".tab", "w") as file:
+        for side, Gtot, Area in (("AB", GtotAB, AreaAB), ("BA", GtotBA, AreaBA)):
+            file.write("Flatsurf side {}\n  Compound  Gsolv  Gtot  across  Gmix\n".format(side))
+            for i, name in enumerate(compound_list):
+                file.write("  \"{0}\"  {1:.6f}  {2:.6f}  {3:.6f}  {4:.6f}\n".format(name, 0.0, Gtot[i], Area[i], 0.0))
+    return
+
+
+def write_synthetic_lle_tab(input_file_name, compound_list, phases):
+    """ Write a .tab file in the LLE layout read by get_comp_and_phases_for_LL
+
+    Args:
+        input_file_name: The file name without extension as a string
+        compound_list: Compound names as a list
+        phases: The phases as a list of arrays
+
+    Return:
+        None
+    """
+    with open(input_file_name+".tab", "w") as file:
+        file.write("Liquid extraction\n")
+        file.write("  Nr  Compound  " + "  ".join("phase_{}_x".format(j+1) for j in range(len(phases))) + "\n")
+        for i, name in enumerate(compound_list):
+            file.write("  {}  \"{}\"  ".format(i+1, name) + "  ".join("{:.10f}".format(phase[i]) for phase in phases) + "\n")
+    return
+
+
+class ExtrapolatingBackend(object):
+    """ Solver backend that predicts flatsurf results from a local linear model instead of running the wrapped backend
+
+    Every flatsurf job (e.g. flatsurfAS and flatsurfSB) gets its own model of Gtot and Area against the inputs
+    log(phase1), log(phase2) and IFT, updated by Broyden rank-one updates after each real calculation. A job is
+    predicted when the model was accurate at its last check and the inputs moved less than the trust radius since the
+    last real calculation. Each real calculation checks the prediction the model would have made: an accurate
+    prediction widens the trust radius, an inaccurate one shrinks it and stops predictions until the model is accurate again.
+
+    Args:
+        backend: The solver backend running the real calculations
+        tolerance: The largest accepted prediction error of Gtot in kJ/mol, default = 1e-3
+        max_predictions: The maximum number of predictions in a row before a real calculation, default = 2
+        max_trust_radius: The largest step in the inputs that is predicted, default = 0.2
+    """
+    def __init__(self, backend, tolerance = 1e-3, max_predictions = 2, max_trust_radius = 0.2):
+        self.backend = backend
+        self.tolerance = tolerance
+        self.max_predictions = max_predictions
+        self.max_trust_radius = max_trust_radius
+        self.models = {}
+        self.last_predicted = False  # If any job of the last evaluate call was predicted
+        self.force_check = False  # Run all jobs of the next evaluate call with the wrapped backend
+        self.N_predicted = 0
+
+    @property
+    def cache_tag(self):
+        return self.backend.cache_tag
+
+    def run_lle(self, input_file_name, N_compounds):
+        """ Run the LLE with the wrapped backend, see COSMOthermBackend.run_lle """
+        return self.backend.run_lle(input_file_name, N_compounds)
+
+    def _inputs(self, job):
+        return np.concatenate((np.log(np.maximum(job.phase1, 1e-300)), np.log(np.maximum(job.phase2, 1e-300)), [job.IFT/10.]))
+
+    def evaluate(self, jobs):
+        """ Predict the flatsurf results where the models are trusted and calculate the rest with the wrapped backend
+
+        Args:
+            jobs: The flatsurf calculations as a list of FlatsurfJob
+
+        Return:
+            results: (GtotAB, GtotBA, AreaAB, AreaBA) for each job as a list of tuples of np.arrays
+        """
+        results = [None]*len(jobs)
+        with get_profiler().section("extrapolate"):
+            inputs = [self._inputs(job) for job in jobs]
+            missing = []
+            for i, job in enumerate(jobs):
+                model = self.models.get(job.output_file_name)
+                if not self.force_check and model is not None and model["trusted"] and model["N_predicted"] < self.max_predictions:
+                    step = inputs[i]-model["u"]
+                    if np.max(np.abs(step)) <= model["trust_radius"]:
+                        y = model["y"] + np.dot(model["J"], step)
+                        results[i] = tuple(np.split(y, 4))
+                        model["N_predicted"] += 1
+                        continue
+                missing.append(i)
+            self.force_check = False
+            self.last_predicted = len(missing) < len(jobs)
+            self.N_predicted += len(jobs)-len(missing)
+        if missing:
+            calculated = self.backend.evaluate([jobs[i] for i in missing])
+            for i, result in zip(missing, calculated):
+                self._update_model(jobs[i].output_file_name, inputs[i], np.concatenate(result), len(result[0]))
+                results[i] = result
+        return results
+
+    def _update_model(self, name, u, y, N_compounds):
+        """ Check the prediction of the model against a real calculation and add it to the model by a Broyden update """
+        model = self.models.get(name)
+        if model is None or len(model["u"]) != len(u):
+            self.models[name] = {"u": u, "y": y, "J": np.zeros((len(y), len(u))), "trusted": False,
+                                 "trust_radius": 0.0, "N_predicted": 0}
+            return
+        du = u-model["u"]
+        dy = y-model["y"]
+        step = np.max(np.abs(du))
+        error = dy-np.dot(model["J"], du)
+        # Gtot in kJ/mol must match to the tolerance, areas relative to their size
+        Gtot_error = np.max(np.abs(error[:2*N_compounds]))
+        Area_error = np.max(np.abs(error[2*N_compounds:])/np.maximum(np.abs(y[2*N_compounds:]), 1e-12))
+        if Gtot_error < self.tolerance and Area_error < self.tolerance:
+            model["trusted"] = True
+            model["trust_radius"] = min(max(2*model["trust_radius"], 2*step), self.max_trust_radius)
+        else:
+            model["trusted"] = False
+            model["trust_radius"] = 0.5*step
+        if step > 0.0:
+            model["J"] += np.outer(error, du)/np.dot(du, du)
+        model["u"] = u
+        model["y"] = y
+        model["N_predicted"] = 0
+
+    def close(self):
+        """ Close the wrapped backend, see COSMOthermBackend.close """
+        return self.backend.close()
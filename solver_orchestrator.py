@@ -0,0 +1,185 @@
+from __future__ import print_function,division
+import time
+import asyncio
+from collections import namedtuple
+from instrumentation import get_profiler
+
+# This document includes the asyncio orchestration of the solver processes. The processes of one evaluation are started
+# together and awaited in an event loop, which the orchestrator keeps for all its evaluations, so no worker pool is needed. Every process has a per-call timeout, after which it
+# is killed and optionally started again, and every calculation can have a deadline (see set_deadline), after which the
+# running processes are killed and SolverTimeoutError is raised.
+
+# The outcome of one solver command: returncode is the exit status of the last attempt, None if it was killed
+ProcessResult = namedtuple("ProcessResult", ["cmd", "returncode", "attempts", "timed_out", "wall_time"])
+
+
+class SolverError(RuntimeError):
+    """ A solver process failed with a non-zero exit status on every attempt """
+    def __init__(self, message, result = None):
+        RuntimeError.__init__(self, message)
+        self.result = result
+
+
+class SolverTimeoutError(SolverError):
+    """ A solver process hung on every attempt, or the calculation passed its deadline """
+
+
+_deadline = None
+
+
+def get_deadline():
+    """ The time.monotonic() time the active calculation must finish by, None without a deadline """
+    return _deadline
+
+
+def set_deadline(deadline):
+    """ Make deadline the deadline of the solver calls in this process
+
+    Args:
+        deadline: A time.monotonic() time, or None for no deadline
+
+    Return:
+        previous: The deadline that was active before
+    """
+    global _deadline
+    previous = _deadline
+    _deadline = deadline
+    return previous
+
+
+def check_deadline():
+    """ Raise SolverTimeoutError if the active calculation passed its deadline """
+    if _deadline is not None and time.monotonic() >= _deadline:
+        raise SolverTimeoutError("The calculation passed its time limit")
+
+
+class ProcessOrchestrator(object):
+    """ Run solver commands as concurrent subprocesses in an asyncio event loop
+
+    Args:
+        call_timeout: The longest wall time in seconds of one process before it is killed, default = None (no limit)
+        retries: The number of times a killed or failed process is started again, default = 0
+        N_concurrent: The maximum number of processes running at the same time, default = None (all commands)
+    """
+    def __init__(self, call_timeout = None, retries = 0, N_concurrent = None):
+        self.call_timeout = call_timeout
+        self.retries = retries
+        self.N_concurrent = N_concurrent
+        self.loop = None
+        self.loop_setup_time = 0.0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["loop"] = None  # An event loop can not be copied to another process, the copy creates its own
+        return state
+
+    def __del__(self):
+        # The copy of a backend in a worker process is dropped without close, its event loop is closed with it
+        if getattr(self, "loop", None) is not None and not self.loop.is_closed() and not self.loop.is_running():
+            self.loop.close()
+
+    async def run_process(self, cmd, semaphore = None):
+        """ Run one command until it exits, killing it when it passes the call timeout or the deadline
+
+        Args:
+            cmd: The command as a list of strings
+            semaphore: An asyncio.Semaphore limiting the concurrent processes, default = None
+
+        Return:
+            result: The outcome of the command as a ProcessResult
+        """
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            if semaphore is not None:
+                await semaphore.acquire()
+            try:
+                # After the wait for the semaphore, so the time spent queued counts against the deadline
+                timeout = self.call_timeout
+                deadline = get_deadline()
+                if deadline is not None:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0.0:
+                        raise SolverTimeoutError("The calculation passed its time limit before {} started".format(" ".join(cmd)))
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                returncode = await self._run_once(cmd, timeout)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+            result = ProcessResult(cmd, returncode, attempts, returncode is None, time.monotonic()-start)
+            if returncode == 0:
+                return result
+            if deadline is not None and time.monotonic() >= deadline:
+                raise SolverTimeoutError("The calculation passed its time limit, killed {}".format(" ".join(cmd)), result)
+            if attempts > self.retries:
+                if returncode is None:
+                    raise SolverTimeoutError("{} was killed after {} s in {} attempt(s)".format(" ".join(cmd), self.call_timeout,
+                                                                                              attempts), result)
+                raise SolverError("{} exited with status {} in {} attempt(s)".format(" ".join(cmd), returncode, attempts), result)
+
+    async def _run_once(self, cmd, timeout):
+        """ Start cmd and wait for it, the exit status or None if it was killed after timeout seconds """
+        process = await asyncio.create_subprocess_exec(*cmd)
+        try:
+            if timeout is None:
+                return await process.wait()
+            return await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if process.returncode is None:  # Timed out or cancelled, never leave a hung solver holding a core
+                try:
+                    process.kill()
+                except ProcessLookupError:  # It exited in the meantime
+                    pass
+                await process.wait()
+
+    async def run_async(self, cmds):
+        """ Run commands concurrently and wait for all of them, if one fails the others are killed
+
+        Args:
+            cmds: The commands as a list of lists of strings
+
+        Return:
+            results: A ProcessResult for every command in the order of cmds
+        """
+        semaphore = asyncio.Semaphore(self.N_concurrent) if self.N_concurrent is not None else None
+        tasks = [asyncio.ensure_future(self.run_process(cmd, semaphore)) for cmd in cmds]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self, cmds):
+        """ Run commands concurrently from synchronous code in the event loop of the orchestrator, see run_async
+
+        Args:
+            cmds: The commands as a list of lists of strings
+
+        Return:
+            results: A ProcessResult for every command in the order of cmds
+        """
+        if cmds == []:
+            return []
+        if self.loop is None:  # Created once, not for every evaluation
+            start = time.perf_counter()
+            self.loop = asyncio.new_event_loop()
+            self.loop_setup_time = time.perf_counter()-start
+            get_profiler().add("loop_setup", self.loop_setup_time)
+        return self.loop.run_until_complete(self.run_async(cmds))
+
+    def close(self):
+        """ Close the event loop, a later run creates a new one
+
+        Return:
+            teardown_time: The wall time in seconds it took to close the event loop as a float
+        """
+        start = time.perf_counter()
+        if self.loop is not None:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+            self.loop = None
+        return time.perf_counter()-start
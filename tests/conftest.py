@@ -0,0 +1,20 @@
+from __future__ import print_function,division
+import os
+import sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+from bench_suite import write_system
+
+
+@pytest.fixture
+def synthetic_system(tmp_path):
+    """ Write a synthetic input file (see benchmarks/bench_suite.py) and return its name with extension """
+    def make(phase_types, N_compounds):
+        name = str(tmp_path / "{}_{}".format(phase_types, N_compounds))
+        write_system(name, N_compounds, phase_types)
+        return name+".inp"
+    return make
@@ -0,0 +1,28 @@
+from __future__ import print_function,division
+import os
+import numpy as np
+import pytest
+from run_T_sweep import run_T_sweep, run_sweep_branch
+from solver_backends import SyntheticBackend
+
+
+def test_branches_start_from_the_anchor(synthetic_system):
+    input_file = synthetic_system("LL", 10)
+    T_list = np.linspace(298.15, 348.15, 7)
+    walk = run_T_sweep(input_file, "LL", T_list, SyntheticBackend(), print_statements = False)
+    branches = run_T_sweep(input_file, "LL", T_list, SyntheticBackend(), N_branches = 2, print_statements = False)
+    assert list(walk["Warm start"]) == [False]+[True]*6
+    assert list(branches["Warm start"]) == [False]+[True]*6
+    assert np.allclose(branches["T [K]"], T_list)
+    assert np.allclose(branches["IFT [mN/m]"], walk["IFT [mN/m]"], atol = 1e-2)
+
+
+def test_every_temperature_has_its_own_output_file(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 5)
+    sweep_path = tmp_path / "sweep"
+    sweep_path.mkdir()
+    results = run_sweep_branch(input_file[:-4], "LL", [298.15, 298.65], SyntheticBackend(), str(sweep_path),
+                               {"print_statements": False, "save_output_file": True})
+    assert [details["T"] for details in results] == pytest.approx([298.15, 298.65])
+    assert sorted(name for name in os.listdir(str(sweep_path)) if name.endswith("_output.txt")) == ["LL_5_T298_1500_output.txt",
+                                                                                                     "LL_5_T298_6500_output.txt"]
@@ -0,0 +1,10 @@
+from __future__ import print_function,division
+from bench_suite import compare
+
+
+def test_compare_gates_on_calls_and_memory_but_not_wall_time():
+    baseline = {"iterations": 20, "calls": 41, "wall_time": 0.1, "peak_MB": 1.0}
+    assert compare(dict(baseline, wall_time = 10.0), baseline, 0.25) == []
+    assert compare(dict(baseline, calls = 42), baseline, 0.25) == ["calls 42 > 41"]
+    assert compare(dict(baseline, iterations = None), baseline, 0.25) == []
+    assert len(compare(dict(baseline, peak_MB = 3.0), baseline, 0.25)) == 1
@@ -0,0 +1,33 @@
+from __future__ import print_function,division
+import pytest
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from distributed import LocalCluster, DistributedBackend
+from functions import parse_address
+from solver_backends import SyntheticBackend
+
+
+def run(input_file, phase_types, backend):
+    coverage, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, "", backend = backend, print_statements = False,
+                                                            save_output_file = False, return_details = True)
+    return details
+
+
+@pytest.mark.parametrize("phase_types", ["LL", "SL"])
+def test_local_cluster_gives_the_local_result(synthetic_system, phase_types):
+    input_file = synthetic_system(phase_types, 5)
+    local = run(input_file, phase_types, SyntheticBackend())
+    with LocalCluster(N_workers = 2) as cluster:
+        backend = DistributedBackend(cluster.address)
+        try:
+            distributed = run(input_file, phase_types, backend)
+        finally:
+            backend.close()
+    assert distributed["converged"]
+    assert distributed["IFT_tot"] == pytest.approx(local["IFT_tot"], abs = 1e-4)  # The LLE phases are sent as the text of the .tab file
+    assert distributed["iterations"] == local["iterations"]
+
+
+def test_parse_address():
+    assert parse_address("48766") == ("127.0.0.1", 48766)
+    assert parse_address("node1:48766") == ("node1", 48766)
+    assert parse_address("/tmp/ift.sock") == (None, "/tmp/ift.sock")
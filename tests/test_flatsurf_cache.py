@@ -0,0 +1,29 @@
+from __future__ import print_function,division
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from flatsurf_cache import CachedBackend, FlatsurfCache, canonical_flatsurf_key
+from solver_backends import SyntheticBackend, ExtrapolatingBackend
+
+
+def test_canonical_key_ignores_whitespace_and_comments():
+    text = "ctd = BP_TZVP.ctd\nflatsurf  IFT=20.0\n"
+    assert canonical_flatsurf_key(text, "synthetic") == canonical_flatsurf_key("!! comment\nctd = BP_TZVP.ctd\n\nflatsurf IFT=20.0", "synthetic")
+    assert canonical_flatsurf_key(text, "synthetic") != canonical_flatsurf_key(text, "COSMOtherm C:\\COSMOtherm")
+    assert canonical_flatsurf_key(text, "synthetic") != canonical_flatsurf_key(text.replace("20.0", "20.1"), "synthetic")
+
+
+def test_cached_backend_can_be_wrapped(tmp_path):
+    cached = CachedBackend(SyntheticBackend(), FlatsurfCache(str(tmp_path)))
+    assert cached.cache_tag == "synthetic"
+    assert ExtrapolatingBackend(cached).cache_tag == "synthetic"
+
+
+def test_second_run_is_calculated_from_the_cache(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 5)
+    results = []
+    for _ in range(2):
+        backend = SyntheticBackend()
+        coverage, IFT = calculate_IFT_tot_and_coverage(input_file, "LL", "", backend = backend, print_statements = False,
+                                                       save_output_file = False, cache_dir = str(tmp_path / "cache"))
+        results.append((IFT, backend.N_calls))
+    assert results[1][0] == results[0][0]
+    assert results[1][1] < results[0][1]
@@ -0,0 +1,23 @@
+from __future__ import print_function,division
+import pytest
+from functions import read_last_lines
+
+
+@pytest.mark.parametrize("text", ["a\nb\nc\n", "a\nb\nc", "a\nb\nc\n\n", "a\r\nb\r\nc\r\n\r\n", "a\n\nb\nc\n \n\n", "c\n", "\n\n"])
+@pytest.mark.parametrize("N_lines", [1, 2, 3, 10])
+def test_read_last_lines_is_the_same_with_and_without_mmap(tmp_path, text, N_lines):
+    file_name = str(tmp_path / "file.tab")
+    with open(file_name, "wb") as file:
+        file.write(text.encode("latin-1"))
+    small = read_last_lines(file_name, N_lines)
+    mapped = read_last_lines(file_name, N_lines, mmap_threshold = 0)
+    assert small == mapped
+    assert small == text.rstrip(" \r\n").splitlines()[-N_lines:]
+
+
+def test_read_last_lines_skips_the_empty_lines_at_the_end(tmp_path):
+    file_name = str(tmp_path / "file.tab")
+    with open(file_name, "w") as file:
+        file.write("header\nx 1.0\ny 2.0\n\n")
+    assert read_last_lines(file_name, 2) == ["x 1.0", "y 2.0"]
+    assert read_last_lines(file_name, 2, mmap_threshold = 0) == ["x 1.0", "y 2.0"]
@@ -0,0 +1,170 @@
+from __future__ import print_function,division
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import numpy as np
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from instrumentation import get_profiler
+from solver_backends import SyntheticBackend
+from solver_orchestrator import get_deadline
+from trajectory import read_trajectory
+
+
+class FailingLLEBackend(SyntheticBackend):
+    """ A synthetic backend whose LLE raises the given exception """
+    def __init__(self, exception):
+        SyntheticBackend.__init__(self)
+        self.exception = exception
+        self.closed = False
+
+    def run_lle(self, input_file_name, N_compounds):
+        raise self.exception
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("exception", [RuntimeError("LLE failed"), KeyboardInterrupt()])
+def test_failed_lle_restores_the_deadline_and_profiler(synthetic_system, exception):
+    input_file = synthetic_system("LL", 3)
+    profiler = get_profiler()
+    deadline = get_deadline()
+    backend = FailingLLEBackend(exception)
+    with pytest.raises(type(exception)):
+        calculate_IFT_tot_and_coverage(input_file, "LL", "", backend = backend, print_statements = False, save_output_file = False,
+                                       calculation_timeout = 60.0, profile = True)
+    assert get_profiler() is profiler
+    assert get_deadline() == deadline
+    assert not backend.closed  # The caller's backend is left open
+
+
+def test_caller_backend_is_left_open(synthetic_system):
+    backend = FailingLLEBackend(None)
+    calculate_IFT_tot_and_coverage(synthetic_system("SL", 3), "SL", "", backend = backend, print_statements = False, save_output_file = False)
+    assert not backend.closed
+
+
+def run(input_file, phase_types, **options):
+    backend = SyntheticBackend()
+    coverage, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, "", backend = backend, print_statements = False,
+                                                            return_details = True, **options)
+    return details, backend.N_calls
+
+
+@pytest.mark.parametrize("phase_types", ["LL", "SL"])
+def test_resume_from_checkpoint_continues_the_calculation(synthetic_system, tmp_path, phase_types):
+    input_file = synthetic_system(phase_types, 5)
+    checkpoint_file = str(tmp_path / "checkpoint.npz")
+    full, full_calls = run(input_file, phase_types, save_output_file = False)
+    interrupted, interrupted_calls = run(input_file, phase_types, save_output_file = False, max_iterations = 5, checkpoint_file = checkpoint_file)
+    assert not interrupted["converged"]
+    assert os.path.exists(checkpoint_file)
+    resumed, resumed_calls = run(input_file, phase_types, save_output_file = False, checkpoint_file = checkpoint_file, resume = True)
+    assert resumed["converged"]
+    assert resumed["IFT_tot"] == pytest.approx(full["IFT_tot"], abs = 1e-3)
+    assert resumed["iterations"] > 5  # The iteration count continues from the checkpoint
+    assert resumed_calls < full_calls
+    assert not os.path.exists(checkpoint_file)
+
+
+def test_checkpoint_of_another_system_is_ignored(synthetic_system, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.npz")
+    run(synthetic_system("SL", 5), "SL", save_output_file = False, max_iterations = 5, checkpoint_file = checkpoint_file)
+    resumed, _ = run(synthetic_system("SL", 6), "SL", save_output_file = False, checkpoint_file = checkpoint_file, resume = True)
+    full, _ = run(synthetic_system("SL", 6), "SL", save_output_file = False)
+    assert resumed["iterations"] == full["iterations"]
+
+
+
+def test_resume_truncates_the_text_output_to_the_checkpoint(synthetic_system, tmp_path):
+    input_file = synthetic_system("SL", 5)
+    checkpoint_file = str(tmp_path / "checkpoint.npz")
+    output_file = input_file.split(".")[0]+"_output.txt"
+    run(input_file, "SL", max_iterations = 5, checkpoint_file = checkpoint_file)
+    with open(output_file, "a") as file:
+        file.write("written after the checkpoint\n")
+    resumed, _ = run(input_file, "SL", checkpoint_file = checkpoint_file, resume = True)
+    with open(output_file, "r") as file:
+        lines = file.readlines()
+    assert len(lines) == resumed["iterations"]+1
+    assert "written after the checkpoint\n" not in lines
+
+
+def test_binary_trajectory_has_a_record_per_iteration(synthetic_system):
+    input_file = synthetic_system("SL", 5)
+    details, _ = run(input_file, "SL", output_format = "binary")
+    records = read_trajectory(input_file.split(".")[0]+"_trajectory.npy")
+    assert len(records) == details["iterations"]
+    assert list(records["iteration"]) == list(range(1, details["iterations"]+1))
+    assert records["IFT_tot"][-1] == pytest.approx(details["IFT_tot"])
+    assert np.allclose(records["coverage"][-1], details["coverage"])
+
+
+def test_resumed_binary_trajectory_continues_at_the_checkpoint(synthetic_system, tmp_path):
+    input_file = synthetic_system("SL", 5)
+    checkpoint_file = str(tmp_path / "checkpoint.npz")
+    run(input_file, "SL", output_format = "binary", max_iterations = 5, checkpoint_file = checkpoint_file)
+    resumed, _ = run(input_file, "SL", output_format = "binary", checkpoint_file = checkpoint_file, resume = True)
+    records = read_trajectory(input_file.split(".")[0]+"_trajectory.npy")
+    assert list(records["iteration"]) == list(range(1, resumed["iterations"]+1))
+
+
+class WorkspaceBackend(SyntheticBackend):
+    """ A synthetic backend that records the directories of its flatsurf files and can fail after some evaluations """
+    def __init__(self, fail_after = None):
+        SyntheticBackend.__init__(self)
+        self.fail_after = fail_after
+        self.directories = set()
+
+    def evaluate(self, jobs):
+        self.directories.update(os.path.dirname(job.output_file_name) for job in jobs)
+        if self.fail_after is not None and self.N_calls >= self.fail_after:
+            raise RuntimeError("flatsurf failed")
+        return SyntheticBackend.evaluate(self, jobs)
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    """ A temp directory of its own, so the workspaces left behind can be counted """
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    monkeypatch.setattr("tempfile.tempdir", str(temp_dir))
+    return temp_dir
+
+
+def test_simultaneous_calculations_get_their_own_workspace(synthetic_system, temp_dir):
+    input_file = synthetic_system("LL", 5)
+    backends = [WorkspaceBackend() for _ in range(4)]
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        IFTs = list(executor.map(lambda backend: calculate_IFT_tot_and_coverage(input_file, "LL", "", backend = backend, print_statements = False,
+                                                                                save_output_file = False)[1], backends))
+    assert IFTs == pytest.approx([IFTs[0]]*4)
+    directories = [backend.directories for backend in backends]
+    assert all(len(directory) == 1 for directory in directories)
+    assert len(set.union(*directories)) == 4
+    assert all(os.path.dirname(directory) == str(temp_dir) for directory, in directories)
+    assert os.listdir(str(temp_dir)) == []
+
+
+def test_workspace_is_removed_when_the_calculation_fails(synthetic_system, temp_dir):
+    with pytest.raises(RuntimeError):
+        calculate_IFT_tot_and_coverage(synthetic_system("LL", 5), "LL", "", backend = WorkspaceBackend(fail_after = 6), print_statements = False,
+                                       save_output_file = False)
+    assert os.listdir(str(temp_dir)) == []
+
+
+def test_kept_flatsurf_files_are_moved_out_of_the_workspace(synthetic_system, temp_dir):
+    input_file = synthetic_system("LL", 5)
+    calculate_IFT_tot_and_coverage(input_file, "LL", "", backend = SyntheticBackend(), print_statements = False, save_output_file = False,
+                                   delete_files = False)
+    assert os.listdir(str(temp_dir)) == []
+    assert "flatsurfAS.tab" in os.listdir(input_file[:-4]+"_Gtot_files")
+
+
+def test_given_scratch_path_is_kept_without_the_flatsurf_files(synthetic_system, tmp_path):
+    scratch_path = tmp_path / "scratch"
+    scratch_path.mkdir()
+    (scratch_path / "other.txt").write_text(u"not from the calculation")
+    calculate_IFT_tot_and_coverage(synthetic_system("LL", 5), "LL", "", backend = SyntheticBackend(), print_statements = False,
+                                   save_output_file = False, scratch_path = str(scratch_path))
+    assert os.listdir(str(scratch_path)) == ["other.txt"]
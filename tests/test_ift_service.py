@@ -0,0 +1,63 @@
+from __future__ import print_function,division
+import time
+import socket
+import asyncio
+import threading
+import pytest
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from ift_service import IFTService, submit, request
+from solver_backends import SyntheticBackend, COSMOthermBackend
+
+
+@pytest.fixture
+def service():
+    """ A service on the synthetic backend in a thread of this process, so its counters can be checked """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        address = "127.0.0.1:{}".format(probe.getsockname()[1])
+    service = IFTService(N_workers = 2, backend = SyntheticBackend(latency = 0.05))
+    thread = threading.Thread(target = asyncio.run, args = (service.serve(address, print_statements = False),))
+    thread.start()
+    for _ in range(200):
+        try:
+            request({"kind": "ping"}, address)
+            break
+        except (ConnectionError, OSError):
+            time.sleep(0.05)
+    yield service, address
+    request({"kind": "shutdown"}, address)
+    thread.join(30)
+
+
+def test_identical_jobs_are_calculated_once(service, synthetic_system):
+    service, address = service
+    input_file = synthetic_system("SL", 5)
+    _, IFT = calculate_IFT_tot_and_coverage(input_file, "SL", "", backend = SyntheticBackend(), print_statements = False,
+                                            save_output_file = False)
+    jobs = [{"id": i, "input_file": input_file, "phase_types": "SL", "user": ""} for i in range(3)]
+    results = list(submit(jobs, address))
+    assert sorted(result["id"] for result in results) == [0, 1, 2]
+    assert all(result["status"] == "done" for result in results)
+    assert [result["IFT"] for result in results] == pytest.approx([IFT]*3)
+    assert sum(result["coalesced"] for result in results) == 2
+    answer = request({"kind": "ping"}, address)
+    assert answer["jobs"] == 1 and answer["coalesced"] == 2
+
+
+def test_failed_job_is_reported(service, tmp_path):
+    service, address = service
+    result, = submit([{"input_file": str(tmp_path / "missing.inp"), "phase_types": "LL", "user": ""}], address)
+    assert result["status"] == "failed"
+
+
+def test_unknown_user_fails_without_prompting(tmp_path, monkeypatch):
+    users_file = str(tmp_path / "Users.txt")
+    with open(users_file, "w") as file:
+        file.write("Name: AB\nPath: {}\n\nName: CD\nPath: {}\n".format(__file__, tmp_path / "missing"))
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("The service prompted for input"))
+    service = IFTService(N_workers = 1, users_file = users_file)
+    assert isinstance(service.get_backend("AB"), COSMOthermBackend)
+    with pytest.raises(ValueError):
+        service.get_backend("XY")
+    with pytest.raises(ValueError):
+        service.get_backend("CD")
@@ -0,0 +1,106 @@
+from __future__ import print_function,division
+import re
+import numpy as np
+import pytest
+from input_deck import InputDeck
+
+
+# A hand written input file with names from the file names, tc= and an option line in a compound block
+text = ("ctd = BP_TZVP_C30_1601.ctd cdir = \"C:\\COSMO\\CTDATA-FILES\" ldir = \"C:\\COSMO\\licensefiles\"\n"
+        "unit=si notempty wtln ehfile\n"
+        "!! written by hand !!\n"
+        "f = \"h2o.cosmo\" fdir=\"C:\\COSMO\\DB\" VPfile\n"
+        "f = \"hexane_c0.cosmo\" fdir=\"C:\\COSMO\\DB\" Comp = hexane VPfile\n"
+        "  fconf = \"hexane_c1.cosmo\"\n"
+        "f = \"ethanol_c0.cosmo\" fdir=\"C:\\COSMO\\DB\" VPfile\n"
+        "tc=25.0 liq_ex=3 x1={0.9 0.0 0.1} x2={0.01 0.89 0.1} x3={0.0 0.0 1.0} ncsurf\n")
+
+
+def baseline_parse(text):
+    """ The regular expressions the input file was parsed with before InputDeck, applied to the text """
+    T_list = re.findall(r"t[ckF]=[0-9]+\.*[0-9]*", text)[0].split("=")
+    if T_list[0] == "tc":
+        T = float(T_list[1])+273.15
+    elif T_list[0] == "tF":
+        T = (float(T_list[1])-32)*(5/9) + 273.15
+    else:
+        T = float(T_list[1])
+    N_compounds = len(re.findall(r"[^w]\d\ *=\ *\{[\d \. \ * e \-]*", text)[0].split())
+    compound_object = re.findall(r"f\ *=\ *[\w\S\ ]* VPfile", text)
+    phase_object = re.findall(r"[^w]\d\ *=\ *\{[\d \. \ * e \-]*", text)
+    compound_list = []
+    for i in range(N_compounds):
+        comp = re.findall(r"Comp = \S*", compound_object[i])
+        if comp == []:
+            compound_list.append(compound_object[i].split()[2].split(".")[0].strip("\""))
+        else:
+            compound_list.append(comp[0].split(" ")[-1].strip("\""))
+    phases = []
+    phase_counter = 1
+    for obj in phase_object:
+        phase = []
+        if obj[1] == str(phase_counter):
+            for k in obj.split():
+                if re.findall(r"[^w]\d\ *=\ *\{", k) != []:
+                    phase.append(float(k.split("{")[1]))
+                else:
+                    phase.append(float(k))
+            phases.append(np.array(phase))
+            phase_counter += 1
+    liq_ex = int(re.findall(r"liq_ex=\d", text)[0][-1])
+    parameterization = re.findall(r"ctd\ *=\ *\w*", text)[0].split()[2]
+    return N_compounds, T, compound_list, phases, liq_ex, parameterization
+
+
+def baseline_render_flatsurf(lines, phase1, phase2, T, IFT, IFT_write_length, phase_types, max_depth):
+    """ The flatsurf input as it was rendered from the file before InputDeck """
+    max_depth_str = ""
+    if phase_types[0] == "S" or phase_types[1] == "S":
+        max_depth_str = "maxdepth={} ".format(max_depth)
+    rendered = lines[0]
+    rendered += max_depth_str+" "+lines[1]
+    rendered += "".join(lines[2:-1])
+    rendered += ("tk={0} FLATSURF xf1={{{1}}} xf2={{{2}}} IGNORE_CHARGE IFT={3:.{4}f} \n".
+                 format(T, "  ".join(map(str,phase1)), "  ".join(map(str,phase2)), IFT, IFT_write_length))
+    return rendered
+
+
+def read_text(synthetic_system, source):
+    if source == "hand written":
+        return text
+    with open(synthetic_system(*source), "r") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("source", ["hand written", ("LL", 10), ("WOS", 5), ("LLL", 50)])
+def test_deck_matches_the_baseline_parser(synthetic_system, source):
+    text = read_text(synthetic_system, source)
+    deck = InputDeck(text, "input")
+    N_compounds, T, compound_list, phases, liq_ex, parameterization = baseline_parse(text)
+    assert deck.N_compounds == N_compounds and deck.T == T and deck.liq_ex == liq_ex
+    assert deck.compound_list == compound_list and deck.parameterization == parameterization
+    assert len(deck.phases) == len(phases) == liq_ex
+    for phase, baseline_phase in zip(deck.phases, phases):
+        assert np.array_equal(phase, baseline_phase)
+    assert deck.unit_si and deck.N_unit == 1
+
+
+@pytest.mark.parametrize("source", ["hand written", ("LS", 10)])
+@pytest.mark.parametrize("phase_types", ["LL", "LS"])
+def test_flatsurf_input_matches_the_baseline(synthetic_system, source, phase_types):
+    text = read_text(synthetic_system, source)
+    deck = InputDeck(text, "input")
+    phase1, phase2 = deck.phases[0]/np.sum(deck.phases[0]), deck.phases[1]/np.sum(deck.phases[1])
+    assert deck.render_flatsurf(phase1, phase2, 298.15, 23.456789, 4, phase_types, 10.0) == \
+        baseline_render_flatsurf(text.splitlines(True), phase1, phase2, 298.15, 23.456789, 4, phase_types, 10.0)
+
+
+def test_subsystem_keeps_the_blocks_of_the_present_compounds():
+    deck = InputDeck(text, "input")
+    assert len(deck.header_lines) == 3 and [len(block) for block in deck.compound_blocks] == [1, 2, 1]
+    subsystem = deck.render_subsystem(deck.phases[1], deck.phases[2])  # h2o and hexane in phase 2, ethanol in both
+    assert subsystem == "".join(deck.lines[:3]) + "".join(deck.lines[3:7]) + "tc=25.0 liq_ex=2 x1={0.01 0.89 0.1} x2={0.0 0.0 1.0} ncsurf"
+    subsystem = deck.render_subsystem(deck.phases[2], deck.phases[2])
+    assert subsystem == "".join(deck.lines[:3]) + deck.lines[6] + "tc=25.0 liq_ex=2 x1={1.0} x2={1.0} ncsurf"
+    parsed = InputDeck(subsystem)
+    assert parsed.compound_list == ["ethanol_c0"] and parsed.liq_ex == 2 and parsed.T == deck.T
@@ -0,0 +1,55 @@
+from __future__ import print_function,division
+import csv
+import json
+import time
+import pytest
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from instrumentation import Profiler, NullProfiler, get_profiler
+from solver_backends import SyntheticBackend
+
+
+def test_totals_add_up_the_stages_of_every_iteration(tmp_path):
+    profiler = Profiler()
+    profiler.add("lle", 1.0)
+    for iteration in [1, 2, 3]:
+        profiler.next_iteration(iteration)
+        profiler.add("cosmotherm", 0.5, calls = 2)
+        profiler.add("update", 0.1)
+        with profiler.section("parse"):
+            time.sleep(0.01)
+    totals = profiler.totals()
+    assert totals["lle"] == (1.0, 1)
+    assert totals["cosmotherm"] == (pytest.approx(1.5), 6)
+    assert totals["update"] == (pytest.approx(0.3), 3)
+    assert totals["parse"][0] >= 0.03 and totals["parse"][1] == 3
+    assert [line.split()[0] for line in profiler.summary().splitlines()] == ["Stage", "cosmotherm", "lle", "update", "parse"]
+
+    profiler.write_trace(str(tmp_path / "trace.json"))
+    with open(str(tmp_path / "trace.json")) as file:
+        trace = json.load(file)
+    assert len(trace["iterations"]) == 10
+    assert trace["totals"]["cosmotherm"] == {"seconds": pytest.approx(1.5), "calls": 6}
+    profiler.write_trace(str(tmp_path / "trace.csv"))
+    with open(str(tmp_path / "trace.csv")) as file:
+        rows = list(csv.DictReader(file))
+    assert sum(float(row["seconds"]) for row in rows if row["stage"] == "update") == pytest.approx(0.3)
+    assert [row["iteration"] for row in rows if row["stage"] == "lle"] == ["0"]
+
+
+def test_profiled_calculation_accounts_for_the_solver_time(synthetic_system, tmp_path):
+    profile_file = str(tmp_path / "profile.json")
+    backend = SyntheticBackend(latency = 0.02)
+    start = time.perf_counter()
+    _, _, details = calculate_IFT_tot_and_coverage(synthetic_system("LL", 5), "LL", "", backend = backend, print_statements = False,
+                                                   save_output_file = False, return_details = True, profile_file = profile_file)
+    wall_time = time.perf_counter()-start
+    assert isinstance(get_profiler(), NullProfiler)
+    with open(profile_file) as file:
+        trace = json.load(file)
+    totals = trace["totals"]
+    assert totals["lle"]["calls"] == 1
+    assert totals["cosmotherm"]["calls"] == backend.N_calls-1  # Every flatsurf calculation, the LLE is timed as lle
+    assert totals["cosmotherm"]["seconds"] >= 0.02*details["iterations"]  # Two flatsurf calculations per iteration on 2 cores
+    assert totals["update"]["calls"] == details["iterations"]
+    assert max(row["iteration"] for row in trace["iterations"]) == details["iterations"]
+    assert sum(total["seconds"] for total in totals.values()) <= wall_time
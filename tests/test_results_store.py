@@ -0,0 +1,105 @@
+from __future__ import print_function,division
+import numpy as np
+import pytest
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from results_store import ResultsStore, interpolate_guess
+from run_T_sweep import write_input_at_T
+from solver_backends import SyntheticBackend
+
+
+compound_list = ["h2o", "hexane", "ethanol"]
+settings = {"scale_water": 1.0, "scale_organic": 1.0, "solid_scaling": 1.0, "gas_scaling": 1.0, "max_depth": 10.0}
+
+
+def record(T, IFT, coverage = (0.2, 0.3, 0.5), phase1 = (0.9, 0.05, 0.05), phase2 = (0.01, 0.89, 0.1), **changes):
+    """ A converged calculation of the test system as stored by calculate_IFT_tot_and_coverage """
+    values = dict(settings, compound_list = compound_list, T = T, parameterization = "BP_TZVP", phase_types = "LL",
+                  phase1 = np.array(phase1), phase2 = np.array(phase2), coverage = np.array(coverage), IFT_A = IFT/2,
+                  IFT_B = IFT/2, IFT_tot = IFT, iterations = 10, converged = True, timings = {"cosmotherm": 1.5})
+    values.update(changes)
+    return values
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultsStore(str(tmp_path / "results.db")) as store:
+        yield store
+
+
+def test_add_and_query_round_trip(store):
+    coverage = np.array([0.1, 1/3., 0.5666666666666667])
+    store.add(record(298.15, 40.0, coverage = coverage))
+    records = store.query(compound_list, "LL", "BP_TZVP")
+    assert len(records) == 1
+    assert records[0]["compound_list"] == compound_list
+    assert np.array_equal(records[0]["coverage"], coverage)
+    assert records[0]["timings"] == {"cosmotherm": 1.5}
+    assert records[0]["converged"] == 1
+
+
+def test_query_ranges(store):
+    for T, IFT in [(280.0, 45.0), (300.0, 40.0), (320.0, 35.0)]:
+        store.add(record(T, IFT))
+    assert [r["T"] for r in store.query(T_range = (290.0, None))] == [300.0, 320.0]
+    assert [r["T"] for r in store.query(IFT_range = (None, 40.0))] == [300.0, 320.0]
+    assert store.query(compound_list[:2]) == []
+
+
+def test_nearest_leaves_out_other_scaling_settings(store):
+    store.add(record(298.15, 40.0, scale_water = 0.5))
+    store.add(record(308.15, 38.0))
+    records = store.nearest(compound_list, [0.9, 0.05, 0.05], [0.01, 0.89, 0.1], 298.15, "BP_TZVP", "LL", settings = settings)
+    assert [r["T"] for r in records] == [308.15]
+    assert len(store.nearest(compound_list, [0.9, 0.05, 0.05], [0.01, 0.89, 0.1], 298.15, "BP_TZVP", "LL")) == 2
+
+
+def test_initial_guess_copies_an_exact_match(store):
+    store.add(record(298.15, 40.0, coverage = (0.2, 0.3, 0.5)))
+    store.add(record(308.15, 30.0, coverage = (0.4, 0.3, 0.3)))
+    guess = store.initial_guess(compound_list, [0.9, 0.05, 0.05], [0.01, 0.89, 0.1], 298.15, "BP_TZVP", "LL", settings = settings)
+    assert guess["distance"] == 0.0
+    assert np.allclose(guess["coverage"], [0.2, 0.3, 0.5])
+    assert guess["IFT_A"] == 20.0
+
+
+def test_initial_guess_without_close_calculations(store):
+    store.add(record(298.15, 40.0, max_depth = 5.0))
+    assert store.initial_guess(compound_list, [0.9, 0.05, 0.05], [0.01, 0.89, 0.1], 298.15, "BP_TZVP", "LL", settings = settings) is None
+    assert store.initial_guess(compound_list, [0.05, 0.9, 0.05], [0.01, 0.89, 0.1], 298.15, "BP_TZVP", "LL") is None
+
+
+def test_interpolate_guess_weights_by_inverse_square_distance():
+    records = [{"coverage": np.array([0.2, 0.8, 0.0]), "IFT_A": 10.0, "IFT_B": 20.0, "distance": 0.1},
+               {"coverage": np.array([0.8, 0.2, 0.0]), "IFT_A": 40.0, "IFT_B": 50.0, "distance": 0.2}]
+    guess = interpolate_guess(records)
+    assert guess["IFT_A"] == pytest.approx(0.8*10.0+0.2*40.0) and guess["IFT_B"] == pytest.approx(0.8*20.0+0.2*50.0)
+    coverage = np.exp(0.8*np.log([0.2, 0.8])+0.2*np.log([0.8, 0.2]))
+    assert np.allclose(guess["coverage"], np.append(coverage/np.sum(coverage), 0.0))  # The solid keeps no coverage
+    assert guess["N_neighbours"] == 2 and guess["distance"] == 0.1
+    exact = interpolate_guess(records+[dict(records[1], distance = 0.0)])
+    assert np.allclose(exact["coverage"], [0.8, 0.2, 0.0]) and exact["IFT_A"] == 40.0
+    assert interpolate_guess([]) is None
+
+
+def run(input_file, **options):
+    backend = SyntheticBackend()
+    _, IFT, details = calculate_IFT_tot_and_coverage(input_file, "LL", "", backend = backend, print_statements = False, save_output_file = False,
+                                                     return_details = True, **options)
+    return IFT, details["iterations"], backend.N_calls
+
+
+def test_warm_start_from_close_calculations(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 10)
+    results_db = str(tmp_path / "results.db")
+    cold = run(input_file)
+    assert run(input_file, results_db = results_db, warm_start = True) == cold  # Nothing stored yet, so it starts from flatsurfAB
+
+    write_input_at_T(input_file[:-4], str(tmp_path / "warmer"), 303.15)
+    warm = run(str(tmp_path / "warmer.inp"), results_db = results_db, warm_start = True)
+    reference = run(str(tmp_path / "warmer.inp"))
+    assert warm[0] == pytest.approx(reference[0], abs = 1e-3)
+    assert warm[2] < reference[2]
+
+    again = run(input_file, results_db = results_db, warm_start = True)  # Starts from the exact match
+    assert again[0] == pytest.approx(cold[0], abs = 1e-3)
+    assert again[2] < warm[2]
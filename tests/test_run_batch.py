@@ -0,0 +1,13 @@
+from __future__ import print_function,division
+from run_batch import run_batch
+from solver_backends import SyntheticBackend
+
+
+def test_batch_reports_the_status_and_leaves_the_backend_alone(synthetic_system):
+    calculations = [(synthetic_system("LL", 2), "LL"), (synthetic_system("LS", 10), "LS")]
+    backend = SyntheticBackend(multiprocess = True)
+    df = run_batch(calculations, backend, N_cores = 2, print_statements = False)
+    assert backend.multiprocess is True
+    assert list(df["Status"]) == ["converged", "converged"]
+    df = run_batch(calculations, backend, N_cores = 2, print_statements = False, max_iterations = 3)
+    assert all(status.startswith("not converged") for status in df["Status"])
@@ -0,0 +1,63 @@
+from __future__ import print_function,division
+import time
+import numpy as np
+import pytest
+from bench_suite import CountingBackend
+from input_deck import InputDeck
+from run_liquid_solid import calculate_interface_IFTs, calculate_contact_angle_matrix, calculate_contact_angle, input_file_to_IFT
+from solver_backends import SyntheticBackend
+
+
+def test_interfaces_run_at_the_same_time(synthetic_system, tmp_path):
+    deck = InputDeck.read(synthetic_system("WOS", 5)[:-4])
+    output_path = str(tmp_path / "serial_")
+    start = time.perf_counter()
+    serial = [input_file_to_IFT(deck, deck.phases[first], deck.phases[second], name, types, output_path, "", print_statements = False,
+                                backend = SyntheticBackend(latency = 0.05))[0]
+              for first, second, name, types in [(0, 1, "WO", "LL"), (0, 2, "WS", "LS"), (1, 2, "OS", "LS")]]
+    serial_time = time.perf_counter()-start
+    start = time.perf_counter()
+    concurrent = calculate_interface_IFTs(deck, "WOS", str(tmp_path / "concurrent_"), "", print_statements = False,
+                                          backend = SyntheticBackend(latency = 0.05))
+    assert concurrent == pytest.approx(serial)
+    assert time.perf_counter()-start < 0.75*serial_time
+
+
+def test_given_interfaces_are_not_calculated(synthetic_system, tmp_path):
+    name = synthetic_system("WOS", 5)[:-4]
+    deck = InputDeck.read(name)
+    all_IFTs = calculate_interface_IFTs(deck, "WOS", str(tmp_path / "all_"), "", print_statements = False,
+                                        backend = CountingBackend(SyntheticBackend(), name+"_all_calls"))
+    backend = CountingBackend(SyntheticBackend(), name+"_calls")
+    WO_IFT, WS_IFT, OS_IFT = calculate_interface_IFTs(deck, "WOS", str(tmp_path / "given_"), "", WO_IFT = 12.5, OS_IFT = 7.5,
+                                                      print_statements = False, backend = backend)
+    assert (WO_IFT, OS_IFT) == (12.5, 7.5)
+    assert WS_IFT == pytest.approx(all_IFTs[1])
+    assert 0 < backend.N_calls() < CountingBackend(None, name+"_all_calls").N_calls()/2
+
+
+def test_screening_matrix_calculates_each_distinct_interface_once(synthetic_system, tmp_path):
+    name = synthetic_system("WOOSS", 5)[:-4]  # The two solids have the same composition
+    deck = InputDeck.read(name)
+    backend = CountingBackend(SyntheticBackend(), name+"_calls")
+    oils, solids, contact_angles, IFTs = calculate_contact_angle_matrix(deck, "WOOSS", "", N_workers = 2, print_statements = False, backend = backend)
+    assert (oils, solids) == ([2, 3], [4, 5])
+    assert sorted(IFTs) == ["O2S4", "O2S5", "O3S4", "O3S5", "W1O2", "W1O3", "W1S4", "W1S5"]
+    assert IFTs["W1S4"] == IFTs["W1S5"] and IFTs["O2S4"] == IFTs["O2S5"] and IFTs["O3S4"] == IFTs["O3S5"]
+    assert IFTs["W1O2"] != IFTs["W1O3"]
+
+    # The solver calls of the 5 distinct interfaces, not of the 8 in the matrix or 12 for 3 per contact angle
+    N_calls = 0
+    for first, second, types in [(0, 1, "LL"), (0, 2, "LL"), (0, 3, "LS"), (1, 3, "LS"), (2, 3, "LS")]:
+        serial = SyntheticBackend()
+        IFT, _ = input_file_to_IFT(deck, deck.phases[first], deck.phases[second], "serial", types, str(tmp_path / "serial_"), "",
+                                   print_statements = False, backend = serial)
+        assert IFT == pytest.approx(IFTs["{}{}{}{}".format("WOOSS"[first], first+1, "WOOSS"[second], second+1)])
+        N_calls += serial.N_calls
+    assert backend.N_calls() == N_calls
+
+    for i, oil in enumerate(oils):
+        for j, solid in enumerate(solids):
+            assert contact_angles[i, j] == pytest.approx(calculate_contact_angle(IFTs["W1O{}".format(oil)], IFTs["W1S{}".format(solid)],
+                                                                                 IFTs["O{}S{}".format(oil, solid)], print_statements = False))
+    assert np.array_equal(contact_angles[:, 0], contact_angles[:, 1])
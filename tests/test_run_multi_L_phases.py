@@ -0,0 +1,37 @@
+from __future__ import print_function,division
+import glob
+import pytest
+from run_multi_L_phases import calculate_interfaces
+from solver_backends import SyntheticBackend
+
+
+class ClosingBackend(SyntheticBackend):
+    """ A synthetic backend that records if it was closed """
+    closed = False
+
+    def close(self):
+        self.closed = True
+        return SyntheticBackend.close(self)
+
+
+class FailingBackend(SyntheticBackend):
+    """ A synthetic backend whose flatsurf calculations fail """
+    def evaluate(self, jobs):
+        raise RuntimeError("flatsurf failed")
+
+
+def test_parallel_interfaces_match_sequential_and_leave_no_checkpoints(synthetic_system):
+    name = synthetic_system("LLL", 5)[:-4]
+    sequential = ClosingBackend()
+    _, sequential_IFTs, _ = calculate_interfaces(name, "LLL", sequential, N_workers = 1, print_statements = False)
+    parallel = ClosingBackend()
+    _, parallel_IFTs, _ = calculate_interfaces(name, "LLL", parallel, N_workers = 2, print_statements = False)
+    assert parallel_IFTs == pytest.approx(sequential_IFTs)
+    assert sequential.closed and parallel.closed
+    assert glob.glob(name+"_checkpoint*") == []
+
+
+def test_failed_interface_is_raised(synthetic_system):
+    name = synthetic_system("LLL", 5)[:-4]
+    with pytest.raises(RuntimeError):
+        calculate_interfaces(name, "LLL", FailingBackend(), error_attempts = 1, N_workers = 2, print_statements = False)
@@ -0,0 +1,115 @@
+from __future__ import print_function,division
+import os
+import time
+import numpy as np
+import pytest
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from input_deck import InputDeck
+from solver_backends import FlatsurfJob, SyntheticBackend, ExtrapolatingBackend
+
+
+def make_jobs(input_file, directory, IFTs):
+    """ One flatsurf job between the two phases of the input file for every IFT """
+    deck = InputDeck.read(input_file[:-4])
+    phase1, phase2 = deck.phases[0]/np.sum(deck.phases[0]), deck.phases[1]/np.sum(deck.phases[1])
+    return [FlatsurfJob(deck, os.path.join(str(directory), "flatsurf_{}".format(k)), phase1, phase2, deck.T, IFT, 4, "LL", 10.0,
+                        deck.N_compounds) for k, IFT in enumerate(IFTs)]
+
+
+def test_synthetic_backend_counts_every_calculation(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 5)
+    backend = SyntheticBackend()
+    compound_list, phase1, phase2 = backend.run_lle(input_file[:-4], 5)
+    assert backend.N_calls == 1
+    assert len(compound_list) == 5 and np.sum(phase1) == pytest.approx(1.0) and np.sum(phase2) == pytest.approx(1.0)
+    assert len(backend.evaluate(make_jobs(input_file, tmp_path, [20.0, 30.0, 40.0]))) == 3
+    assert backend.N_calls == 4
+
+
+def test_synthetic_backend_is_deterministic(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 10)
+    jobs = make_jobs(input_file, tmp_path, [20.0, 30.0])
+    first = SyntheticBackend().evaluate(jobs)
+    second = SyntheticBackend().evaluate(jobs)
+    unwritten = SyntheticBackend(write_files = False).evaluate(jobs)
+    for a, b, c in zip(first, second, unwritten):
+        for values_a, values_b, values_c in zip(a, b, c):
+            assert np.array_equal(values_a, values_b)
+            assert np.allclose(values_a, values_c, atol = 1e-6)  # The .tab files hold 6 decimals
+    assert not np.allclose(first[0][0], first[1][0])  # The IFT changes Gtot
+    assert os.path.exists(jobs[0].output_file_name+".inp") and os.path.exists(jobs[0].output_file_name+".tab")
+
+
+def test_synthetic_calculation_repeats_exactly(synthetic_system):
+    input_file = synthetic_system("SL", 10)
+    results = []
+    for _ in range(2):
+        backend = SyntheticBackend()
+        _, IFT = calculate_IFT_tot_and_coverage(input_file, "SL", "", backend = backend, print_statements = False, save_output_file = False)
+        results.append((IFT, backend.N_calls))
+    assert results[0] == results[1]
+
+
+def test_synthetic_latency_runs_N_cpu_jobs_at_a_time(synthetic_system, tmp_path):
+    jobs = make_jobs(synthetic_system("LL", 2), tmp_path, [20.0]*4)
+    for options, rounds in [({"N_cpu": 2}, 2), ({"N_cpu": 4}, 1), ({"multiprocess": False}, 4)]:
+        start = time.perf_counter()
+        SyntheticBackend(latency = 0.1, write_files = False, **options).evaluate(jobs)
+        assert 0.1*rounds <= time.perf_counter()-start < 0.1*rounds+0.1
+
+
+class QuadraticBackend(SyntheticBackend):
+    """ Gtot grows with the square of the IFT, which a linear model never predicts to the tolerance """
+    def evaluate(self, jobs):
+        self.N_calls += len(jobs)
+        return [(np.full(job.N_compounds, job.IFT**2), -np.full(job.N_compounds, job.IFT**2), np.ones(job.N_compounds),
+                 np.ones(job.N_compounds)) for job in jobs]
+
+
+def test_extrapolation_predicts_within_the_trusted_region(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 10)
+    backend = ExtrapolatingBackend(SyntheticBackend(write_files = False))
+    for IFT in [20.0, 21.0, 22.0]:  # The synthetic Gtot is linear in the IFT, so the third calculation confirms the model
+        backend.evaluate(make_jobs(input_file, tmp_path, [IFT]))
+    assert backend.backend.N_calls == 3 and backend.N_predicted == 0
+    for IFT in [23.0, 24.0]:
+        job, = make_jobs(input_file, tmp_path, [IFT])
+        predicted, = backend.evaluate([job])
+        calculated, = SyntheticBackend(write_files = False).evaluate([job])
+        for values_predicted, values_calculated in zip(predicted, calculated):
+            assert np.allclose(values_predicted, values_calculated, atol = 1e-6)
+    assert backend.backend.N_calls == 3 and backend.N_predicted == 2 and backend.last_predicted
+
+
+def test_extrapolation_falls_back_to_the_wrapped_backend(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 10)
+    backend = ExtrapolatingBackend(SyntheticBackend(write_files = False))
+    for IFT in [20.0, 21.0, 22.0, 23.0, 24.0]:
+        backend.evaluate(make_jobs(input_file, tmp_path, [IFT]))
+    backend.evaluate(make_jobs(input_file, tmp_path, [25.0]))  # After max_predictions in a row
+    assert backend.backend.N_calls == 4 and not backend.last_predicted
+    backend.evaluate(make_jobs(input_file, tmp_path, [35.0]))  # Outside the trust radius
+    assert backend.backend.N_calls == 5 and not backend.last_predicted
+    backend.force_check = True  # As for the convergence check of the calculation
+    backend.evaluate(make_jobs(input_file, tmp_path, [35.5]))
+    assert backend.backend.N_calls == 6 and not backend.force_check
+
+
+def test_inaccurate_extrapolation_is_not_used(synthetic_system, tmp_path):
+    input_file = synthetic_system("LL", 2)
+    backend = ExtrapolatingBackend(QuadraticBackend())
+    for IFT in np.linspace(20.0, 21.0, 6):
+        backend.evaluate(make_jobs(input_file, tmp_path, [IFT]))
+    assert backend.backend.N_calls == 6 and backend.N_predicted == 0
+
+
+def test_extrapolated_calculation_matches_the_calculated_one(synthetic_system):
+    input_file = synthetic_system("LS", 10)
+    results = []
+    for extrapolate in [False, True]:
+        backend = SyntheticBackend()
+        _, IFT = calculate_IFT_tot_and_coverage(input_file, "LS", "", backend = backend, print_statements = False, save_output_file = False,
+                                                extrapolate = extrapolate)
+        results.append((IFT, backend.N_calls))
+    assert results[1][0] == pytest.approx(results[0][0], abs = 1e-3)
+    assert results[1][1] < results[0][1]
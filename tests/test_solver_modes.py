@@ -0,0 +1,101 @@
+from __future__ import print_function,division
+import time
+import pytest
+import numpy as np
+from ift_from_3phase import calculate_IFT_tot_and_coverage
+from solver_backends import SyntheticBackend
+
+
+class RoundCountingBackend(SyntheticBackend):
+    """ Counts the evaluations, i.e. the rounds of flatsurf calculations a calculation waits for one after the other """
+    def __init__(self, *args, **kwargs):
+        SyntheticBackend.__init__(self, *args, **kwargs)
+        self.N_rounds = 0
+
+    def evaluate(self, jobs):
+        self.N_rounds += 1
+        return SyntheticBackend.evaluate(self, jobs)
+
+
+def run(input_file, phase_types, **options):
+    backend = SyntheticBackend()
+    coverage, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, "", backend = backend, print_statements = False,
+                                                            save_output_file = False, return_details = True, max_iterations = 400, **options)
+    assert details["converged"]
+    return details, backend.N_calls
+
+
+@pytest.mark.parametrize("phase_types, N_compounds", [("LL", 2), ("LL", 10), ("SL", 50), ("GL", 10), ("GL", 200)])
+def test_anderson_finds_the_damped_solution(synthetic_system, phase_types, N_compounds):
+    input_file = synthetic_system(phase_types, N_compounds)
+    damped, damped_calls = run(input_file, phase_types)
+    mixed, mixed_calls = run(input_file, phase_types, solver_mode = "anderson")
+    assert mixed["IFT_tot"] == pytest.approx(damped["IFT_tot"], abs = 1e-3)
+    assert mixed["IFT_A"] >= 0.0 and mixed["IFT_B"] >= 0.0
+    assert mixed_calls <= damped_calls
+
+
+def test_calculate_CF_is_unchanged_without_relative():
+    from functions import calculate_CF
+    coverage = np.array([0.5, 0.3, 0.2])
+    coverage_new = np.array([5.0, 3.0, 0.2])
+    CF = np.clip(np.power(coverage_new/coverage, 0.5), 1/2.0, 2.0)
+    expected = coverage*CF/np.sum(coverage*CF)
+    assert np.allclose(calculate_CF(np.copy(coverage), coverage_new, 0.5, 2.0, np.arange(3)), expected)
+    assert not np.allclose(calculate_CF(np.copy(coverage), coverage_new, 0.5, 2.0, np.arange(3), relative = True), expected)
+
+
+def test_fixed_damping_converges(synthetic_system):
+    details, _ = run(synthetic_system("LL", 10), "LL", adaptive_damping = False)
+    assert details["IFT_A"] > 0.0 and details["IFT_B"] > 0.0
+
+
+@pytest.mark.parametrize("phase_types, N_compounds, IFT, iterations", [("LL", 10, 34.2346, 23), ("LS", 10, 24.7491, 21), ("SL", 50, 5.3204, 21),
+                                                                       ("GL", 200, 15.6071, 22)])
+def test_default_damping_results(synthetic_system, phase_types, N_compounds, IFT, iterations):
+    details, _ = run(synthetic_system(phase_types, N_compounds), phase_types)
+    assert details["IFT_tot"] == pytest.approx(IFT, abs = 1e-3)
+    assert details["iterations"] == iterations
+
+
+def test_fixed_damping_stalls_when_every_coverage_factor_is_limited(synthetic_system):
+    # Every coverage factor of LL 200 hits max_CF, so the normalization undoes the step and the IFT stops changing
+    input_file = synthetic_system("LL", 200)
+    fixed, _ = run(input_file, "LL", adaptive_damping = False)
+    adaptive, _ = run(input_file, "LL")
+    assert fixed["IFT_tot"] == pytest.approx(20.1709, abs = 1e-3)
+    assert adaptive["IFT_tot"] == pytest.approx(35.4317, abs = 1e-3)
+    restarted, _ = run(input_file, "LL", adaptive_damping = False, initial_guess = adaptive)
+    assert restarted["IFT_tot"] == pytest.approx(adaptive["IFT_tot"], abs = 1e-3)
+
+
+@pytest.mark.parametrize("phase_types, N_compounds", [("LL", 2), ("SL", 50), ("GL", 200)])
+def test_newton_finds_the_damped_solution(synthetic_system, phase_types, N_compounds):
+    input_file = synthetic_system(phase_types, N_compounds)
+    damped, _ = run(input_file, phase_types)
+    newton, _ = run(input_file, phase_types, solver_mode = "newton")
+    assert newton["IFT_tot"] == pytest.approx(damped["IFT_tot"], abs = 1e-3)
+
+
+def test_newton_probes_a_reduced_jacobian_by_default(synthetic_system):
+    input_file = synthetic_system("GL", 200)
+    _, reduced_calls = run(input_file, "GL", solver_mode = "newton")
+    _, full_calls = run(input_file, "GL", solver_mode = "newton", newton_probes = None)
+    assert reduced_calls < full_calls/3
+
+
+@pytest.mark.parametrize("phase_types", ["SL", "GL"])
+def test_newton_saves_wall_time_when_the_probes_run_in_parallel(synthetic_system, phase_types):
+    input_file = synthetic_system(phase_types, 50)
+    results = {}
+    for solver_mode in ["damping", "newton"]:
+        backend = RoundCountingBackend(latency = 0.05, N_cpu = 8)
+        start = time.perf_counter()
+        _, IFT, details = calculate_IFT_tot_and_coverage(input_file, phase_types, "", backend = backend, print_statements = False,
+                                                         save_output_file = False, return_details = True, solver_mode = solver_mode)
+        results[solver_mode] = (IFT, details["iterations"], backend.N_rounds, backend.N_calls, time.perf_counter()-start)
+    damped, newton = results["damping"], results["newton"]
+    assert newton[0] == pytest.approx(damped[0], abs = 1e-3)
+    assert newton[3] > damped[3]  # More solver calls,
+    assert newton[1] < damped[1]*0.7 and newton[2] < damped[2]*0.8  # but fewer iterations and rounds to wait for
+    assert newton[4] < damped[4]
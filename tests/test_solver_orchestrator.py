@@ -0,0 +1,101 @@
+from __future__ import print_function,division
+import os
+import sys
+import time
+import stat
+import pytest
+from solver_orchestrator import ProcessOrchestrator, SolverError, SolverTimeoutError, set_deadline
+from solver_backends import COSMOthermBackend
+
+
+def sleep(seconds):
+    return [sys.executable, "-c", "import time; time.sleep({})".format(seconds)]
+
+
+def exit_with(status):
+    return [sys.executable, "-c", "import sys; sys.exit({})".format(status)]
+
+
+def fail_once(marker_file):
+    """ A command that fails the first time it runs and succeeds after that """
+    return [sys.executable, "-c", "import os, sys; exists = os.path.exists({0!r}); open({0!r}, 'a').close(); sys.exit(0 if exists else 1)".format(marker_file)]
+
+
+@pytest.fixture
+def orchestrators():
+    created = []
+    def make(*args, **kwargs):
+        created.append(ProcessOrchestrator(*args, **kwargs))
+        return created[-1]
+    yield make
+    for orchestrator in created:
+        orchestrator.close()
+
+
+@pytest.fixture
+def deadline():
+    """ Set a deadline for the test and restore the previous one """
+    previous = []
+    def set_in(seconds):
+        previous.append(set_deadline(time.monotonic()+seconds))
+    yield set_in
+    if previous:
+        set_deadline(previous[0])
+
+
+def test_exit_status_and_attempts(orchestrators):
+    result, = orchestrators().run([exit_with(0)])
+    assert result.returncode == 0 and result.attempts == 1 and not result.timed_out
+
+
+def test_non_zero_exit_raises_solver_error(orchestrators):
+    with pytest.raises(SolverError) as error:
+        orchestrators().run([exit_with(3)])
+    assert not isinstance(error.value, SolverTimeoutError)
+    assert error.value.result.returncode == 3
+
+
+def test_hung_process_is_killed_after_the_call_timeout(orchestrators):
+    start = time.monotonic()
+    with pytest.raises(SolverTimeoutError) as error:
+        orchestrators(call_timeout = 0.3).run([sleep(10)])
+    assert time.monotonic()-start < 3.0
+    assert error.value.result.timed_out
+
+
+def test_failed_process_is_retried(orchestrators, tmp_path):
+    marker_file = str(tmp_path / "marker")
+    result, = orchestrators(retries = 1).run([fail_once(marker_file)])
+    assert result.returncode == 0 and result.attempts == 2
+    os.remove(marker_file)
+    with pytest.raises(SolverError):
+        orchestrators(retries = 0).run([fail_once(marker_file)])
+
+
+def test_deadline_kills_the_running_processes(orchestrators, deadline):
+    deadline(0.5)
+    start = time.monotonic()
+    with pytest.raises(SolverTimeoutError):
+        orchestrators().run([sleep(10), sleep(10)])
+    assert time.monotonic()-start < 3.0
+
+
+def test_queued_process_does_not_overshoot_the_deadline(orchestrators, deadline):
+    deadline(1.0)
+    start = time.monotonic()
+    with pytest.raises(SolverTimeoutError):
+        orchestrators(N_concurrent = 1).run([sleep(0.6), sleep(10)])
+    assert time.monotonic()-start < 1.4  # The second process gets what is left after the first, not the full second
+
+
+def test_cosmotherm_backend_raises_for_a_failing_binary(tmp_path):
+    binary = str(tmp_path / "cosmotherm")
+    with open(binary, "w") as file:
+        file.write("#!/bin/sh\nexit 2\n")
+    os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+    backend = COSMOthermBackend(binary)
+    try:
+        with pytest.raises(SolverError):
+            backend.run_lle(str(tmp_path / "system"), 2)
+    finally:
+        backend.close()
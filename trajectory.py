@@ -0,0 +1,158 @@
+from __future__ import print_function,division
+import os
+import sys
+import struct
+import numpy as np
+
+# This document includes the binary trajectory of a calculation: one record per iteration with the coverage, the IFTs and the
+# Gtot and Area of both flatsurf calculations, stored as a .npy record array that np.load can memory map.
+# Run by: python trajectory.py "trajectory_file.npy" ["output_file.txt"] to convert a trajectory to the text output format
+
+_magic = b"\x93NUMPY\x01\x00"
+
+
+def trajectory_dtype(N_compounds):
+    """ The record of one iteration
+
+    Args:
+        N_compounds: The number of compounds in the system as an integer
+
+    Return:
+        dtype: The structured np.dtype
+    """
+    fields = [("iteration", "<i4"), ("coverage", "<f8", (N_compounds,)),
+              ("IFT_A", "<f8"), ("IFT_B", "<f8"), ("IFT_tot", "<f8")]
+    for name in ["GtotAS", "GtotSA", "GtotSB", "GtotBS", "AreaAS", "AreaSA", "AreaSB", "AreaBS"]:
+        fields.append((name, "<f8", (N_compounds,)))
+    return np.dtype(fields)
+
+
+def _header(dtype, N_records, header_size):
+    """ A version 1.0 .npy header padded to header_size bytes """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(np.lib.format.dtype_to_descr(dtype), N_records)
+    N_padding = header_size - len(_magic) - 2 - len(header) - 1
+    if N_padding < 0:
+        raise ValueError("The trajectory header does not fit in {} bytes".format(header_size))
+    header = header + " "*N_padding + "\n"
+    return _magic + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class TrajectoryWriter(object):
+    """ Append iteration records to a .npy trajectory file with buffered writes
+
+    The header is written with room for any record count, so records are appended to the end of the file and only the
+    count in the header is rewritten. Records are kept in a preallocated buffer and written buffer_size at a time and
+    when the writer is closed. The header is updated after the records are written, so the file is always readable.
+
+    Args:
+        file_name: The trajectory file name with extension as a string
+        N_compounds: The number of compounds in the system as an integer
+        buffer_size: The number of records kept in memory before they are written, default = 32
+        resume: Continue an existing trajectory, dropping the records after max_iteration, boolean, default = False
+        max_iteration: The last iteration kept when resuming, default = None keeps all records
+    """
+    def __init__(self, file_name, N_compounds, buffer_size = 32, resume = False, max_iteration = None):
+        self.file_name = file_name
+        self.dtype = trajectory_dtype(N_compounds)
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.N_buffered = 0
+        length = len(_header(self.dtype, 10**15, 1 << 16).rstrip())+1  # Room for any record count
+        self.header_size = -(-length // 64)*64
+        self.N_records = 0
+        if resume and os.path.exists(file_name):
+            records = np.load(file_name, mmap_mode="r")
+            if records.dtype == self.dtype:
+                keep = len(records) if max_iteration is None else int(np.sum(records["iteration"] <= max_iteration))
+                self.header_size = records.offset
+                self.N_records = keep
+                del records
+                with open(file_name, "r+b") as file:
+                    file.truncate(self.header_size + keep*self.dtype.itemsize)
+                    file.seek(0)
+                    file.write(_header(self.dtype, self.N_records, self.header_size))
+                return
+        with open(file_name, "wb") as file:
+            file.write(_header(self.dtype, 0, self.header_size))
+
+    def append(self, **values):
+        """ Add the record of an iteration
+
+        Args:
+            values: The fields of the record, see trajectory_dtype, missing fields are 0
+
+        Return:
+            None
+        """
+        self.buffer[self.N_buffered] = np.zeros((), dtype=self.dtype)
+        for name, value in values.items():
+            self.buffer[name][self.N_buffered] = value
+        self.N_buffered += 1
+        if self.N_buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered records and update the record count in the header
+
+        Return:
+            None
+        """
+        if self.N_buffered == 0:
+            return
+        with open(self.file_name, "r+b") as file:
+            file.seek(self.header_size + self.N_records*self.dtype.itemsize)
+            file.write(self.buffer[:self.N_buffered].tobytes())
+            self.N_records += self.N_buffered
+            file.seek(0)
+            file.write(_header(self.dtype, self.N_records, self.header_size))
+        self.N_buffered = 0
+
+    def close(self):
+        """ Write the remaining records, see flush """
+        self.flush()
+
+
+def read_trajectory(file_name):
+    """ Read a trajectory without loading it into memory
+
+    Args:
+        file_name: The trajectory file name with extension as a string
+
+    Return:
+        records: The iteration records as a memory mapped np.array, e.g. records["IFT_tot"]
+    """
+    return np.load(file_name, mmap_mode="r")
+
+
+def trajectory_to_text(file_name, output_file_name = None):
+    """ Write a trajectory in the text output format of calculate_IFT_tot_and_coverage
+
+    Args:
+        file_name: The trajectory file name with extension as a string
+        output_file_name: The text file name, default = None replaces _trajectory.npy by _output.txt
+
+    Return:
+        output_file_name: The text file name as a string
+    """
+    if output_file_name is None:
+        output_file_name = file_name[:-len("_trajectory.npy")] if file_name.endswith("_trajectory.npy") else os.path.splitext(file_name)[0]
+        output_file_name += "_output.txt"
+    records = read_trajectory(file_name)
+    with open(output_file_name, "w") as output:
+        output.write("".join("Coverage_{}, ".format(i) for i in range(records.dtype["coverage"].shape[0])) + "IFT\n")
+        for record in records:
+            output.write(", ".join(map(str, record["coverage"]))+", {}\n".format(record["IFT_tot"]))
+    return output_file_name
+
+
+def main():
+    try:
+        file_name = sys.argv[1]
+    except IndexError:
+        print("Incorrect inputs, run by: python trajectory.py \"trajectory_file.npy\" [\"output_file.txt\"]")
+        quit()
+    output_file_name = trajectory_to_text(file_name, sys.argv[2] if len(sys.argv) > 2 else None)
+    print("Wrote {}".format(output_file_name))
+
+
+if __name__ == "__main__":
+    main()